@@ -6,13 +6,34 @@
 from . import config
 from . import state
 from . import utils
-from . import map_setup
-from . import ui_manager
-from . import wfs_handler
-from . import feature_manager
-from . import feature_editor
-from . import feature_cutter
-from . import file_operations
-from . import callbacks
+from . import projection
+from . import feature_copy
+from . import map_payload
+from . import feature_store
+from . import feature_index
+from . import vector_tiles
+from . import http_client
+from . import request_scheduler
+from . import response_cache
+from . import capabilities
+from . import gml_stream
+from . import persistence
+from . import local_store
+from . import wfs_client
+from . import core
+
+# Notebook UI. Headless installs without ipyleaflet / leafmap / ipywidgets still get the
+# core API and the CLI (python -m nrw_geotools).
+try:
+    from . import map_setup
+    from . import ui_manager
+    from . import wfs_handler
+    from . import feature_manager
+    from . import feature_editor
+    from . import feature_cutter
+    from . import file_operations
+    from . import callbacks
+except ImportError as e_ui:
+    print(f"nrw_geotools: notebook UI not available ({e_ui}), core API only.")
 
 print("nrw_geotools package loaded.")
\ No newline at end of file
@@ -2,13 +2,18 @@
 from IPython.display import clear_output as ipython_clear_output
 
 # Import core logic functions from other modules
-from .wfs_handler import discover_feature_types, fetch_wfs_data
+from .wfs_handler import discover_feature_types, fetch_wfs_data, cancel_fetch
 from .feature_manager import handle_draw_control_actions # General handler for new features
 from .feature_manager import (
     on_geojson_feature_click_callback_base,
     keep_selected_features,
     clear_selection,
-    remove_selected_features
+    remove_selected_features,
+    start_area_selection,
+    stop_area_selection,
+    handle_area_selection_draw,
+    select_features_by_query,
+    SELECTION_SOURCE_LAYER_PROPERTY
 )
 from .feature_editor import (
     start_edit_selected_feature,
@@ -22,6 +27,8 @@ from .feature_cutter import (
 )
 from .file_operations import save_selected_as_gml
 from . import config as app_config
+from . import feature_index
+from . import feature_store
 from . import state as app_state # For master_on_draw_handler to check state
 
 
@@ -34,6 +41,10 @@ def on_discover_button_clicked(app_context):
 def on_fetch_data_button_clicked(app_context):
     fetch_wfs_data(app_context)
 
+def on_cancel_fetch_button_clicked(app_context):
+    if cancel_fetch(app_context, reason="cancelled by user"):
+        app_context['widgets']['status_output_widget'].append_stdout("Cancelling fetch...\n")
+
 # Feature Management Callbacks
 def master_on_draw_handler(draw_control_instance, action, geo_json, app_context):
     current_app_state = app_context['state']
@@ -59,6 +70,8 @@ def master_on_draw_handler(draw_control_instance, action, geo_json, app_context)
     elif current_app_state.is_cutting_operation_active and current_app_state._cutting_draw_handler_active_flag:
         print("DEBUG master_on_draw: Delegating to _cutting_mode_draw_handler")
         _cutting_mode_draw_handler(draw_control_instance, action, geo_json, app_context)
+    elif current_app_state.is_area_selecting:
+        handle_area_selection_draw(draw_control_instance, action, geo_json, app_context)
     else:
         # Standard drawing of new features
         print("DEBUG master_on_draw: Delegating to handle_draw_control_actions (general new feature)")
@@ -70,6 +83,25 @@ def get_geojson_click_handler(app_context, layer_name_for_handler):
         feature, layer_name_for_handler, kwargs, app_context
     )
 
+# Clicks on the selection overlay deselect the feature in the layer it came from
+def get_selection_overlay_click_handler(app_context):
+    return lambda feature, **kwargs: on_geojson_feature_click_callback_base(
+        feature, feature.get('properties', {}).get(SELECTION_SOURCE_LAYER_PROPERTY), kwargs, app_context
+    )
+
+def on_area_select_toggled(change, app_context):
+    if change['new']:
+        start_area_selection(app_context)
+    else:
+        stop_area_selection(app_context)
+
+def on_query_select_button_clicked(app_context):
+    select_features_by_query(app_context['widgets']['query_select_input'].value, app_context)
+
+def on_map_zoom_changed(change, app_context):
+    # Layers are re-rendered only when the zoom crosses into another LOD band.
+    feature_index.set_display_tolerance(feature_store.display_tolerance_for_zoom(change['new']))
+
 def on_keep_selected_button_clicked(app_context):
     keep_selected_features(app_context)
 
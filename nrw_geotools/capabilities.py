@@ -0,0 +1,118 @@
+# nrw_geotools/capabilities.py
+#
+# WFS GetCapabilities download, parsing and on-disk caching. The parsed summary
+# (feature type names, default/other CRS, WGS84 bounding boxes and GetFeature output
+# formats) is kept as JSON so the feature type dropdown can be filled instantly after
+# a kernel restart; a stale cache is still used and refreshed in the background.
+
+import json
+import os
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+from owslib.wfs import WebFeatureService
+
+from . import config as app_config
+from . import http_client
+
+_NS_OWS = 'http://www.opengis.net/ows/1.1'
+
+
+def _parse_with_owslib(xml_bytes):
+    wfs = WebFeatureService(url=app_config.WFS_CAPABILITIES_URL.split('?')[0], version='2.0.0', xml=xml_bytes)
+    feature_types = {}
+    for name, content in wfs.contents.items():
+        crs_codes = []
+        for crs in (getattr(content, 'crsOptions', None) or []):
+            try:
+                crs_codes.append(crs.getcodeurn())
+            except Exception:
+                crs_codes.append(str(crs))
+        bbox = getattr(content, 'boundingBoxWGS84', None)
+        feature_types[name] = {
+            'default_crs': crs_codes[0] if crs_codes else None,
+            'other_crs': crs_codes[1:],
+            'wgs84_bbox': list(bbox[:4]) if bbox else None,
+        }
+    output_formats = []
+    try:
+        output_formats = list(wfs.getOperationByName('GetFeature').parameters['outputFormat']['values'])
+    except Exception:
+        pass
+    return feature_types, output_formats
+
+
+def _parse_with_elementtree(xml_bytes):
+    root = ET.fromstring(xml_bytes)
+    namespaces = {'wfs': 'http://www.opengis.net/wfs/2.0', 'ows': _NS_OWS}
+    if not root.findall('.//wfs:FeatureType', namespaces):
+        namespaces['wfs'] = 'http://www.opengis.net/wfs'
+    feature_types = {}
+    for ft_node in root.findall('.//wfs:FeatureType', namespaces):
+        name_el = ft_node.find('wfs:Name', namespaces)
+        if name_el is None or not name_el.text:
+            continue
+        default_crs_el = ft_node.find('wfs:DefaultCRS', namespaces)
+        bbox = None
+        lower_el = ft_node.find('ows:WGS84BoundingBox/ows:LowerCorner', namespaces)
+        upper_el = ft_node.find('ows:WGS84BoundingBox/ows:UpperCorner', namespaces)
+        if lower_el is not None and upper_el is not None:
+            try:
+                bbox = [float(v) for v in lower_el.text.split()] + [float(v) for v in upper_el.text.split()]
+            except (AttributeError, ValueError):
+                bbox = None
+        feature_types[name_el.text] = {
+            'default_crs': default_crs_el.text if default_crs_el is not None else None,
+            'other_crs': [el.text for el in ft_node.findall('wfs:OtherCRS', namespaces) if el.text],
+            'wgs84_bbox': bbox,
+        }
+    output_formats = [
+        value_el.text for value_el in root.findall(
+            ".//ows:Operation[@name='GetFeature']/ows:Parameter[@name='outputFormat']//ows:Value", namespaces)
+        if value_el.text
+    ]
+    return feature_types, output_formats
+
+
+def parse_capabilities(xml_bytes, log=print):
+    try:
+        feature_types, output_formats = _parse_with_owslib(xml_bytes)
+    except Exception as e_owslib:
+        log(f"OWSLib discovery failed: {e_owslib}. Trying direct XML parsing...")
+        feature_types, output_formats = _parse_with_elementtree(xml_bytes)
+    return {
+        'url': app_config.WFS_CAPABILITIES_URL,
+        'fetched_at': time.time(),
+        'feature_types': feature_types,
+        'output_formats': output_formats,
+    }
+
+
+def fetch_capabilities(log=print):
+    """Downloads, parses and caches the capabilities. Raises on download or parse errors."""
+    response_caps = http_client.http_get(app_config.WFS_CAPABILITIES_URL, timeout=30)
+    response_caps.raise_for_status()
+    capabilities = parse_capabilities(response_caps.content, log=log)
+    save_cached_capabilities(capabilities)
+    return capabilities
+
+
+def save_cached_capabilities(capabilities):
+    tmp_path = f"{app_config.CAPABILITIES_CACHE_PATH}.{uuid.uuid4().hex}.tmp" # Unique: a notebook and CLI workers may save at once
+    with open(tmp_path, 'w', encoding='utf-8') as f_cache:
+        json.dump(capabilities, f_cache)
+    os.replace(tmp_path, app_config.CAPABILITIES_CACHE_PATH)
+
+
+def load_cached_capabilities():
+    """Returns (capabilities, is_stale); (None, True) when there is no usable cache."""
+    try:
+        with open(app_config.CAPABILITIES_CACHE_PATH, 'r', encoding='utf-8') as f_cache:
+            capabilities = json.load(f_cache)
+    except (OSError, ValueError):
+        return None, True
+    if capabilities.get('url') != app_config.WFS_CAPABILITIES_URL or not capabilities.get('feature_types'):
+        return None, True
+    is_stale = time.time() - capabilities.get('fetched_at', 0) >= app_config.CAPABILITIES_CACHE_TTL_SECONDS
+    return capabilities, is_stale
@@ -0,0 +1,160 @@
+# nrw_geotools/cli.py
+#
+# Batch runner without Jupyter: python -m nrw_geotools --type adv:AX_Gebaeude --bbox ... --aoi ...
+# Every bbox / AOI file is one job; jobs run in a process pool and each writes one file
+# per feature type to --out-dir. AOI jobs fetch the AOI's bounding box and keep only the
+# features intersecting the AOI geometry.
+
+import argparse
+import concurrent.futures
+import os
+import sys
+
+import geopandas as gpd
+import shapely
+import shapely.wkt
+
+from . import config as app_config
+from . import core
+from . import projection
+from . import request_scheduler
+from . import utils
+
+
+def _parse_bbox(value):
+    try:
+        bbox = tuple(float(v) for v in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise argparse.ArgumentTypeError(f"expected minx,miny,maxx,maxy, got '{value}'")
+    return bbox
+
+
+def _parse_where(value):
+    name, sep, expected = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"expected property=value, got '{value}'")
+    return name, expected
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m nrw_geotools",
+        description="Fetch NRW ALKIS WFS features for bboxes / AOI files and export them without Jupyter.",
+    )
+    parser.add_argument('--type', dest='feature_types', action='append', default=[],
+                        help="Feature type to fetch, e.g. adv:AX_Gebaeude (repeatable). --list-types shows all.")
+    parser.add_argument('--bbox', action='append', default=[], type=_parse_bbox,
+                        help="minx,miny,maxx,maxy in --bbox-crs (repeatable, one job each)")
+    parser.add_argument('--bbox-crs', default="EPSG:4326", help="CRS of --bbox values (default: EPSG:4326, lon/lat)")
+    parser.add_argument('--aoi', action='append', default=[],
+                        help="Vector file (GeoJSON, GPKG, shapefile, ...) whose geometries form one job (repeatable)")
+    parser.add_argument('--where', action='append', default=[], type=_parse_where,
+                        help="Keep only features with property=value (repeatable, all must match)")
+    parser.add_argument('--format', choices=('gml', 'geojson'), default='gml',
+                        help="gml: EPSG:25832 like the notebook export; geojson: EPSG:4326")
+    parser.add_argument('--out-dir', default=app_config.GML_OUTPUT_DIR)
+    parser.add_argument('--processes', type=int, default=min(os.cpu_count() or 1, app_config.CLI_DEFAULT_PROCESSES),
+                        help=f"Jobs run in parallel (default: up to {app_config.CLI_DEFAULT_PROCESSES}). "
+                             "The processes share the WFS request rate and concurrency limits.")
+    parser.add_argument('--no-local-store', action='store_true', help="Neither read from nor write to the local store")
+    parser.add_argument('--list-types', action='store_true', help="Print the available feature types and exit")
+    return parser
+
+
+def _load_aoi_job(aoi_path):
+    gdf = projection.reproject_gdf(gpd.read_file(aoi_path), "EPSG:4326")
+    aoi_geom = shapely.union_all(gdf.geometry.values)
+    if aoi_geom is None or aoi_geom.is_empty:
+        raise ValueError(f"AOI file '{aoi_path}' has no geometry")
+    return {
+        'name': os.path.splitext(os.path.basename(aoi_path))[0],
+        'bbox': aoi_geom.bounds,
+        'bbox_crs': "EPSG:4326",
+        'aoi_wkt': aoi_geom.wkt,
+    }
+
+
+def _run_job(job, feature_types, where, output_format, out_dir, use_local_store):
+    """Runs in a worker process. Returns a summary dict; never raises."""
+    summary = {'name': job['name'], 'outputs': {}, 'failures': {}, 'error': None}
+
+    def log(msg):
+        print(f"[{job['name']}] {msg}", flush=True)
+
+    try:
+        features_by_type, failures = core.fetch_features(
+            feature_types, job['bbox'], bbox_crs=job['bbox_crs'], use_local_store=use_local_store, log=log
+        )
+        summary['failures'] = failures
+        aoi_geom = shapely.wkt.loads(job['aoi_wkt']) if job.get('aoi_wkt') else None
+        for ft_fetch, features in features_by_type.items():
+            selected = core.select_features(features, where=where or None, intersects=aoi_geom)
+            if not selected:
+                continue
+            sane_type = utils.sanitize_filename(ft_fetch.replace(':', '_'))
+            out_path = os.path.join(out_dir, f"{utils.sanitize_filename(job['name'])}_{sane_type}.{output_format}")
+            if output_format == 'gml':
+                count = core.export_gml(selected, out_path)
+            else:
+                count = core.export_geojson(selected, out_path)
+            summary['outputs'][out_path] = count
+            log(f"Wrote {count} feature(s) to {out_path}")
+    except Exception as e_job:
+        summary['error'] = f"{type(e_job).__name__}: {e_job}"
+    return summary
+
+
+def main(argv=None):
+    args = _build_parser().parse_args(argv)
+
+    if args.list_types:
+        for type_name in core.discover_feature_types():
+            print(type_name)
+        return 0
+    if not args.feature_types:
+        print("Error: at least one --type is required (see --list-types).", file=sys.stderr)
+        return 2
+
+    jobs = [
+        {'name': f"bbox_{i + 1}", 'bbox': bbox, 'bbox_crs': args.bbox_crs, 'aoi_wkt': None}
+        for i, bbox in enumerate(args.bbox)
+    ]
+    for aoi_path in args.aoi:
+        try:
+            jobs.append(_load_aoi_job(aoi_path))
+        except Exception as e_aoi:
+            print(f"Error reading AOI '{aoi_path}': {e_aoi}", file=sys.stderr)
+            return 2
+    if not jobs:
+        print("Error: give at least one --bbox or --aoi.", file=sys.stderr)
+        return 2
+
+    where = dict(args.where)
+    job_args = (args.feature_types, where, args.format, args.out_dir, not args.no_local_store)
+    processes = max(1, min(args.processes, len(jobs)))
+    if app_config.WFS_SCHEDULER_ENABLED:
+        processes = min(processes, app_config.WFS_MAX_CONCURRENCY) # Each process sends at least one request at a time
+    print(f"Running {len(jobs)} job(s) for {len(args.feature_types)} type(s) in {processes} process(es)...")
+    if processes == 1:
+        summaries = [_run_job(job, *job_args) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, initializer=request_scheduler.share_limits, initargs=(processes,)
+        ) as executor:
+            summaries = list(executor.map(_run_job, jobs, *[[arg] * len(jobs) for arg in job_args]))
+
+    exit_code = 0
+    print("\n--- Summary ---")
+    for summary in summaries:
+        if summary['error']:
+            exit_code = 1
+            print(f"{summary['name']}: ERROR {summary['error']}")
+            continue
+        total = sum(summary['outputs'].values())
+        print(f"{summary['name']}: {total} feature(s) in {len(summary['outputs'])} file(s)")
+        for ft_fetch, reason in summary['failures'].items():
+            exit_code = 1
+            print(f"  - failed {ft_fetch}: {reason}")
+    return exit_code
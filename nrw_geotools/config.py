@@ -10,14 +10,95 @@ DOWNLOAD_DIR = "wfs_downloaded_data"
 GML_OUTPUT_DIR = "gml_output"
 DRAWN_FEATURES_LAYER_NAME = "User Drawn Features"
 MAX_FEATURES_PER_TYPE_FETCH = 50
+WFS_FETCH_MAX_WORKERS = 8 # Worker threads for (feature type, tile) requests; the request scheduler limits how many are in flight
+WFS_PAGING_ENABLED = True # Page through results with STARTINDEX/COUNT instead of one COUNT-limited request
+WFS_PAGE_SIZE = 500
+WFS_MAX_FEATURES_PER_TYPE_PAGED = 20000 # Safety cap per feature type and tile when paging
+WFS_TILE_SIZE_M = 1000 # Request bbox (EPSG:25832) is split into tiles of about this size
+WFS_MAX_TILES_PER_TYPE = 64 # Tiles grow beyond WFS_TILE_SIZE_M for viewports that would need more
+WFS_MIN_TILE_SIZE_M = 125 # Tiles that time out are split in four until they reach this size
+WFS_INCREMENTAL_FETCH = True # Keep WFS layers between fetches and only request viewport area not fetched yet
+WFS_MIN_UNCOVERED_AREA_M2 = 1.0 # Uncovered slivers smaller than this are not requested
+WFS_DUMP_UNREADABLE_GML = False # Write GML responses GDAL cannot parse to DOWNLOAD_DIR/prob_<type>.gml (non-streaming parse only)
+WFS_STREAMING_PARSE = True # Parse GML incrementally while it downloads and show features batch by batch
+WFS_STREAM_BATCH_SIZE = 200 # Features per batch sent to the map when streaming
+WFS_KEEP_PARTIAL_RESULTS = True # Features a cancelled / superseded fetch already added stay on the map (False: removed again)
 
 WFS_CAPABILITIES_URL = "https://www.wfs.nrw.de/geobasis/wfs_nw_alkis_aaa-modell-basiert?SERVICE=WFS&REQUEST=GetCapabilities"
 WFS_GETFEATURE_BASE_URL = "https://www.wfs.nrw.de/geobasis/wfs_nw_alkis_aaa-modell-basiert"
 
+# HTTP client (shared pooled session, see http_client.py)
+HTTP_DEFAULT_TIMEOUT = 60
+HTTP_POOL_CONNECTIONS = 4 # Number of per-host connection pools kept
+HTTP_MAX_CONNECTIONS_PER_HOST = 8
+HTTP_MAX_RETRIES = 4
+HTTP_BACKOFF_FACTOR = 0.5 # Sleeps 0.5s, 1s, 2s, ... between retries
+HTTP_BACKOFF_JITTER = 0.5 # Up to this many random seconds added to each backoff
+HTTP_BACKOFF_MAX = 30
+HTTP_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Request scheduler for WFS GetFeature calls (see request_scheduler.py)
+WFS_SCHEDULER_ENABLED = True
+WFS_RATE_LIMIT_PER_SECOND = 4.0 # Token bucket refill rate
+WFS_RATE_LIMIT_BURST = 8 # Token bucket size: requests that may start back to back
+WFS_INITIAL_CONCURRENCY = 2
+WFS_MAX_CONCURRENCY = 8 # Keep <= HTTP_MAX_CONNECTIONS_PER_HOST
+WFS_LATENCY_SPIKE_FACTOR = 3.0 # A response this many times slower than the running average counts as congestion
+WFS_LATENCY_SPIKE_MIN_SECONDS = 5.0 # ... but only if it also took at least this long
+WFS_BACKOFF_COOLDOWN_SECONDS = 2.0 # Congestion signals within this window halve the concurrency only once
+CLI_DEFAULT_PROCESSES = 4 # Batch runner default (python -m nrw_geotools); its processes share the limits above
+
+# GetFeature response cache (see response_cache.py)
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_DIR = os.path.join(DOWNLOAD_DIR, "response_cache")
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600 # Served without contacting the server while younger than this
+RESPONSE_CACHE_MAX_BYTES = 512 * 1024 * 1024 # Least recently used entries are evicted beyond this size
+RESPONSE_CACHE_RESCAN_WRITES = 200 # Rescan the cache dir after this many writes, for entries other processes added
+
+# Parsed GetCapabilities cache (see capabilities.py)
+CAPABILITIES_CACHE_PATH = os.path.join(DOWNLOAD_DIR, "wfs_capabilities_cache.json")
+CAPABILITIES_CACHE_TTL_SECONDS = 7 * 24 * 3600 # Older caches are still used, but refreshed in the background
+
+# Local feature store: FlatGeobuf files per feature type (see local_store.py)
+LOCAL_STORE_ENABLED = True # Append fetched features to the store and reopen areas it covers without WFS requests
+LOCAL_STORE_DIR = os.path.join(DOWNLOAD_DIR, "local_store")
+LOCAL_STORE_MAX_AGE_SECONDS = 7 * 24 * 3600 # Older parts no longer count as coverage and are dropped on compaction
+LOCAL_STORE_MAX_PARTS = 16 # A feature type's parts are merged into one file beyond this many
+WFS_SAVE_GEOJSON_COPIES = False # Also write a <type>_bbox_<x>_<y>.geojson copy of each fetched layer
+
 SELECTED_STYLE = {'color': 'yellow', 'weight': 3, 'fillColor': 'yellow', 'fillOpacity': 0.7}
 DEFAULT_FEATURE_STYLE = {'color': '#3388ff', 'weight': 2, 'fillOpacity': 0.1, 'opacity': 0.6}
 EDIT_MODE_STYLE = {'color': 'lime', 'weight': 4, 'fillColor': 'lime', 'fillOpacity': 0.5, 'dashArray': '8, 8', 'clickable': True}
 HIDDEN_STYLE = {'opacity': 0, 'fillOpacity': 0, 'weight': 0, 'stroke': False, 'fill': False, 'clickable': False}
+# "overlay": selected features are drawn on a separate small layer on top, so a click only
+# sends that layer (size of the selection) to the browser. "inline": the selected feature is
+# restyled inside its own layer, which re-sends the whole layer on every click.
+SELECTION_RENDER_MODE = "overlay"
+# Level of detail: while zoomed out to at most the band's zoom level, layers with at least
+# LOD_MIN_FEATURES features are sent to the browser with geometries simplified to the band's
+# tolerance in metres (topology-preserving, per geometry). Selection, edit, cut and export
+# always use the full-resolution geometry.
+LOD_ENABLED = True
+LOD_MIN_FEATURES = 200
+LOD_ZOOM_BANDS = ((12, 5.0), (14, 1.5), (16, 0.4)) # (up to zoom level, tolerance in metres), ascending
+# Map payload (see map_payload.py): coordinates sent to the map are rounded to this many
+# decimals of a degree (7: about 1 cm) and only the listed properties are sent, i.e. what
+# the feature styles and click handlers use. None sends coordinates / properties unchanged.
+MAP_COORDINATE_DECIMALS = 7
+MAP_CLIENT_PROPERTIES = ('_temp_id', 'style', '_selection_source_layer')
+# Vector tiles (see vector_tiles.py, needs mapbox_vector_tile): WFS layers with at least
+# VECTOR_TILE_MIN_FEATURES features are cut into Mapbox Vector Tiles in the kernel and served
+# to the map from a local HTTP endpoint instead of being sent as GeoJSON. The browser then
+# only holds the tiles in view. Without mapbox_vector_tile, layers stay GeoJSON.
+VECTOR_TILES_ENABLED = True
+VECTOR_TILE_MIN_FEATURES = 20000
+VECTOR_TILE_HOST = "127.0.0.1"
+VECTOR_TILE_PORT = 0 # 0: any free port
+VECTOR_TILE_PUBLIC_URL = None # URL the browser reaches the endpoint at (e.g. behind jupyter-server-proxy); None: http://host:port
+VECTOR_TILE_CACHE_SIZE = 512 # Encoded tiles kept per layer
+AREA_SELECT_ALL_LAYERS = "__all__" # Layer dropdown value: every WFS layer and the drawn features layer
+AREA_SELECT_SHAPE_STYLE = {'color': 'orange', 'weight': 2, 'fillOpacity': 0.1, 'dashArray': '4, 4', 'clickable': False}
+SELECTION_OVERLAY_LAYER_NAME = "Selection"
 
 FETCH_ALL_BUTTON_LABEL = "Fetch ALL Discovered WFS Features"
 
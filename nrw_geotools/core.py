@@ -0,0 +1,212 @@
+# nrw_geotools/core.py
+#
+# Headless API: discover, fetch by bbox and types, select, cut and export without a map,
+# widgets or Jupyter. Features are plain GeoJSON feature dicts in EPSG:4326, the same
+# objects the notebook layers hold. Progress goes through a log callable (default print).
+
+import os
+import uuid
+
+import geopandas as gpd
+import shapely.geometry
+import shapely.ops
+import shapely.prepared
+
+from . import config as app_config
+from . import capabilities as wfs_capabilities
+from . import feature_store
+from . import local_store
+from . import persistence
+from . import projection
+from . import request_scheduler
+from . import wfs_client
+
+
+def discover_feature_types(use_cache=True, log=print):
+    """Names of the WFS feature types; a fresh capabilities cache is used unless use_cache is False."""
+    if use_cache:
+        cached_capabilities, is_stale = wfs_capabilities.load_cached_capabilities()
+        if cached_capabilities is not None and not is_stale:
+            return list(cached_capabilities['feature_types'].keys())
+    return list(wfs_capabilities.fetch_capabilities(log=log)['feature_types'].keys())
+
+
+def to_request_bbox(bbox, bbox_crs="EPSG:4326"):
+    """EPSG:25832 bounds of bbox, given as (minx, miny, maxx, maxy) in bbox_crs (x = easting / longitude)."""
+    area = projection.reproject_geometries([shapely.geometry.box(*bbox)], bbox_crs, "EPSG:25832")[0]
+    return area.bounds
+
+
+def fetch_features(feature_types, bbox, bbox_crs="EPSG:4326", use_local_store=None, log=print, job=None):
+    """
+    Fetches feature_types within bbox, tiled and in parallel like the notebook does, with the
+    local store answering the area it covers (use_local_store defaults to LOCAL_STORE_ENABLED).
+    Returns (features_by_type, failures): {type: [feature, ...]} with each gml:id once, and
+    {type: reason} for types with at least one failed tile (their other features are kept).
+    job (a wfs_client.FetchJob) lets another thread cancel the fetch; what arrived so far is returned.
+    """
+    request_bbox = to_request_bbox(bbox, bbox_crs)
+    srs_name_req = wfs_client.SRS_NAME_25832
+    tiles = wfs_client.plan_tiles(request_bbox)
+    tiles_by_type = {ft_fetch: list(tiles) for ft_fetch in feature_types}
+    if use_local_store is None:
+        use_local_store = app_config.LOCAL_STORE_ENABLED
+
+    features_by_type = {ft_fetch: [] for ft_fetch in feature_types}
+    seen_ids_by_type = {ft_fetch: set() for ft_fetch in feature_types}
+    failures = {}
+
+    def add_features(ft_fetch, features):
+        seen_ids = seen_ids_by_type[ft_fetch]
+        for feature_dict_item in features:
+            feature_id = wfs_client.feature_identity(feature_dict_item)
+            if feature_id is not None:
+                if feature_id in seen_ids:
+                    continue
+                seen_ids.add(feature_id)
+            features_by_type[ft_fetch].append(feature_dict_item)
+
+    if use_local_store:
+        store_results_by_type, store_errors = wfs_client.take_from_local_store(tiles_by_type, request_bbox, srs_name_req)
+        for ft_fetch, e_store in store_errors.items():
+            log(f"Warn: Local store read failed for {ft_fetch}: {e_store}")
+        for ft_fetch, (store_features, _) in store_results_by_type.items():
+            add_features(ft_fetch, wfs_client.tag_features_for_display(store_features))
+            log(f"From local store: {ft_fetch}, {len(store_features)} features")
+
+    total_tiles = sum(len(type_tiles) for type_tiles in tiles_by_type.values())
+    if total_tiles:
+        log(f"Fetching {sum(1 for t in tiles_by_type.values() if t)} type(s) in {total_tiles} tile request(s)...")
+    fetched_features_by_type = {ft_fetch: [] for ft_fetch in feature_types}
+    fetched_area_by_type = {}
+    for kind, ft_fetch, payload in wfs_client.iter_fetch_events(tiles_by_type, srs_name_req, job=job):
+        if kind == 'page':
+            fetched_features_by_type[ft_fetch].extend(payload)
+            add_features(ft_fetch, payload)
+        elif kind == 'error':
+            failures.setdefault(ft_fetch, payload)
+        elif kind == 'tile_done' and payload['ok']:
+            tile_area = shapely.geometry.box(*payload['bbox'])
+            fetched_area = fetched_area_by_type.get(ft_fetch)
+            fetched_area_by_type[ft_fetch] = tile_area if fetched_area is None else fetched_area.union(tile_area)
+        elif kind == 'type_done':
+            log(f"{'Failed' if ft_fetch in failures else 'Done'}: {ft_fetch}, {len(features_by_type[ft_fetch])} features")
+            if use_local_store and ft_fetch in fetched_area_by_type:
+                try:
+                    local_store.append_features(ft_fetch, fetched_features_by_type.pop(ft_fetch), fetched_area_by_type[ft_fetch],
+                                                wfs_client.store_params_key(srs_name_req))
+                except Exception as e_store:
+                    log(f"Warn: Local store write failed for {ft_fetch}: {e_store}")
+    if total_tiles and app_config.WFS_SCHEDULER_ENABLED:
+        log(request_scheduler.format_stats(request_scheduler.get_scheduler().stats()))
+    return features_by_type, failures
+
+
+def select_features(features, predicate=None, where=None, intersects=None):
+    """
+    Features matching all given conditions: predicate(feature) is true, every where
+    {property: value} matches (numbers as numbers, see feature_store.property_matches) and
+    the geometry intersects the shapely geometry intersects (EPSG:4326).
+    """
+    if intersects is not None:
+        intersects = shapely.prepared.prep(intersects)
+    selected = []
+    for feature_dict_item in features:
+        properties = feature_dict_item['properties']
+        if where and not all(feature_store.property_matches(properties.get(name), value) for name, value in where.items()):
+            continue
+        if intersects is not None:
+            if not feature_dict_item.get('geometry') or not intersects.intersects(shapely.geometry.shape(feature_dict_item['geometry'])):
+                continue
+        if predicate is not None and not predicate(feature_dict_item):
+            continue
+        selected.append(feature_dict_item)
+    return selected
+
+
+def split_polygon_feature(feature_dict, cutter_geom, target_geom=None):
+    """
+    Splits a (Multi)Polygon feature by a line geometry. Returns the new part features (copied
+    properties, new '_temp_id', default style), [] if the line leaves no valid part, or None
+    if the feature's geometry is invalid / empty even after buffer(0). target_geom is the
+    feature's shapely geometry if the caller already has it.
+    """
+    if target_geom is None:
+        target_geom = shapely.geometry.shape(feature_dict['geometry'])
+    if not target_geom.is_valid:
+        target_geom = target_geom.buffer(0) # Try to fix
+    if not target_geom.is_valid or target_geom.is_empty:
+        return None
+
+    # Property values are shared with the original feature (copy-on-write, see feature_copy).
+    properties_for_parts = {k: v for k, v in feature_dict['properties'].items() if k != 'style'} # New parts get default style
+    split_geometries = shapely.ops.split(target_geom, cutter_geom)
+    parts = []
+    for part_geom in getattr(split_geometries, 'geoms', []):
+        if part_geom.is_empty or not part_geom.is_valid:
+            continue
+        if part_geom.area < 1e-9: # Filter out sliver polygons
+            continue
+        parts.append({
+            'type': 'Feature',
+            'geometry': shapely.geometry.mapping(part_geom),
+            'properties': {
+                **properties_for_parts,
+                '_temp_id': str(uuid.uuid4()), # New ID for the new part
+                'style': dict(app_config.DEFAULT_FEATURE_STYLE)
+            }
+        })
+    return parts
+
+
+def cut_features(features, cutting_line):
+    """
+    Returns features with every (Multi)Polygon the line (shapely geometry, EPSG:4326)
+    splits into two or more parts replaced by those parts, plus the number of features cut.
+    Other features are kept as they are.
+    """
+    result, cut_count = [], 0
+    for feature_dict_item in features:
+        geom_type = (feature_dict_item.get('geometry') or {}).get('type', '').lower()
+        parts = None
+        if 'polygon' in geom_type:
+            try:
+                parts = split_polygon_feature(feature_dict_item, cutting_line)
+            except Exception:
+                parts = None
+        if parts and len(parts) > 1:
+            result.extend(parts)
+            cut_count += 1
+        else:
+            result.append(feature_dict_item)
+    return result, cut_count
+
+
+def _features_to_gdf(features, target_crs):
+    gdf = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+    if 'style' in gdf.columns:
+        gdf = gdf.drop(columns=['style'])
+    return projection.reproject_gdf(gdf, target_crs)
+
+
+def export_gml(features, path, target_crs="EPSG:25832"):
+    """
+    Writes features (GeoJSON dicts, or a GeoDataFrame e.g. from FeatureStore.to_geodataframe)
+    to a GML file in target_crs (without the display 'style'). Returns the count.
+    """
+    if isinstance(features, gpd.GeoDataFrame):
+        gdf = projection.reproject_gdf(features.drop(columns=['style'], errors='ignore'), target_crs)
+    else:
+        gdf = _features_to_gdf(features, target_crs)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    gdf.to_file(path, driver="GML")
+    return len(gdf)
+
+
+def export_geojson(features, path):
+    """Writes features as a GeoJSON FeatureCollection (EPSG:4326, without the display 'style'). Returns the count."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    persistence.write_geojson(path, [
+        {**f, 'properties': {k: v for k, v in f['properties'].items() if k != 'style'}} for f in features
+    ])
+    return len(features)
@@ -0,0 +1,28 @@
+# nrw_geotools/feature_copy.py
+#
+# Copy-on-write handling of GeoJSON feature dicts. Features on the map layers, in the
+# selection state and in the edit / cut bookkeeping are never changed in place: a change
+# makes a new feature dict with a new 'properties' dict, and everything else (geometry,
+# property values) stays shared with the old one. Copying a feature therefore costs the
+# same for a point and for a polygon with thousands of vertices.
+# Rule for callers: never assign into a feature's dicts or lists; use the helpers below.
+
+
+def with_properties(feature_dict, **updates):
+    """A new feature like feature_dict with the given properties set; geometry is shared."""
+    return {**feature_dict, 'properties': {**(feature_dict.get('properties') or {}), **updates}}
+
+
+def with_style(feature_dict, style):
+    """A new feature like feature_dict with properties['style'] = a copy of style; geometry is shared."""
+    return with_properties(feature_dict, style=dict(style))
+
+
+def with_geometry(feature_dict, geometry):
+    """A new feature like feature_dict with another geometry; properties are copied one level."""
+    return {**feature_dict, 'geometry': geometry, 'properties': dict(feature_dict.get('properties') or {})}
+
+
+def style_of(feature_dict, default_style):
+    """A copy of the feature's style, or of default_style if it has none."""
+    return dict((feature_dict.get('properties') or {}).get('style') or default_style)
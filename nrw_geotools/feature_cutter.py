@@ -2,16 +2,19 @@
 
 import copy
 import shapely.geometry
-import shapely.ops
-import uuid
 from IPython.display import clear_output as ipython_clear_output
 import ipyleaflet
 
 # Import from within the package
 from . import config as app_config
 from . import state as app_state
-from .ui_manager import update_all_button_states
+from . import core
+from . import feature_copy
+from . import feature_index
+from .ui_manager import update_all_button_states, ui_operation
+from .feature_manager import sync_selection_overlay
 
+@ui_operation
 def _perform_actual_cut_logic(cutting_line_geojson_feature, app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -45,11 +48,19 @@ def _perform_actual_cut_logic(cutting_line_geojson_feature, app_context):
     all_newly_created_split_features_by_layer = {}
     successfully_cut_ids_by_layer = {layer_name: set() for layer_name in app_state.selected_features_by_layer.keys()}
 
+    # The layers' stores give the targets' shapely geometries, and their STRtrees tell which
+    # targets the line's bounding box reaches at all; the others are not split.
+    stores_by_layer, reachable_ids_by_layer = {}, {}
+    for layer_name in {info['layer_name'] for info in app_state.features_to_be_cut_info}:
+        layer_obj = m.find_layer(layer_name)
+        if layer_obj and isinstance(layer_obj, ipyleaflet.GeoJSON):
+            stores_by_layer[layer_name] = feature_index.store_of(layer_obj)
+            reachable_ids_by_layer[layer_name] = set(stores_by_layer[layer_name].query(cutter_geom, predicate=None))
 
     for target_info in app_state.features_to_be_cut_info:
         target_layer_name = target_info['layer_name']
         target_id = target_info['_temp_id']
-        target_feature_dict = target_info['feature_dict'] # This is a deepcopy
+        target_feature_dict = target_info['feature_dict'] # Shared with the layer, never changed in place
         # print(f"DEBUG: Processing target feature ID: {target_id} from layer: {target_layer_name}")
 
         # Initialize layer in results if not present
@@ -57,54 +68,29 @@ def _perform_actual_cut_logic(cutting_line_geojson_feature, app_context):
             all_newly_created_split_features_by_layer[target_layer_name] = []
 
         original_pre_selection_style = app_state.original_styles_by_layer.get(target_layer_name, {}).get(
-                                        target_id, copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE))
+                                        target_id, app_config.DEFAULT_FEATURE_STYLE)
 
+        target_store = stores_by_layer.get(target_layer_name)
         try:
-            target_geom = shapely.geometry.shape(target_feature_dict['geometry'])
-            if not target_geom.is_valid:
-                target_geom = target_geom.buffer(0) # Try to fix
-
-            if not target_geom.is_valid or target_geom.is_empty:
+            if target_store is not None and target_id in target_store and target_id not in reachable_ids_by_layer[target_layer_name]:
+                new_parts = [] # The line does not come near it
+            else:
+                new_parts = core.split_polygon_feature(
+                    target_feature_dict, cutter_geom, target_store.geometry(target_id) if target_store is not None else None
+                )
+            if new_parts is None:
                 print(f"  Skipping invalid/empty geometry for feature {target_id}. It will be kept as is.")
-                feature_to_keep = copy.deepcopy(target_feature_dict)
-                feature_to_keep['properties']['style'] = original_pre_selection_style
+                feature_to_keep = feature_copy.with_style(target_feature_dict, original_pre_selection_style)
                 all_newly_created_split_features_by_layer[target_layer_name].append(feature_to_keep)
                 continue
 
-            properties_for_parts = copy.deepcopy(target_feature_dict['properties'])
-            properties_for_parts.pop('style', None) # New parts get default style
-            
-            split_geometries = shapely.ops.split(target_geom, cutter_geom)
-            # print(f"DEBUG: split_geometries for {target_id}: {type(split_geometries)}")
-            # if hasattr(split_geometries, 'geoms'):
-            #     print(f"DEBUG: Number of geoms in split: {len(split_geometries.geoms)}")
-
-            num_parts_created = 0
-            if hasattr(split_geometries, 'geoms') and split_geometries.geoms: # A GeometryCollection
-                for part_geom in split_geometries.geoms:
-                    # print(f"DEBUG: Part for {target_id} - Valid: {part_geom.is_valid}, Empty: {part_geom.is_empty}, Type: {part_geom.geom_type}")
-                    if part_geom.is_empty or not part_geom.is_valid:
-                        continue
-                    if part_geom.area < 1e-9: # Filter out sliver polygons (adjust threshold if needed)
-                        # print(f"DEBUG: Skipping sliver polygon for {target_id}. Area: {part_geom.area}")
-                        continue
-                    num_parts_created += 1
-                    new_split_feature = {
-                        'type': 'Feature',
-                        'geometry': shapely.geometry.mapping(part_geom),
-                        'properties': {
-                            **copy.deepcopy(properties_for_parts),
-                            '_temp_id': str(uuid.uuid4()), # New ID for the new part
-                            'style': copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE)
-                        }
-                    }
-                    all_newly_created_split_features_by_layer[target_layer_name].append(new_split_feature)
-            
+            all_newly_created_split_features_by_layer[target_layer_name].extend(new_parts)
+            num_parts_created = len(new_parts)
+
             # print(f"DEBUG: num_parts_created for {target_id}: {num_parts_created}")
             if num_parts_created == 0: # Original was not split or resulted in no valid parts (e.g. only slivers)
                 print(f"  Feature {target_id} was not split by the line or resulted in no valid parts. It will be kept as is.")
-                feature_to_keep_unsplit = copy.deepcopy(target_feature_dict)
-                feature_to_keep_unsplit['properties']['style'] = original_pre_selection_style
+                feature_to_keep_unsplit = feature_copy.with_style(target_feature_dict, original_pre_selection_style)
                 all_newly_created_split_features_by_layer[target_layer_name].append(feature_to_keep_unsplit)
             elif num_parts_created > 0:
                 print(f"  Feature {target_id} from layer '{target_layer_name}' cut into {num_parts_created} part(s).")
@@ -113,8 +99,7 @@ def _perform_actual_cut_logic(cutting_line_geojson_feature, app_context):
 
         except Exception as e_split:
             print(f"  Error during split operation for feature {target_id}: {e_split}. Keeping original.")
-            feature_to_keep_on_error = copy.deepcopy(target_feature_dict)
-            feature_to_keep_on_error['properties']['style'] = original_pre_selection_style
+            feature_to_keep_on_error = feature_copy.with_style(target_feature_dict, original_pre_selection_style)
             all_newly_created_split_features_by_layer[target_layer_name].append(feature_to_keep_on_error)
     
     # print(f"DEBUG: all_newly_created_split_features_by_layer before map update: { {k: len(v) for k,v in all_newly_created_split_features_by_layer.items()} }")
@@ -123,25 +108,16 @@ def _perform_actual_cut_logic(cutting_line_geojson_feature, app_context):
     for layer_name_update, new_or_preserved_features in all_newly_created_split_features_by_layer.items():
         target_layer_obj_update = m.find_layer(layer_name_update)
         if target_layer_obj_update and isinstance(target_layer_obj_update, ipyleaflet.GeoJSON):
-            current_features_on_map_data = list(target_layer_obj_update.data.get('features', []))
-            
             # IDs of original features that were targeted for cutting in this specific layer
             ids_of_originals_targeted_in_this_layer = {
                 info['_temp_id'] for info in app_state.features_to_be_cut_info 
                 if info['layer_name'] == layer_name_update
             }
             
-            # Filter out the original features that were targeted
-            features_to_retain_from_original_layer = [
-                f for f in current_features_on_map_data
-                if f['properties'].get('_temp_id') not in ids_of_originals_targeted_in_this_layer
-            ]
-            
-            # Combine retained features with new/preserved ones
-            final_features_for_layer = features_to_retain_from_original_layer + new_or_preserved_features
-            # print(f"DEBUG: Updating layer {layer_name_update} with {len(final_features_for_layer)} features.")
-            
-            target_layer_obj_update.data = {"type": "FeatureCollection", "features": final_features_for_layer}
+            # Replace the targeted originals by the new/preserved features
+            with app_state.wfs_layer_lock:
+                feature_index.remove_features(target_layer_obj_update, ids_of_originals_targeted_in_this_layer)
+                feature_index.append_features(target_layer_obj_update, new_or_preserved_features)
         elif target_layer_obj_update:
             print(f"  Warning: Layer {layer_name_update} found but is not a GeoJSON layer. Type: {type(target_layer_obj_update)}")
         else:
@@ -159,6 +135,7 @@ def _perform_actual_cut_logic(cutting_line_geojson_feature, app_context):
                 del app_state.selected_features_by_layer[layer_name]
                 if layer_name in app_state.original_styles_by_layer:
                      del app_state.original_styles_by_layer[layer_name]
+    sync_selection_overlay(app_context)
 
 
     # Reset state and draw tools as cutting is now complete
@@ -187,6 +164,7 @@ def _perform_actual_cut_logic(cutting_line_geojson_feature, app_context):
 
 
 # This is called BY the master_on_draw_handler when appropriate (cutting mode active)
+@ui_operation
 def _cutting_mode_draw_handler(control_instance, action, geo_json, app_context):
     widgets = app_context['widgets']
     editing_status_output_widget = widgets['editing_status_output_widget']
@@ -219,6 +197,7 @@ def _cutting_mode_draw_handler(control_instance, action, geo_json, app_context):
             print("Cut mode still active. Draw a new line or click 'Cancel Cut Op'.")
         control_instance.clear() # Clear any partial drawing from draw_control's temp layer
 
+@ui_operation
 def start_cut_selected_features(app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -235,11 +214,7 @@ def start_cut_selected_features(app_context):
         layer_obj = m.find_layer(layer_name_sel)
         if layer_obj and isinstance(layer_obj, ipyleaflet.GeoJSON):
             for temp_id_sel in sel_ids_in_layer.keys():
-                feature_to_check = None
-                for f_on_map in layer_obj.data.get('features', []):
-                    if f_on_map['properties'].get('_temp_id') == temp_id_sel:
-                        feature_to_check = f_on_map
-                        break
+                feature_to_check = feature_index.find_feature(layer_obj, temp_id_sel)
                 
                 if feature_to_check:
                     geom_type = feature_to_check.get('geometry', {}).get('type', '').lower()
@@ -247,7 +222,7 @@ def start_cut_selected_features(app_context):
                         app_state.features_to_be_cut_info.append({
                             'layer_name': layer_name_sel,
                             '_temp_id': temp_id_sel,
-                            'feature_dict': copy.deepcopy(feature_to_check)
+                            'feature_dict': feature_to_check
                         })
                         has_polygons_to_cut = True
                     # else: # Optional: message for non-polygons
@@ -287,6 +262,7 @@ def start_cut_selected_features(app_context):
     update_all_button_states(app_context)
 
 
+@ui_operation
 def cancel_cut_operation(app_context): # This is the function imported by callbacks.py
     m = app_context['m']
     widgets = app_context['widgets']
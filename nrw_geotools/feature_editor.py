@@ -1,14 +1,17 @@
 # nrw_geotools/feature_editor.py
 
-import copy
 from IPython.display import clear_output as ipython_clear_output
 import ipyleaflet # For isinstance checks
 
 # Import from within the package
 from . import config as app_config
 from . import state as app_state
-from .ui_manager import update_all_button_states
+from . import feature_copy
+from . import feature_index
+from .ui_manager import update_all_button_states, ui_operation
+from .feature_manager import sync_selection_overlay
 
+@ui_operation
 def start_edit_selected_feature(app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -24,14 +27,13 @@ def start_edit_selected_feature(app_context):
                 temp_id = list(features_in_layer.keys())[0]
                 layer_obj_check = m.find_layer(layer_name) # Check layer type here
                 if layer_obj_check and isinstance(layer_obj_check, ipyleaflet.GeoJSON):
-                    for f_on_map in layer_obj_check.data['features']:
-                        if f_on_map['properties'].get('_temp_id') == temp_id:
-                            feature_to_edit_info = {
-                                'layer_name': layer_name,
-                                '_temp_id': temp_id,
-                                'feature_dict_on_map': copy.deepcopy(f_on_map)
-                            }
-                            break 
+                    f_on_map = feature_index.find_feature(layer_obj_check, temp_id)
+                    if f_on_map is not None:
+                        feature_to_edit_info = {
+                            'layer_name': layer_name,
+                            '_temp_id': temp_id,
+                            'feature_dict_on_map': f_on_map
+                        }
                 if feature_to_edit_info and feature_to_edit_info.get('layer_name') == layer_name:
                     break
             elif len(features_in_layer) > 1: # More than one selected in a layer
@@ -51,31 +53,24 @@ def start_edit_selected_feature(app_context):
     app_state.feature_being_edited_info = {
         'layer_name': feature_to_edit_info['layer_name'],
         '_temp_id': feature_to_edit_info['_temp_id'],
-        'original_feature_dict': copy.deepcopy(feature_to_edit_info['feature_dict_on_map']),
+        'original_feature_dict': feature_to_edit_info['feature_dict_on_map'], # Shared, never changed in place
     }
 
-    feature_for_draw_control = copy.deepcopy(feature_to_edit_info['feature_dict_on_map'])
-    feature_for_draw_control['properties']['style'] = copy.deepcopy(app_config.EDIT_MODE_STYLE)
+    feature_for_draw_control = feature_copy.with_style(feature_to_edit_info['feature_dict_on_map'], app_config.EDIT_MODE_STYLE)
 
     m.draw_control.clear()
     m.draw_control.data = [feature_for_draw_control]
 
     source_layer_obj = m.find_layer(feature_to_edit_info['layer_name'])
     if source_layer_obj and isinstance(source_layer_obj, ipyleaflet.GeoJSON): # Explicit check
-        source_layer_data_features = list(source_layer_obj.data.get('features', []))
-        found_in_source = False
-        for i, f_dict in enumerate(source_layer_data_features):
-            if f_dict['properties'].get('_temp_id') == feature_to_edit_info['_temp_id']:
-                hidden_f_dict = copy.deepcopy(f_dict)
-                hidden_f_dict['properties']['style'] = copy.deepcopy(app_config.HIDDEN_STYLE)
-                source_layer_data_features[i] = hidden_f_dict
-                found_in_source = True
-                break
-        if found_in_source:
-            source_layer_obj.data = {"type": "FeatureCollection", "features": source_layer_data_features}
+        f_dict = feature_index.find_feature(source_layer_obj, feature_to_edit_info['_temp_id'])
+        if f_dict is not None:
+            hidden_f_dict = feature_copy.with_style(f_dict, app_config.HIDDEN_STYLE)
+            feature_index.replace_features(source_layer_obj, {feature_to_edit_info['_temp_id']: hidden_f_dict})
         # else: warning already handled if feature_to_edit_info couldn't be built
     elif source_layer_obj:
         print(f"Warning: Source layer {feature_to_edit_info['layer_name']} is not a GeoJSON layer, cannot hide feature.")
+    sync_selection_overlay(app_context) # Hides its highlight while it is edited
 
 
     with editing_status_output_widget:
@@ -86,6 +81,7 @@ def start_edit_selected_feature(app_context):
     update_all_button_states(app_context)
 
 
+@ui_operation
 def apply_feature_edits(app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -107,26 +103,19 @@ def apply_feature_edits(app_context):
     target_layer_obj = m.find_layer(original_info['layer_name'])
 
     if target_layer_obj and isinstance(target_layer_obj, ipyleaflet.GeoJSON): # Explicit check
-        target_layer_data_features = list(target_layer_obj.data.get('features', []))
-        found_and_updated = False
-        for i, f_dict_target in enumerate(target_layer_data_features):
-            if f_dict_target['properties'].get('_temp_id') == original_info['_temp_id']:
-                final_updated_feature = copy.deepcopy(original_info['original_feature_dict'])
-                final_updated_feature['geometry'] = edited_geometry_on_map
-                final_updated_feature['properties']['style'] = copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE)
-                target_layer_data_features[i] = final_updated_feature
-                
-                if original_info['layer_name'] in app_state.selected_features_by_layer and \
-                   original_info['_temp_id'] in app_state.selected_features_by_layer[original_info['layer_name']]:
-                    del app_state.selected_features_by_layer[original_info['layer_name']][original_info['_temp_id']]
-                if original_info['layer_name'] in app_state.original_styles_by_layer and \
-                   original_info['_temp_id'] in app_state.original_styles_by_layer[original_info['layer_name']]:
-                    del app_state.original_styles_by_layer[original_info['layer_name']][original_info['_temp_id']]
-                found_and_updated = True
-                break
+        final_updated_feature = feature_copy.with_style(
+            feature_copy.with_geometry(original_info['original_feature_dict'], edited_geometry_on_map),
+            app_config.DEFAULT_FEATURE_STYLE
+        )
+        found_and_updated = feature_index.replace_features(target_layer_obj, {original_info['_temp_id']: final_updated_feature}) > 0
         
         if found_and_updated:
-            target_layer_obj.data = {"type": "FeatureCollection", "features": target_layer_data_features}
+            if original_info['layer_name'] in app_state.selected_features_by_layer and \
+               original_info['_temp_id'] in app_state.selected_features_by_layer[original_info['layer_name']]:
+                del app_state.selected_features_by_layer[original_info['layer_name']][original_info['_temp_id']]
+            if original_info['layer_name'] in app_state.original_styles_by_layer and \
+               original_info['_temp_id'] in app_state.original_styles_by_layer[original_info['layer_name']]:
+                del app_state.original_styles_by_layer[original_info['layer_name']][original_info['_temp_id']]
             with editing_status_output_widget:
                 ipython_clear_output(wait=True)
                 print(f"Applied geometry changes to feature {original_info['_temp_id']} in layer '{original_info['layer_name']}'.")
@@ -146,9 +135,11 @@ def apply_feature_edits(app_context):
     m.draw_control.clear()
     app_state.is_editing_feature = False
     app_state.feature_being_edited_info = None
+    sync_selection_overlay(app_context)
     update_all_button_states(app_context)
 
 
+@ui_operation
 def cancel_feature_edits(app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -161,21 +152,11 @@ def cancel_feature_edits(app_context):
     target_layer_obj = m.find_layer(original_info['layer_name'])
 
     if target_layer_obj and isinstance(target_layer_obj, ipyleaflet.GeoJSON): # Explicit check
-        target_layer_data_features = list(target_layer_obj.data.get('features', []))
-        found_and_restored = False
-        for i, f_dict in enumerate(target_layer_data_features):
-            if f_dict['properties'].get('_temp_id') == original_info['_temp_id']:
-                feature_to_restore = copy.deepcopy(original_info['original_feature_dict'])
-                original_pre_selection_style = app_state.original_styles_by_layer.get(original_info['layer_name'], {}).get(original_info['_temp_id'])
-                if original_pre_selection_style:
-                     feature_to_restore['properties']['style'] = copy.deepcopy(original_pre_selection_style)
-                else:
-                     feature_to_restore['properties']['style'] = copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE)
-                target_layer_data_features[i] = feature_to_restore
-                found_and_restored = True
-                break
-        if found_and_restored:
-            target_layer_obj.data = {"type": "FeatureCollection", "features": target_layer_data_features}
+        original_pre_selection_style = app_state.original_styles_by_layer.get(original_info['layer_name'], {}).get(original_info['_temp_id'])
+        feature_to_restore = feature_copy.with_style(
+            original_info['original_feature_dict'], original_pre_selection_style or app_config.DEFAULT_FEATURE_STYLE
+        )
+        feature_index.replace_features(target_layer_obj, {original_info['_temp_id']: feature_to_restore})
         # else: Warning about not finding feature
 
     elif target_layer_obj:
@@ -189,6 +170,7 @@ def cancel_feature_edits(app_context):
     m.draw_control.clear()
     app_state.is_editing_feature = False
     app_state.feature_being_edited_info = None
+    sync_selection_overlay(app_context)
     
     if widgets: 
         with editing_status_output_widget:
@@ -0,0 +1,204 @@
+# nrw_geotools/feature_index.py
+#
+# Binds a FeatureStore (see feature_store.py) to every GeoJSON layer: the store is the
+# source of truth for the layer's features, and layer.data is its rendered view (compact
+# copies of the features, see map_payload, simplified for the current zoom band, see
+# set_display_tolerance). All layer changes go through the helpers below, which
+# derive the new store (keeping the _temp_id index and shapely geometries of untouched
+# features) and render it to the layer in one update. If a layer's data is replaced some
+# other way, its store is rebuilt from that data on next use. A layer bound to a tile source
+# (vector_tiles.TileSource, see bind_tile_source) renders nothing while the source draws it
+# from vector tiles. Inside hold_layer_updates, the holding thread's renders wait until the
+# hold ends, so an operation that changes a layer several times sends it once; other
+# threads (a background fetch) keep rendering. Works on anything with a GeoJSON
+# FeatureCollection in .data, no widgets imported here.
+
+import contextlib
+import threading
+import weakref
+
+from . import config as app_config
+from . import map_payload
+from .feature_store import FeatureStore
+
+_lock = threading.RLock()
+_stores = weakref.WeakKeyDictionary() # layer -> (FeatureStore, features list rendered to the layer)
+_tile_sources = weakref.WeakKeyDictionary() # layer -> vector_tiles.TileSource
+_display_tolerance = None # Degrees; None renders full resolution
+_holds = threading.local() # .depth: hold_layer_updates nesting of the thread; .layers: layers it left pending
+_pending = {} # layer -> store not rendered yet, while a thread holds updates
+
+
+def _features(layer):
+    return layer.data.get('features', [])
+
+
+def _is_tiled(layer, store):
+    tile_source = _tile_sources.get(layer)
+    return tile_source is not None and tile_source.publish(store)
+
+
+def _render(layer, store):
+    if _is_tiled(layer, store):
+        return [] # Drawn by the tile source; the GeoJSON layer sends no features
+    if _display_tolerance is None or len(store) < app_config.LOD_MIN_FEATURES:
+        return store.display_features()
+    return store.display_features(_display_tolerance)
+
+
+def _store_locked(layer):
+    if layer in _pending:
+        return _pending[layer]
+    features = _features(layer)
+    entry = _stores.get(layer)
+    if entry is None or entry[1] is not features:
+        entry = (FeatureStore(features), features)
+        _stores[layer] = entry
+    return entry[0]
+
+
+def _assign_locked(layer, store):
+    if getattr(_holds, 'depth', 0):
+        _pending[layer] = store
+        _holds.layers.add(layer)
+        return
+    # A store derives from the pending one (see _store_locked), so it carries the held changes along.
+    _pending.pop(layer, None)
+    rendered = _render(layer, store)
+    layer.data = {"type": "FeatureCollection", "features": rendered}
+    _stores[layer] = (store, rendered)
+
+
+@contextlib.contextmanager
+def hold_layer_updates():
+    """
+    Defers the calling thread's layer renders until its outermost hold ends: however often a
+    layer changes in between, it gets one layer.data assignment. Reads on every thread see
+    the pending stores; other threads' changes are built on them and rendered right away.
+    """
+    with _lock:
+        if not getattr(_holds, 'depth', 0):
+            _holds.depth = 0
+            _holds.layers = set()
+        _holds.depth += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _holds.depth -= 1
+            if not _holds.depth:
+                layers, _holds.layers = _holds.layers, set()
+                for layer in layers:
+                    store = _pending.pop(layer, None)
+                    if store is not None: # Else rendered by another thread meanwhile
+                        _assign_locked(layer, store)
+
+
+def store_of(layer):
+    """The layer's FeatureStore, full resolution (a snapshot: later layer changes produce a new store)."""
+    with _lock:
+        return _store_locked(layer)
+
+
+def set_display_tolerance(tolerance):
+    """
+    Sets the LOD simplification tolerance (degrees, None for full resolution) and re-renders
+    the bound layers whose view changes. Simplified geometries are cached per tolerance.
+    """
+    global _display_tolerance
+    with _lock:
+        if tolerance == _display_tolerance:
+            return
+        _display_tolerance = tolerance
+        for layer, (store, rendered) in list(_stores.items()):
+            if layer in _pending or rendered is not _features(layer) or _is_tiled(layer, store):
+                continue # Rendered when the hold ends, replaced from outside (rebuilt on next use), or drawn from tiles
+            if _render(layer, store) is not rendered:
+                _assign_locked(layer, store)
+
+
+def bind_tile_source(layer, tile_source):
+    """
+    Lets tile_source draw the layer: every store of the layer is published to it, and while
+    tile_source.publish(store) returns True the layer's own data stays empty.
+    """
+    with _lock:
+        store = _store_locked(layer)
+        _tile_sources[layer] = tile_source
+        _assign_locked(layer, store)
+
+
+def position_of(layer, temp_id):
+    """Position of the feature with temp_id in the layer's store, or None."""
+    with _lock:
+        return _store_locked(layer).position_of(temp_id)
+
+
+def find_feature(layer, temp_id):
+    """The full-resolution feature dict with temp_id on the layer (not a copy), or None."""
+    with _lock:
+        return _store_locked(layer).feature(temp_id)
+
+
+def features_by_ids(layer, temp_ids):
+    """The layer's features for temp_ids, in temp_ids order; ids not on the layer are skipped."""
+    with _lock:
+        return _store_locked(layer).features_by_ids(temp_ids)
+
+
+def all_features(layer):
+    """All full-resolution features of the layer (the store's list; do not modify)."""
+    with _lock:
+        return _store_locked(layer).features
+
+
+def payload_sizes(layer):
+    """
+    (bytes, full_bytes): size of the layer's data as sent to the map, and of its features with
+    full coordinates and all properties, both as JSON text, as measured when the data was
+    rendered. None while an update is held back, and for tiled, empty or unknown layers.
+    """
+    with _lock:
+        if layer in _pending or layer not in _stores:
+            return None
+        store, rendered = _stores[layer]
+    if not rendered:
+        return None
+    return store.payload_sizes(rendered)
+
+
+def set_features(layer, features):
+    """Replaces all features of the layer."""
+    with _lock:
+        _assign_locked(layer, _store_locked(layer).with_features(features))
+
+
+def append_features(layer, new_features):
+    """Adds new_features at the end of the layer; existing positions stay valid."""
+    with _lock:
+        _assign_locked(layer, _store_locked(layer).appended(new_features))
+
+
+def replace_features(layer, replacements):
+    """
+    Puts replacements ({_temp_id: feature dict}) in place of the features with those ids,
+    in one layer update. Ids not on the layer are ignored. Returns the number replaced.
+    """
+    with _lock:
+        store = _store_locked(layer)
+        new_store = store.replaced(replacements)
+        if new_store is None:
+            return 0
+        _assign_locked(layer, new_store)
+        return sum(1 for temp_id in replacements if temp_id in store)
+
+
+def remove_features(layer, temp_ids):
+    """Removes the features with temp_ids from the layer in one update. Returns the number removed."""
+    with _lock:
+        store = _store_locked(layer)
+        new_store = store.removed(temp_ids)
+        if new_store is None:
+            return 0
+        _assign_locked(layer, new_store)
+        return len(store) - len(new_store)
@@ -1,15 +1,81 @@
 import ipyleaflet
 import uuid
-import copy
 import os
-import geopandas as gpd # For saving kept features
+import shapely.geometry
 
 from . import config as app_config
 from . import state as app_state
-from .ui_manager import update_all_button_states
+from . import persistence
+from . import feature_copy
+from . import feature_index
+from .ui_manager import update_all_button_states, ui_operation
 from IPython.display import clear_output as ipython_clear_output
 
+SELECTION_SOURCE_LAYER_PROPERTY = '_selection_source_layer' # On overlay features: name of the layer they are selected in
+
+
+def _forget_wfs_coverage(layer_name):
+    # Features were deleted from this WFS layer, so the area fetched for it no longer holds
+    # everything the WFS has there: the next fetch requests the viewport again.
+    for coverage_key in list(app_state.wfs_coverage_by_key):
+        if f"WFS: {coverage_key[0].split(':')[-1]}" == layer_name:
+            app_state.wfs_coverage_by_key.pop(coverage_key, None)
+
+
+def _selection_overlay_enabled():
+    return app_config.SELECTION_RENDER_MODE == "overlay"
+
+
+def _get_selection_overlay(app_context):
+    """The selection overlay layer, created on first use and kept above all other layers."""
+    m = app_context['m']
+    overlay = app_state.selection_overlay_layer
+    if overlay is None or overlay not in m.layers:
+        from .map_setup import initialize_selection_overlay_layer_on_map # Lazy import
+        from .callbacks import get_selection_overlay_click_handler # Lazy import for click handler
+        overlay = initialize_selection_overlay_layer_on_map(m, get_selection_overlay_click_handler(app_context))
+    if m.layers[-1] is not overlay: # Layers added later (new WFS types) would cover it and take its clicks
+        m.remove_layer(overlay)
+        m.add_layer(overlay)
+    return overlay
+
+
+def _overlay_feature(feature_dict, layer_name):
+    # Shares geometry and properties with the layer's feature; only the top-level dicts are new.
+    properties = dict(feature_dict['properties'])
+    properties['style'] = app_config.SELECTED_STYLE
+    properties[SELECTION_SOURCE_LAYER_PROPERTY] = layer_name
+    return {**feature_dict, 'properties': properties}
+
+
+def sync_selection_overlay(app_context):
+    """
+    Redraws the selection overlay from app_state.selected_features_by_layer, e.g. after keep,
+    clear, remove, edit or cut changed the selection. The feature being edited is left out.
+    Costs one overlay update sized by the selection; the feature layers are not touched.
+    """
+    if not _selection_overlay_enabled():
+        return
+    m = app_context['m']
+    editing_temp_id = (app_state.feature_being_edited_info or {}).get('_temp_id') if app_state.is_editing_feature else None
+    overlay_features = []
+    with app_state.wfs_layer_lock:
+        for layer_name, sel_dict in app_state.selected_features_by_layer.items():
+            if not sel_dict:
+                continue
+            layer_obj = m.find_layer(layer_name)
+            if not layer_obj or not isinstance(layer_obj, ipyleaflet.GeoJSON):
+                continue
+            for feature_dict in feature_index.features_by_ids(layer_obj, sel_dict.keys()):
+                if feature_dict['properties']['_temp_id'] != editing_temp_id:
+                    overlay_features.append(_overlay_feature(feature_dict, layer_name))
+        if not overlay_features and app_state.selection_overlay_layer is None:
+            return
+        feature_index.set_features(_get_selection_overlay(app_context), overlay_features)
+
+
 # This is the base function that will be wrapped by lambdas for specific layers
+@ui_operation
 def on_geojson_feature_click_callback_base(feature, layer_name, event_details, app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -36,40 +102,42 @@ def on_geojson_feature_click_callback_base(feature, layer_name, event_details, a
             print(f"Error: Could not find GeoJSON layer '{layer_name}'.")
         return
 
-    current_layer_features_list = list(layer_object.data.get('features', []))
-    target_feature_from_data = None
-    target_feature_index = -1
-    for i, f_in_data in enumerate(current_layer_features_list):
-        if isinstance(f_in_data, dict) and 'properties' in f_in_data and \
-           isinstance(f_in_data['properties'], dict) and f_in_data['properties'].get('_temp_id') == event_temp_id:
-            target_feature_from_data = f_in_data
-            target_feature_index = i
-            break
-    
-    if not target_feature_from_data:
-        with status_output_widget:
-            print(f"Warn: No feature with _temp_id {event_temp_id} in {layer_name} data. Map object might be out of sync.")
-        return
+    with app_state.wfs_layer_lock: # A background fetch may replace the layer data at the same time
+        target_feature_from_data = feature_index.find_feature(layer_object, event_temp_id)
+        if not target_feature_from_data:
+            with status_output_widget:
+                print(f"Warn: No feature with _temp_id {event_temp_id} in {layer_name} data. Map object might be out of sync.")
+            return
 
-    if layer_name not in app_state.selected_features_by_layer:
-        app_state.selected_features_by_layer[layer_name] = {}
-        app_state.original_styles_by_layer[layer_name] = {}
+        if layer_name not in app_state.selected_features_by_layer:
+            app_state.selected_features_by_layer[layer_name] = {}
+            app_state.original_styles_by_layer[layer_name] = {}
 
-    modified_feature_for_update = copy.deepcopy(target_feature_from_data)
-    if event_temp_id in app_state.selected_features_by_layer[layer_name]:
-        del app_state.selected_features_by_layer[layer_name][event_temp_id]
-        original_style = app_state.original_styles_by_layer[layer_name].pop(event_temp_id, copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE))
-        modified_feature_for_update['properties']['style'] = original_style
-    else:
-        app_state.selected_features_by_layer[layer_name][event_temp_id] = copy.deepcopy(target_feature_from_data)
-        app_state.original_styles_by_layer[layer_name][event_temp_id] = copy.deepcopy(target_feature_from_data['properties'].get('style', copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE)))
-        modified_feature_for_update['properties']['style'] = copy.deepcopy(app_config.SELECTED_STYLE)
-    
-    current_layer_features_list[target_feature_index] = modified_feature_for_update
-    layer_object.data = {"type": "FeatureCollection", "features": current_layer_features_list} # This triggers map update
+        is_deselect = event_temp_id in app_state.selected_features_by_layer[layer_name]
+        if is_deselect:
+            del app_state.selected_features_by_layer[layer_name][event_temp_id]
+            original_style = app_state.original_styles_by_layer[layer_name].pop(event_temp_id, app_config.DEFAULT_FEATURE_STYLE)
+        else:
+            # Layer features are never changed in place (see feature_copy), so no copy is needed.
+            app_state.selected_features_by_layer[layer_name][event_temp_id] = target_feature_from_data
+            app_state.original_styles_by_layer[layer_name][event_temp_id] = feature_copy.style_of(target_feature_from_data, app_config.DEFAULT_FEATURE_STYLE)
+
+        if _selection_overlay_enabled():
+            # Only the overlay changes; the (possibly large) feature layer is not re-sent.
+            overlay = _get_selection_overlay(app_context)
+            if is_deselect:
+                feature_index.remove_features(overlay, [event_temp_id])
+            else:
+                feature_index.append_features(overlay, [_overlay_feature(target_feature_from_data, layer_name)])
+        else:
+            modified_feature_for_update = feature_copy.with_style(
+                target_feature_from_data, original_style if is_deselect else app_config.SELECTED_STYLE
+            )
+            feature_index.replace_features(layer_object, {event_temp_id: modified_feature_for_update}) # This triggers map update
     update_all_button_states(app_context)
 
 
+@ui_operation
 def handle_draw_control_actions(draw_control_instance, action, geo_json, app_context):
     # m = app_context['m'] # Not directly used, but app_state.drawn_features_layer is
     widgets = app_context['widgets']
@@ -98,23 +166,16 @@ def handle_draw_control_actions(draw_control_instance, action, geo_json, app_con
                 print("CRITICAL ERROR: drawn_features_layer is None after re-initialization attempt!")
                 return
 
-        new_feature = copy.deepcopy(geo_json)
-        new_feature['properties'] = new_feature.get('properties', {})
-        new_feature['properties']['_temp_id'] = str(uuid.uuid4())
-        new_feature['properties']['style'] = copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE)
-        
-        updated_features_list = list(app_state.drawn_features_layer.data.get('features', []))
-        updated_features_list.append(new_feature)
+        new_feature = feature_copy.with_properties(
+            geo_json, _temp_id=str(uuid.uuid4()), style=dict(app_config.DEFAULT_FEATURE_STYLE)
+        )
         
-        app_state.drawn_features_layer.data = {
-            "type": "FeatureCollection",
-            "features": updated_features_list
-        }
+        feature_index.append_features(app_state.drawn_features_layer, [new_feature])
         
         draw_control_instance.clear() # Clear the drawing from the draw_control's temporary layer
         
         with status_output_widget:
-            print(f"Feature with _temp_id {new_feature['properties']['_temp_id']} added to '{app_config.DRAWN_FEATURES_LAYER_NAME}'. Layer now has {len(updated_features_list)} features.")
+            print(f"Feature with _temp_id {new_feature['properties']['_temp_id']} added to '{app_config.DRAWN_FEATURES_LAYER_NAME}'. Layer now has {len(feature_index.all_features(app_state.drawn_features_layer))} features.")
         update_all_button_states(app_context)
 
     elif action == 'edited':
@@ -128,6 +189,192 @@ def handle_draw_control_actions(draw_control_instance, action, geo_json, app_con
         draw_control_instance.clear()
 
 
+def _feature_layer_names(m):
+    return [
+        name for name in m.get_layer_names()
+        if name.startswith("WFS:") or name == app_config.DRAWN_FEATURES_LAYER_NAME
+    ]
+
+
+def _area_select_target_layers(app_context):
+    m = app_context['m']
+    chosen_layer_name = app_context['widgets']['area_select_layer_dropdown'].value
+    layers = [
+        m.find_layer(name) for name in _feature_layer_names(m)
+        if chosen_layer_name == app_config.AREA_SELECT_ALL_LAYERS or name == chosen_layer_name
+    ]
+    return [layer_obj for layer_obj in layers if isinstance(layer_obj, ipyleaflet.GeoJSON)]
+
+
+def _set_draw_tools(m, shape_options, polyline):
+    m.draw_control.polyline = {'shapeOptions': shape_options} if polyline else {}
+    m.draw_control.polygon = {'shapeOptions': shape_options}
+    m.draw_control.rectangle = {'shapeOptions': shape_options}
+    m.draw_control.circle = {'shapeOptions': shape_options} if polyline else {}
+    m.draw_control.circlemarker = {'shapeOptions': shape_options} if polyline else {}
+    m.draw_control.marker = {}
+
+
+def _add_to_selection(app_context, temp_ids_by_layer):
+    """
+    Selects the features {layer: [_temp_id, ...]} that are not selected yet, with one overlay
+    update for all of them (or one update per layer in "inline" mode). Returns how many
+    were added. Call with app_state.wfs_layer_lock held.
+    """
+    newly_selected = 0
+    overlay_features = []
+    for layer_obj, temp_ids in temp_ids_by_layer.items():
+        layer_selection = app_state.selected_features_by_layer.setdefault(layer_obj.name, {})
+        layer_original_styles = app_state.original_styles_by_layer.setdefault(layer_obj.name, {})
+        restyled_features = {}
+        for feature_dict in feature_index.features_by_ids(layer_obj, temp_ids):
+            temp_id = feature_dict['properties']['_temp_id']
+            if temp_id in layer_selection:
+                continue
+            layer_selection[temp_id] = feature_dict
+            layer_original_styles[temp_id] = feature_copy.style_of(feature_dict, app_config.DEFAULT_FEATURE_STYLE)
+            if _selection_overlay_enabled():
+                overlay_features.append(_overlay_feature(feature_dict, layer_obj.name))
+            else:
+                restyled_features[temp_id] = feature_copy.with_style(feature_dict, app_config.SELECTED_STYLE)
+            newly_selected += 1
+        if restyled_features:
+            feature_index.replace_features(layer_obj, restyled_features)
+    if overlay_features:
+        feature_index.append_features(_get_selection_overlay(app_context), overlay_features)
+    return newly_selected
+
+
+@ui_operation
+def start_area_selection(app_context):
+    m = app_context['m']
+    widgets = app_context['widgets']
+    status_output_widget = widgets['status_output_widget']
+
+    layer_dropdown = widgets['area_select_layer_dropdown']
+    layer_names = _feature_layer_names(m)
+    previous_choice = layer_dropdown.value
+    layer_dropdown.options = [('All feature layers', app_config.AREA_SELECT_ALL_LAYERS)] + [(name, name) for name in layer_names]
+    layer_dropdown.value = previous_choice if previous_choice in layer_names else app_config.AREA_SELECT_ALL_LAYERS
+
+    app_state.is_area_selecting = True
+    m.draw_control.clear()
+    _set_draw_tools(m, dict(app_config.AREA_SELECT_SHAPE_STYLE), polyline=False)
+
+    # Build the layers' STRtrees now rather than on the first drawn shape.
+    for layer_obj in _area_select_target_layers(app_context):
+        feature_index.store_of(layer_obj).tree()
+
+    with status_output_widget:
+        ipython_clear_output(wait=True)
+        print("AREA SELECTION: draw a rectangle or polygon on the map; the features it hits are added to the selection.")
+        print("Click 'Select by Area' again when done.")
+    update_all_button_states(app_context)
+
+
+@ui_operation
+def stop_area_selection(app_context):
+    m = app_context['m']
+    app_state.is_area_selecting = False
+    m.draw_control.clear()
+    default_shape_options = dict(app_config.DEFAULT_FEATURE_STYLE)
+    default_shape_options.setdefault('clickable', True)
+    _set_draw_tools(m, default_shape_options, polyline=True)
+    update_all_button_states(app_context)
+
+
+@ui_operation
+def select_features_in_area(area_geojson, app_context):
+    """
+    Adds every feature of the target layers that the drawn area hits (predicate from the
+    dropdown) to the selection. Candidates come from each layer's STRtree; the highlight
+    is one overlay update (or one update per layer in "inline" mode).
+    """
+    m = app_context['m']
+    widgets = app_context['widgets']
+    status_output_widget = widgets['status_output_widget']
+
+    try:
+        area_geom = shapely.geometry.shape(area_geojson['geometry'])
+        if not area_geom.is_valid:
+            area_geom = area_geom.buffer(0) # Self-intersecting lasso
+    except Exception as e_area:
+        with status_output_widget:
+            print(f"Error: Could not read the drawn area: {e_area}")
+        m.draw_control.clear()
+        return
+
+    predicate = widgets['area_select_predicate_dropdown'].value
+    with app_state.wfs_layer_lock:
+        newly_selected = _add_to_selection(app_context, {
+            layer_obj: feature_index.store_of(layer_obj).query(area_geom, predicate=predicate)
+            for layer_obj in _area_select_target_layers(app_context)
+        })
+
+    m.draw_control.clear() # The area itself is not kept
+    total_selected = sum(len(sel_dict) for sel_dict in app_state.selected_features_by_layer.values())
+    with status_output_widget:
+        print(f"Area selection: {newly_selected} feature(s) added, {total_selected} selected in total.")
+    update_all_button_states(app_context)
+
+
+@ui_operation
+def handle_area_selection_draw(draw_control_instance, action, geo_json, app_context):
+    if action != 'created':
+        return
+    if geo_json.get('geometry', {}).get('type') in ('Polygon', 'MultiPolygon'):
+        select_features_in_area(geo_json, app_context)
+    else:
+        with app_context['widgets']['status_output_widget']:
+            print("Area selection needs a rectangle or polygon.")
+        draw_control_instance.clear()
+
+
+@ui_operation
+def select_features_by_query(expression, app_context):
+    """
+    Adds the features of every WFS layer and the drawn features layer whose properties match
+    a pandas query expression (see FeatureStore.query_properties) to the selection. Layers
+    without a column the expression uses are skipped. Returns the number of features added.
+    """
+    m = app_context['m']
+    widgets = app_context['widgets']
+    status_output_widget = widgets['status_output_widget']
+
+    expression = (expression or '').strip()
+    with status_output_widget:
+        ipython_clear_output(wait=True)
+        if not expression:
+            print("Enter a query, e.g. gebaeudefunktion == 2000 or gml_id.str.startswith('DENW05')")
+            return 0
+
+        matches_by_layer, errors_by_layer = {}, {}
+        with app_state.wfs_layer_lock:
+            for layer_name in _feature_layer_names(m):
+                layer_obj = m.find_layer(layer_name)
+                if not isinstance(layer_obj, ipyleaflet.GeoJSON) or not feature_index.all_features(layer_obj):
+                    continue
+                try:
+                    matches_by_layer[layer_obj] = feature_index.store_of(layer_obj).query_properties(expression)
+                except Exception as e_query:
+                    errors_by_layer[layer_name] = e_query
+            newly_selected = _add_to_selection(app_context, matches_by_layer)
+
+        if errors_by_layer and not matches_by_layer:
+            e_query = next(iter(errors_by_layer.values()))
+            print(f"Error in query: {type(e_query).__name__}: {e_query}")
+        else:
+            matched = sum(len(temp_ids) for temp_ids in matches_by_layer.values())
+            total_selected = sum(len(sel_dict) for sel_dict in app_state.selected_features_by_layer.values())
+            print(f"Query matched {matched} feature(s) in {len(matches_by_layer)} layer(s); "
+                  f"{newly_selected} added, {total_selected} selected in total.")
+            for layer_name, e_query in errors_by_layer.items():
+                print(f"  Skipped '{layer_name}': {type(e_query).__name__}: {e_query}")
+    update_all_button_states(app_context)
+    return newly_selected
+
+
+@ui_operation
 def keep_selected_features(app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -138,10 +385,8 @@ def keep_selected_features(app_context):
         print("Processing 'Keep Selected'...")
         kept_any = False
         layers_to_remove_objs = []
-        current_relevant_layer_names = [
-            name for name in m.get_layer_names() 
-            if name.startswith("WFS:") or name == app_config.DRAWN_FEATURES_LAYER_NAME
-        ]
+        kept_geojson_jobs = {}
+        current_relevant_layer_names = _feature_layer_names(m)
 
         for lname_iter in current_relevant_layer_names:
             layer_obj_iter = m.find_layer(lname_iter)
@@ -150,36 +395,25 @@ def keep_selected_features(app_context):
 
             if lname_iter in app_state.selected_features_by_layer and app_state.selected_features_by_layer[lname_iter]:
                 kept_feats_this_layer = []
-                for temp_id_kept, _ in app_state.selected_features_by_layer[lname_iter].items():
-                    current_feature_on_map = None
-                    for f_map in layer_obj_iter.data['features']: # Iterate through features currently on map
-                        if f_map['properties'].get('_temp_id') == temp_id_kept:
-                            current_feature_on_map = copy.deepcopy(f_map)
-                            break
-                    if current_feature_on_map:
-                        # Revert to original style before selection, or default if not found
-                        original_style_for_this_feature = app_state.original_styles_by_layer[lname_iter].get(
-                            temp_id_kept, copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE)
-                        )
-                        current_feature_on_map['properties']['style'] = original_style_for_this_feature
-                        kept_feats_this_layer.append(current_feature_on_map)
+                selected_on_map = feature_index.features_by_ids(layer_obj_iter, app_state.selected_features_by_layer[lname_iter].keys())
+                for f_map in selected_on_map:
+                    # Revert to original style before selection, or default if not found
+                    original_style_for_this_feature = app_state.original_styles_by_layer[lname_iter].get(
+                        f_map['properties']['_temp_id'], app_config.DEFAULT_FEATURE_STYLE
+                    )
+                    kept_feats_this_layer.append(feature_copy.with_style(f_map, original_style_for_this_feature))
                 
-                layer_obj_iter.data = {"type": "FeatureCollection", "features": kept_feats_this_layer}
+                feature_index.set_features(layer_obj_iter, kept_feats_this_layer)
                 
                 if lname_iter.startswith("WFS:"):
+                    _forget_wfs_coverage(lname_iter)
                     sane_kept_name = lname_iter.replace('WFS: ', '').replace(':', '_').replace('/', '_')
                     bbox_fname_part = (
                         f"bbox_{app_state.min_x_25832_fname_global:.0f}_{app_state.min_y_25832_fname_global:.0f}"
                         if app_state.min_x_25832_fname_global is not None else "filtered"
                     )
                     kept_fpath = os.path.join(app_config.DOWNLOAD_DIR, f"kept_{sane_kept_name}_{bbox_fname_part}.geojson")
-                    try:
-                        gpd.GeoDataFrame.from_features(kept_feats_this_layer, crs="EPSG:4326").to_file(
-                            kept_fpath, driver="GeoJSON", encoding='utf-8'
-                        )
-                        print(f"  Saved kept WFS for {lname_iter} to {kept_fpath}")
-                    except Exception as e_sk:
-                        print(f"  Warn: Save kept WFS fail for {lname_iter}: {e_sk}")
+                    kept_geojson_jobs[kept_fpath] = kept_feats_this_layer
                 else: # Drawn features layer
                      print(f"  Kept selected features in '{lname_iter}'.")
                 kept_any = True
@@ -198,9 +432,21 @@ def keep_selected_features(app_context):
         print("Kept selected features and updated layers." if kept_any else "No features selected; WFS layers with no selections cleared.")
         app_state.selected_features_by_layer.clear()
         app_state.original_styles_by_layer.clear()
+        sync_selection_overlay(app_context)
+        if kept_geojson_jobs:
+            print(f"Writing {len(kept_geojson_jobs)} kept GeoJSON file(s) in the background...")
+
+    def report_kept_saved(saved_paths, failures):
+        for path in saved_paths:
+            status_output_widget.append_stdout(f"  Saved kept WFS features to {path}\n")
+        for path, e_sk in failures.items():
+            status_output_widget.append_stdout(f"  Warn: Save kept WFS fail for {os.path.basename(path)}: {e_sk}\n")
+
+    persistence.save_geojson_async(kept_geojson_jobs, on_done=report_kept_saved)
     update_all_button_states(app_context)
 
 
+@ui_operation
 def clear_selection(app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -214,36 +460,36 @@ def clear_selection(app_context):
             return
 
         changed_any_layer = False
-        for lname_clear, sel_ids_in_layer_clear in app_state.selected_features_by_layer.items():
-            if not sel_ids_in_layer_clear:
-                continue
+        with app_state.wfs_layer_lock:
+            for lname_clear, sel_ids_in_layer_clear in app_state.selected_features_by_layer.items():
+                if not sel_ids_in_layer_clear:
+                    continue
+                if _selection_overlay_enabled(): # Styles in the layer were never changed
+                    changed_any_layer = True
+                    continue
             
-            layer_obj_clear = m.find_layer(lname_clear)
-            if layer_obj_clear and isinstance(layer_obj_clear, ipyleaflet.GeoJSON):
-                new_data_features_list = list(layer_obj_clear.data['features']) # Make a mutable copy
-                changed_in_this_layer = False
-                for i_feat_clear, f_in_l_clear in enumerate(new_data_features_list):
-                    temp_id_clear = f_in_l_clear['properties'].get('_temp_id')
-                    if temp_id_clear and temp_id_clear in sel_ids_in_layer_clear:
+                layer_obj_clear = m.find_layer(lname_clear)
+                if layer_obj_clear and isinstance(layer_obj_clear, ipyleaflet.GeoJSON):
+                    reverted_features = {}
+                    for f_in_l_clear in feature_index.features_by_ids(layer_obj_clear, sel_ids_in_layer_clear.keys()):
+                        temp_id_clear = f_in_l_clear['properties']['_temp_id']
                         # Revert to the style stored when it was selected
                         original_style_to_revert = app_state.original_styles_by_layer[lname_clear].get(
-                            temp_id_clear, copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE)
+                            temp_id_clear, app_config.DEFAULT_FEATURE_STYLE
                         )
-                        reverted_feature_dict = copy.deepcopy(f_in_l_clear)
-                        reverted_feature_dict['properties']['style'] = original_style_to_revert
-                        new_data_features_list[i_feat_clear] = reverted_feature_dict
-                        changed_in_this_layer = True
+                        reverted_features[temp_id_clear] = feature_copy.with_style(f_in_l_clear, original_style_to_revert)
                 
-                if changed_in_this_layer:
-                    layer_obj_clear.data = {"type": "FeatureCollection", "features": new_data_features_list}
-                    changed_any_layer = True
+                    if feature_index.replace_features(layer_obj_clear, reverted_features):
+                        changed_any_layer = True
         
         app_state.selected_features_by_layer.clear()
         app_state.original_styles_by_layer.clear()
+        sync_selection_overlay(app_context)
         print("Selection cleared and styles reverted." if changed_any_layer else "No effective selections to clear.")
     update_all_button_states(app_context)
 
 
+@ui_operation
 def remove_selected_features(app_context):
     m = app_context['m']
     widgets = app_context['widgets']
@@ -260,7 +506,7 @@ def remove_selected_features(app_context):
         affected_layers = set()
         
         # Iterate over a copy because we are modifying app_state.selected_features_by_layer implicitly later by clearing it
-        selected_features_copy = copy.deepcopy(app_state.selected_features_by_layer)
+        selected_features_copy = {layer_name: dict(sel_dict) for layer_name, sel_dict in app_state.selected_features_by_layer.items()}
 
         for layer_name, sel_ids_in_layer in selected_features_copy.items():
             if not sel_ids_in_layer:
@@ -268,25 +514,20 @@ def remove_selected_features(app_context):
             
             layer_obj = m.find_layer(layer_name)
             if layer_obj and isinstance(layer_obj, ipyleaflet.GeoJSON):
-                current_features_on_map = list(layer_obj.data.get('features', []))
-                ids_to_remove_this_layer = set(sel_ids_in_layer.keys())
-                
-                new_features_for_layer = [
-                    f for f in current_features_on_map 
-                    if f['properties'].get('_temp_id') not in ids_to_remove_this_layer
-                ]
+                removed_count_this_layer = feature_index.remove_features(layer_obj, sel_ids_in_layer.keys())
                 
-                if len(new_features_for_layer) < len(current_features_on_map):
-                    layer_obj.data = {"type": "FeatureCollection", "features": new_features_for_layer}
-                    removed_count_this_layer = len(current_features_on_map) - len(new_features_for_layer)
+                if removed_count_this_layer:
                     removed_count += removed_count_this_layer
                     affected_layers.add(layer_name)
+                    if layer_name.startswith("WFS:"):
+                        _forget_wfs_coverage(layer_name)
                     print(f"  Removed {removed_count_this_layer} feature(s) from layer '{layer_name}'.")
             else:
                 print(f"  Warning: Layer '{layer_name}' not found or not GeoJSON, cannot remove features.")
         
         app_state.selected_features_by_layer.clear()
         app_state.original_styles_by_layer.clear()
+        sync_selection_overlay(app_context)
         
         if removed_count > 0:
             print(f"Total {removed_count} selected feature(s) removed from the map.")
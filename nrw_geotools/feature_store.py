@@ -0,0 +1,344 @@
+# nrw_geotools/feature_store.py
+#
+# FeatureStore: the features of one map layer. It holds the GeoJSON feature dicts the
+# layer renders, a _temp_id -> position index, and, built on first use, an array of
+# shapely geometries with an STRtree over it for spatial queries and vectorized exports,
+# and a pandas DataFrame of the properties for attribute queries. For the map it renders
+# compact copies of the features (see map_payload), with simplified geometries at low zoom
+# (level of detail, see display_features); the full-resolution features stay the source of truth.
+# A store is a snapshot: a change makes a new store (appended / replaced / removed) that
+# reuses the index and the shapely geometries of features it did not touch. Feature
+# dicts are shared copy-on-write (see feature_copy), so a geometry dict maps to one
+# shapely geometry for as long as it exists. No widgets here; feature_index binds
+# stores to layers.
+
+import numbers
+import threading
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import shapely.geometry
+
+from . import config as app_config
+from . import gml_stream
+from . import map_payload
+
+_METRES_PER_DEGREE = 111320.0 # Along a meridian; in longitude the tolerance is a bit finer
+_UNEXPORTED_PROPERTIES = ('style',) # Display state, not feature data
+
+
+def _temp_id(feature_dict):
+    properties = feature_dict.get('properties')
+    return properties.get('_temp_id') if isinstance(properties, dict) else None
+
+
+def display_tolerance_for_zoom(zoom):
+    """LOD simplification tolerance in degrees for a map zoom level, or None for full resolution."""
+    if not app_config.LOD_ENABLED or zoom is None:
+        return None
+    for max_zoom, tolerance_m in app_config.LOD_ZOOM_BANDS:
+        if zoom <= max_zoom:
+            return tolerance_m / _METRES_PER_DEGREE
+    return None
+
+
+def _typed(value):
+    # Text as GML types it (gml_stream.typed_value: '2001' is a number, '05' is not); other values unchanged
+    return gml_stream.typed_value(value.strip()) if isinstance(value, str) else value
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, (bool, np.bool_))
+
+
+def _numeric_column(column):
+    """
+    A text / object column as numbers if every value is a number or number text as GML types it
+    (gml_stream.typed_value: '2001' is one, '05' is not), else the column unchanged.
+    Such columns come from text sources, e.g. the local store, or mix both.
+    """
+    values = column.dropna()
+    typed = [_typed(value) for value in values]
+    if not typed or not all(_is_number(value) for value in typed):
+        return column
+    return pd.to_numeric(pd.Series(typed, index=values.index)).reindex(column.index)
+
+
+def property_matches(value, expected):
+    """
+    True if a property value equals expected as query_properties compares them: numbers and
+    number text as numbers (2000 matches '2000' and 2000.0, '012' matches neither), other
+    values as typed or as text ('05' matches '05' only).
+    """
+    typed_value, typed_expected = _typed(value), _typed(expected)
+    if _is_number(typed_value) or _is_number(typed_expected):
+        return _is_number(typed_value) and _is_number(typed_expected) and typed_value == typed_expected
+    return typed_value == typed_expected or str(value) == str(expected)
+
+
+def _build_positions(features):
+    positions = {}
+    for position, feature_dict_item in enumerate(features):
+        temp_id = _temp_id(feature_dict_item)
+        if temp_id is not None:
+            positions[temp_id] = position
+    return positions
+
+
+class FeatureStore:
+    """Features of one layer with a _temp_id index and lazily built shapely geometries / STRtree."""
+
+    def __init__(self, features, positions=None, geometry_cache=None, display_cache=None, properties_cache=None):
+        self.features = features
+        self._positions = positions if positions is not None else _build_positions(features)
+        # id(geometry dict) -> (geometry dict, shapely geometry). Holding the dict keeps its id unique.
+        self._geometry_cache = geometry_cache if geometry_cache is not None else {}
+        # (id(geometry dict), tolerance) -> (geometry dict, compact display geometry dict, its JSON size, original's JSON size)
+        self._display_cache = display_cache if display_cache is not None else {}
+        # id(properties dict) -> (properties dict, client properties, their JSON size, original's JSON size)
+        self._properties_cache = properties_cache if properties_cache is not None else {}
+        self._geometries = None
+        self._tree = None
+        self._properties_frame = None
+        self._display_features = {} # tolerance -> rendered features list
+        self._payload_sizes = {} # tolerance -> (JSON bytes sent to the map, JSON bytes of the original features)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.features)
+
+    # --- Lookup ---
+
+    def position_of(self, temp_id):
+        return self._positions.get(temp_id)
+
+    def __contains__(self, temp_id):
+        return temp_id in self._positions
+
+    def feature(self, temp_id):
+        position = self._positions.get(temp_id)
+        return None if position is None else self.features[position]
+
+    def features_by_ids(self, temp_ids):
+        """Features for temp_ids, in temp_ids order; ids not in the store are skipped."""
+        positions = self._positions
+        return [self.features[positions[temp_id]] for temp_id in temp_ids if temp_id in positions]
+
+    def temp_ids_at(self, positions):
+        return [_temp_id(self.features[position]) for position in positions]
+
+    # --- Geometry ---
+
+    def _shapely_geometry(self, geometry_dict, cache):
+        if not geometry_dict:
+            return None
+        entry = self._geometry_cache.get(id(geometry_dict))
+        if entry is not None and entry[0] is geometry_dict:
+            geometry = entry[1]
+        else:
+            try:
+                geometry = shapely.geometry.shape(geometry_dict)
+            except Exception:
+                return None
+        cache[id(geometry_dict)] = (geometry_dict, geometry)
+        return geometry
+
+    def geometries(self):
+        """Shapely geometries aligned with self.features (None where a feature has none)."""
+        with self._lock:
+            if self._geometries is None:
+                cache = {}
+                geometries = np.empty(len(self.features), dtype=object)
+                for position, feature_dict_item in enumerate(self.features):
+                    geometries[position] = self._shapely_geometry(feature_dict_item.get('geometry'), cache)
+                self._geometries = geometries
+                self._geometry_cache = cache # Only geometries still in the store stay cached
+            return self._geometries
+
+    def geometry(self, temp_id):
+        """The shapely geometry of one feature, or None."""
+        position = self._positions.get(temp_id)
+        if position is None:
+            return None
+        if self._geometries is not None:
+            return self._geometries[position]
+        with self._lock:
+            return self._shapely_geometry(self.features[position].get('geometry'), self._geometry_cache)
+
+    def tree(self):
+        """STRtree over geometries(); tree indexes are positions in self.features."""
+        geometries = self.geometries()
+        with self._lock:
+            if self._tree is None:
+                self._tree = shapely.STRtree(geometries)
+            return self._tree
+
+    def query(self, geometry, predicate='intersects'):
+        """_temp_ids of the features whose geometry satisfies predicate against geometry (EPSG:4326)."""
+        positions = self.tree().query(geometry, predicate=predicate)
+        return self.temp_ids_at(sorted(positions.tolist()))
+
+    # --- Display ---
+
+    def display_features(self, tolerance=None):
+        """
+        The features as sent to the map: geometries simplified to tolerance (degrees; None: not
+        simplified) and compacted by map_payload, properties reduced to the client properties.
+        Cached per tolerance, and display geometries carry over to derived stores. Without a
+        payload stage and tolerance, these are the original features.
+        """
+        if tolerance is None and not map_payload.enabled():
+            return self.features
+        with self._lock:
+            rendered = self._display_features.get(tolerance)
+        if rendered is not None:
+            return rendered
+        current_geometry_ids = {id(feature_dict_item.get('geometry')) for feature_dict_item in self.features}
+        cache = {key: entry for key, entry in self._display_cache.items() if key[0] in current_geometry_ids}
+        missing = [
+            position for position, feature_dict_item in enumerate(self.features)
+            if feature_dict_item.get('geometry') and (id(feature_dict_item['geometry']), tolerance) not in cache
+        ]
+        if missing:
+            display_geometries = [self.features[position]['geometry'] for position in missing]
+            if tolerance is not None:
+                originals = self.geometries()[missing]
+                simplified = shapely.simplify(originals, tolerance, preserve_topology=True)
+                shrunk = shapely.get_num_coordinates(simplified) < shapely.get_num_coordinates(originals)
+                display_geometries = [
+                    shapely.geometry.mapping(simplified_geometry) if is_shrunk else geometry_dict
+                    for geometry_dict, simplified_geometry, is_shrunk in zip(display_geometries, simplified, shrunk)
+                ]
+            for position, display_geometry in zip(missing, display_geometries):
+                geometry_dict = self.features[position]['geometry']
+                compact = map_payload.compact_geometry(display_geometry)
+                cache[(id(geometry_dict), tolerance)] = (
+                    geometry_dict, compact, map_payload.payload_bytes(compact), map_payload.payload_bytes(geometry_dict))
+        with self._lock:
+            known_properties = self._properties_cache
+        properties_cache = {}
+        rendered = []
+        sent_sizes = []
+        full_sizes = []
+        for feature_dict_item in self.features:
+            geometry_dict = feature_dict_item.get('geometry')
+            geometry_entry = cache.get((id(geometry_dict), tolerance)) if geometry_dict else None
+            if geometry_entry is None:
+                geometry_entry = (geometry_dict, geometry_dict) + (map_payload.payload_bytes(geometry_dict),) * 2
+            properties = feature_dict_item.get('properties')
+            properties_entry = known_properties.get(id(properties))
+            if properties_entry is None or properties_entry[0] is not properties:
+                client = map_payload.client_properties(properties)
+                properties_entry = (properties, client, map_payload.payload_bytes(client), map_payload.payload_bytes(properties))
+            properties_cache[id(properties)] = properties_entry
+            rendered.append({'type': 'Feature', 'geometry': geometry_entry[1], 'properties': properties_entry[1]})
+            sent_sizes.append(map_payload.feature_bytes(geometry_entry[2], properties_entry[2]))
+            full_sizes.append(map_payload.feature_bytes(geometry_entry[3], properties_entry[3]))
+        with self._lock:
+            self._display_cache = cache
+            self._properties_cache = properties_cache
+            self._display_features[tolerance] = rendered
+            self._payload_sizes[tolerance] = (map_payload.list_bytes(sent_sizes), map_payload.list_bytes(full_sizes))
+        return rendered
+
+    def payload_sizes(self, rendered):
+        """
+        (JSON bytes sent to the map, JSON bytes of the original features) for rendered, a list
+        display_features returned; measured while rendering. None if rendered is not one of them.
+        """
+        with self._lock:
+            for tolerance, display_features in self._display_features.items():
+                if display_features is rendered:
+                    return self._payload_sizes[tolerance]
+        return None
+
+    # --- Properties ---
+
+    def properties_frame(self):
+        """
+        DataFrame of the features' properties (without 'style'); row labels are positions.
+        Columns holding only numbers and number text are numeric.
+        """
+        with self._lock:
+            if self._properties_frame is None:
+                frame = pd.DataFrame.from_records([feature_dict_item.get('properties') or {} for feature_dict_item in self.features])
+                frame = frame.drop(columns=list(_UNEXPORTED_PROPERTIES), errors='ignore')
+                for column_name in frame.columns:
+                    if pd.api.types.is_object_dtype(frame[column_name]) or pd.api.types.is_string_dtype(frame[column_name]):
+                        frame[column_name] = _numeric_column(frame[column_name])
+                self._properties_frame = frame
+            return self._properties_frame
+
+    def query_properties(self, expression):
+        """
+        _temp_ids of the features whose properties match a pandas query expression, e.g.
+        "gebaeudefunktion == 2000", "amtlicheFlaeche > 500" or "gml_id.str.startswith('DENW')"
+        (numbers unquoted, codes with leading zeros like land == '05' are text; backticks around
+        unusual column names). Raises pandas' errors for invalid expressions or columns the
+        store does not have.
+        """
+        frame = self.properties_frame()
+        if frame.empty:
+            return []
+        # The python engine allows .str / .astype calls; comparisons still run column-wise.
+        return self.temp_ids_at(frame.query(expression, engine='python').index.tolist())
+
+    def to_geodataframe(self, temp_ids=None):
+        """GeoDataFrame (EPSG:4326) of all features or of temp_ids, without the display 'style'."""
+        geometries = self.geometries()
+        if temp_ids is None:
+            positions = range(len(self.features))
+        else:
+            positions = [self._positions[temp_id] for temp_id in temp_ids if temp_id in self._positions]
+        rows = [
+            {k: v for k, v in self.features[position]['properties'].items() if k not in _UNEXPORTED_PROPERTIES}
+            for position in positions
+        ]
+        return gpd.GeoDataFrame(rows, geometry=list(geometries[list(positions)]), crs="EPSG:4326")
+
+    # --- Changes (each returns a new store) ---
+
+    def with_features(self, features):
+        """A store for another features list, reusing this store's shapely / display geometries."""
+        return FeatureStore(features, None, self._geometry_cache, self._display_cache, self._properties_cache)
+
+    def appended(self, new_features):
+        positions = dict(self._positions)
+        offset = len(self.features)
+        for i, feature_dict_item in enumerate(new_features):
+            temp_id = _temp_id(feature_dict_item)
+            if temp_id is not None:
+                positions[temp_id] = offset + i
+        return FeatureStore(self.features + list(new_features), positions, self._geometry_cache, self._display_cache, self._properties_cache)
+
+    def replaced(self, replacements):
+        """New store with replacements ({_temp_id: feature}) in place; None if no id is in the store."""
+        targets = [(self._positions[temp_id], feature_dict_item)
+                   for temp_id, feature_dict_item in replacements.items() if temp_id in self._positions]
+        if not targets:
+            return None
+        features = list(self.features)
+        positions = dict(self._positions)
+        for position, feature_dict_item in targets:
+            old_temp_id = _temp_id(features[position])
+            features[position] = feature_dict_item
+            new_temp_id = _temp_id(feature_dict_item)
+            if new_temp_id != old_temp_id:
+                positions.pop(old_temp_id, None)
+                if new_temp_id is not None:
+                    positions[new_temp_id] = position
+        return FeatureStore(features, positions, self._geometry_cache, self._display_cache, self._properties_cache)
+
+    def removed(self, temp_ids):
+        """New store without the features of temp_ids; None if none of them is in the store."""
+        removed_positions = sorted(self._positions[temp_id] for temp_id in set(temp_ids) if temp_id in self._positions)
+        if not removed_positions:
+            return None
+        kept_features, start = [], 0
+        for position in removed_positions:
+            kept_features.extend(self.features[start:position])
+            start = position + 1
+        kept_features.extend(self.features[start:])
+        return FeatureStore(kept_features, None, self._geometry_cache, self._display_cache, self._properties_cache)
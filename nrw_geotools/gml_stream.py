@@ -0,0 +1,348 @@
+# nrw_geotools/gml_stream.py
+#
+# Incremental parser for WFS GetFeature GML (2.0 wfs:member / 1.1 gml:featureMember).
+# Response chunks are fed into an ElementTree XMLPullParser and features come out in
+# batches of GeoJSON-like dicts, so a large response never has to be held in memory
+# and the first features can be shown before the download has finished.
+# Coordinates stay in the CRS of the response; reprojection is left to the caller.
+# Curved segments (Arc, ArcString, Circle, ...ByCenterPoint) are stroked with GDAL's
+# default 4 degree step, so streamed geometries match the GDAL parse vertex for vertex.
+# Properties come out as GDAL's GML driver (the non-streaming parse) reports them: named
+# after their leaf element, typed as numbers / booleans / datetimes, with a <name>_uom
+# property for measures and lists for repeated elements.
+
+import datetime
+import math
+import re
+import xml.etree.ElementTree as ET
+
+_MEMBER_TAGS = {'member', 'featureMember', 'featureMembers'}
+_GML_ID_ATTRS = ('{http://www.opengis.net/gml/3.2}id', '{http://www.opengis.net/gml}id')
+_ENVELOPE_PROPERTIES = {'boundedBy'} # Not a geometry: GDAL reports its corners as text properties
+_EXCEPTION_ROOTS = {'ExceptionReport', 'ServiceExceptionReport'}
+_INTEGER_RE = re.compile(r'[+-]?\d+')
+_REAL_RE = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+_ARC_STEP_DEGREES = 4.0 # GDAL's OGR_ARC_STEPSIZE default, so both parses stroke curves alike
+_ARC_SEGMENTS = {'Arc', 'ArcString', 'Circle'} # Control points: start, point on the arc, end (, ...)
+_CENTER_POINT_SEGMENTS = {'ArcByCenterPoint', 'CircleByCenterPoint'}
+_DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?')
+
+
+class GMLExceptionReport(Exception):
+    """The server answered with an OGC exception document instead of features."""
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def _is_gml(element):
+    return isinstance(element.tag, str) and element.tag.startswith('{http://www.opengis.net/gml')
+
+
+def typed_value(text):
+    """
+    A property's text as GDAL's GML driver types it: int, float, bool, datetime or str.
+    Numbers with a leading zero ('05', '000000') stay text, as GDAL keeps them.
+    """
+    digits = text.lstrip('+-')
+    if len(digits) > 1 and digits[0] == '0' and digits[1] != '.':
+        return text
+    if _INTEGER_RE.fullmatch(text):
+        return int(text)
+    if _REAL_RE.fullmatch(text):
+        return float(text)
+    if text in ('true', 'false'):
+        return text == 'true'
+    if _DATETIME_RE.fullmatch(text):
+        try:
+            return datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+        except ValueError:
+            return text
+    return text
+
+
+def _angle_degrees(element):
+    value = float(element.text)
+    return math.degrees(value) if element.get('uom', 'deg').lower().startswith('rad') else value
+
+
+def _arc_angles(start, sweep, full_circle=False):
+    """Angles (radians) GDAL strokes an arc at: round(sweep / step) slices, odd and at least 7 for arcs."""
+    slices = int(abs(math.degrees(sweep)) / _ARC_STEP_DEGREES + 0.5)
+    if not full_circle:
+        slices = max(7, slices if slices % 2 else slices + 1)
+    return [start + sweep * i / slices for i in range(slices + 1)]
+
+
+def _stroke_arcs(control_points, full_circle=False):
+    """
+    Line through arcs given by control points (start, point on the arc, end, then two more per
+    further arc, as in gml:ArcString; for gml:Circle the three points span the whole circle).
+    Collinear control points stay straight.
+    """
+    if len(control_points) < 3:
+        return control_points
+    coords = [control_points[0]]
+    for i in range(0, len(control_points) - 2, 2):
+        (x0, y0), (x1, y1), (x2, y2) = control_points[i:i + 3]
+        # Circumcentre, computed relative to the start point to keep precision with large coordinates.
+        bx, by, cx, cy = x1 - x0, y1 - y0, x2 - x0, y2 - y0
+        d = 2 * (bx * cy - by * cx)
+        if abs(d) <= 1e-12 * (bx * bx + by * by + cx * cx + cy * cy):
+            coords.extend([(x1, y1), (x2, y2)])
+            continue
+        ux = (cy * (bx * bx + by * by) - by * (cx * cx + cy * cy)) / d
+        uy = (bx * (cx * cx + cy * cy) - cx * (bx * bx + by * by)) / d
+        center_x, center_y = x0 + ux, y0 + uy
+        radius = math.hypot(ux, uy)
+        start = math.atan2(y0 - center_y, x0 - center_x)
+        counterclockwise = d > 0
+        if full_circle:
+            sweep = 2 * math.pi if counterclockwise else -2 * math.pi
+        else:
+            end = math.atan2(y2 - center_y, x2 - center_x)
+            sweep = (end - start) % (2 * math.pi)
+            if not counterclockwise:
+                sweep -= 2 * math.pi
+        angles = _arc_angles(start, sweep, full_circle)
+        coords.extend((center_x + radius * math.cos(a), center_y + radius * math.sin(a)) for a in angles[1:-1])
+        coords.append(control_points[i] if full_circle else (x2, y2))
+    return coords
+
+
+class GMLFeatureStream:
+    """
+    Parses one GetFeature response. After (or while) iterating iter_batches(), number_matched
+    holds the root element's numberMatched attribute as int, if the server sent one.
+    With swap_axes=True, coordinates are read as (y, x), e.g. for urn:ogc:def:crs:EPSG::4326.
+    """
+
+    def __init__(self, batch_size=200, swap_axes=False):
+        self.batch_size = batch_size
+        self.swap_axes = swap_axes
+        self.number_matched = None
+        self._field_paths = {} # property name -> element path it was first seen at
+
+    def iter_batches(self, chunks):
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        element_stack = []
+        batch = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    if not element_stack:
+                        self._check_root(element)
+                    element_stack.append(element)
+                    continue
+                element_stack.pop()
+                parent = element_stack[-1] if element_stack else None
+                if parent is not None and _local_name(parent.tag) in _MEMBER_TAGS and not _is_gml(element):
+                    feature = self._build_feature(element)
+                    if feature is not None:
+                        batch.append(feature)
+                    # Drop the parsed feature so memory stays at roughly one batch.
+                    parent.remove(element)
+                    if len(batch) >= self.batch_size:
+                        yield batch
+                        batch = []
+                elif _local_name(element.tag) in _MEMBER_TAGS and parent is not None:
+                    parent.remove(element)
+        parser.close()
+        if batch:
+            yield batch
+
+    def _check_root(self, root):
+        if _local_name(root.tag) in _EXCEPTION_ROOTS:
+            raise GMLExceptionReport(root.tag)
+        number_matched = root.get('numberMatched')
+        if number_matched and number_matched.isdigit():
+            self.number_matched = int(number_matched)
+
+    def _build_feature(self, feature_element):
+        properties = {}
+        gml_id = next((feature_element.get(attr) for attr in _GML_ID_ATTRS if feature_element.get(attr)), None)
+        if gml_id:
+            properties['gml_id'] = gml_id
+        geometry = None
+        for prop in feature_element:
+            name = _local_name(prop.tag)
+            geometry_element = next((child for child in prop if _is_gml(child)), None)
+            if geometry_element is not None and name not in _ENVELOPE_PROPERTIES:
+                parsed = self._parse_geometry(geometry_element)
+                if parsed is not None and geometry is None:
+                    geometry = parsed
+                continue
+            self._collect_property(properties, (name,), prop)
+        return {'type': 'Feature', 'properties': properties, 'geometry': geometry}
+
+    def _field_name(self, path):
+        # The leaf element's name, or, as in GDAL, the '|'-joined path if another path has that name already.
+        first_path = self._field_paths.setdefault(path[-1], path)
+        return path[-1] if first_path == path else '|'.join(path)
+
+    def _collect_property(self, properties, path, element):
+        children = list(element)
+        if children:
+            for child in children:
+                self._collect_property(properties, path + (_local_name(child.tag),), child)
+            return
+        text = (element.text or '').strip()
+        if not text:
+            return # Empty and xlink:href-only elements have no value in GDAL either
+        name = self._field_name(path)
+        value = typed_value(text)
+        if name in properties:
+            # Repeated properties become lists, like GDAL's list fields.
+            previous = properties[name]
+            properties[name] = (previous if isinstance(previous, list) else [previous]) + [value]
+        else:
+            properties[name] = value
+        if element.get('uom') is not None:
+            properties.setdefault(f"{name}_uom", element.get('uom'))
+
+    # --- Geometry ---
+
+    def _coords(self, element, dimension=None):
+        name = _local_name(element.tag)
+        dimension = int(element.get('srsDimension') or dimension or 2)
+        if name == 'coordinates':
+            tuples = [tuple(float(v) for v in pair.split(',')) for pair in element.text.split()]
+            values = [v for t in tuples for v in t[:2]]
+            dimension = 2
+        else:
+            values = [float(v) for v in element.text.split()]
+        coords = []
+        for i in range(0, len(values) - dimension + 1, dimension):
+            x, y = values[i], values[i + 1]
+            coords.append((y, x) if self.swap_axes else (x, y))
+        return coords
+
+    def _ring_or_line_coords(self, element, dimension=None):
+        """
+        Coordinates of a LinearRing / Ring / LineString / Curve (any nesting of segments).
+        Arcs and circles are stroked into straight segments the way GDAL does.
+        """
+        dimension = element.get('srsDimension') or dimension
+        name = _local_name(element.tag)
+        if name in _CENTER_POINT_SEGMENTS:
+            return self._center_point_arc_coords(element, dimension)
+        if name in _ARC_SEGMENTS:
+            return _stroke_arcs(self._child_coords(element, dimension), full_circle=name == 'Circle')
+        return self._child_coords(element, dimension)
+
+    def _child_coords(self, element, dimension):
+        coords = []
+        for child in element:
+            name = _local_name(child.tag)
+            if name in ('posList', 'pos', 'coordinates'):
+                coords.extend(self._coords(child, dimension))
+            elif name in ('pointProperty', 'pointRep'):
+                point = next(iter(child), None)
+                if point is not None:
+                    coords.extend(self._ring_or_line_coords(point, dimension))
+            else:
+                # segments, LineStringSegment, Arc, curveMember, Curve, ... : descend and concatenate
+                part = self._ring_or_line_coords(child, dimension)
+                if coords and part and coords[-1] == part[0]:
+                    part = part[1:]
+                coords.extend(part)
+        return coords
+
+    def _center_point_arc_coords(self, element, dimension):
+        center = next((self._coords(child, dimension) for child in element
+                       if _local_name(child.tag) in ('pos', 'posList', 'coordinates')), None)
+        values = {_local_name(child.tag): child for child in element}
+        if not center or 'radius' not in values:
+            return []
+        radius = float(values['radius'].text)
+        if _local_name(element.tag) == 'CircleByCenterPoint':
+            start, sweep = 180.0, 360.0 # Where GDAL starts the circle
+        else:
+            start, end = (_angle_degrees(values[key]) for key in ('startAngle', 'endAngle'))
+            sweep = end - start
+        # Angles count from the CRS's first axis, so work in axis order and swap back at the end.
+        first, second = (center[0][1], center[0][0]) if self.swap_axes else center[0]
+        coords = []
+        for angle in _arc_angles(math.radians(start), math.radians(sweep), full_circle=abs(sweep) >= 360.0):
+            point = (first + radius * math.cos(angle), second + radius * math.sin(angle))
+            coords.append((point[1], point[0]) if self.swap_axes else point)
+        return coords
+
+    def _polygon_rings(self, element):
+        exterior, interiors = None, []
+        for child in element:
+            name = _local_name(child.tag)
+            ring_element = next(iter(child), None)
+            if ring_element is None:
+                continue
+            if name in ('exterior', 'outerBoundaryIs'):
+                exterior = self._ring_or_line_coords(ring_element, element.get('srsDimension'))
+            elif name in ('interior', 'innerBoundaryIs'):
+                interior = self._ring_or_line_coords(ring_element, element.get('srsDimension'))
+                if interior:
+                    interiors.append(interior)
+        return [exterior] + interiors if exterior else []
+
+    def _surface_polygons(self, element):
+        """List of polygons (each a list of rings) for any surface-like GML element."""
+        name = _local_name(element.tag)
+        if name in ('Polygon', 'PolygonPatch', 'Rectangle'):
+            rings = self._polygon_rings(element)
+            return [rings] if rings else []
+        polygons = []
+        for child in element:
+            if isinstance(child.tag, str):
+                polygons.extend(self._surface_polygons(child))
+        return polygons
+
+    def _curve_lines(self, element):
+        name = _local_name(element.tag)
+        if name in ('LineString', 'Curve', 'LinearRing', 'Ring'):
+            line = self._ring_or_line_coords(element)
+            return [line] if line else []
+        lines = []
+        for child in element:
+            if isinstance(child.tag, str):
+                lines.extend(self._curve_lines(child))
+        return lines
+
+    def _points(self, element):
+        if _local_name(element.tag) == 'Point':
+            return self._ring_or_line_coords(element)[:1]
+        points = []
+        for child in element:
+            if isinstance(child.tag, str):
+                points.extend(self._points(child))
+        return points
+
+    def _parse_geometry(self, element):
+        name = _local_name(element.tag)
+        try:
+            if name in ('Polygon', 'Surface', 'MultiSurface', 'MultiPolygon', 'CompositeSurface', 'OrientableSurface', 'PolyhedralSurface'):
+                polygons = self._surface_polygons(element)
+                if not polygons:
+                    return None
+                if len(polygons) == 1 and name in ('Polygon', 'Surface', 'OrientableSurface'):
+                    return {'type': 'Polygon', 'coordinates': polygons[0]}
+                return {'type': 'MultiPolygon', 'coordinates': polygons}
+            if name in ('LineString', 'Curve', 'MultiCurve', 'MultiLineString', 'CompositeCurve', 'OrientableCurve'):
+                lines = self._curve_lines(element)
+                if not lines:
+                    return None
+                if len(lines) == 1 and name in ('LineString', 'Curve', 'CompositeCurve', 'OrientableCurve'):
+                    return {'type': 'LineString', 'coordinates': lines[0]}
+                return {'type': 'MultiLineString', 'coordinates': lines}
+            if name in ('Point', 'MultiPoint'):
+                points = self._points(element)
+                if not points:
+                    return None
+                if name == 'Point':
+                    return {'type': 'Point', 'coordinates': points[0]}
+                return {'type': 'MultiPoint', 'coordinates': points}
+        except (ValueError, AttributeError, IndexError):
+            return None # Malformed coordinates: keep the feature's attributes without geometry
+        return None
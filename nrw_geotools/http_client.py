@@ -0,0 +1,177 @@
+# nrw_geotools/http_client.py
+#
+# Shared HTTP layer for all WFS / capabilities traffic. Pooled requests.Sessions (one
+# per retry policy) keep connections to wfs.nrw.de alive between requests and retry
+# transient failures (429/5xx, connection resets) with exponential backoff plus jitter.
+# Requests made through a request scheduler use a session that leaves the 429/5xx
+# retries to http_get, which sends each of them through the scheduler.
+
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import config as app_config
+
+_sessions = {} # (retry_statuses, retry_reads) -> requests.Session
+_session_lock = threading.Lock()
+
+
+class _JitteredRetry(Retry):
+    # urllib3 only added backoff_jitter in 2.x, so add the jitter here to work with both.
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return 0
+        return min(backoff + random.uniform(0, app_config.HTTP_BACKOFF_JITTER), app_config.HTTP_BACKOFF_MAX)
+
+
+def _build_session(retry_statuses=True, retry_reads=True):
+    # Without retry_statuses every answer comes back to the caller (see _scheduled_get);
+    # without retry_reads a read timeout or error is raised on the first occurrence.
+    retry = _JitteredRetry(
+        total=app_config.HTTP_MAX_RETRIES,
+        connect=app_config.HTTP_MAX_RETRIES,
+        read=app_config.HTTP_MAX_RETRIES if retry_reads else 0,
+        status=app_config.HTTP_MAX_RETRIES if retry_statuses else 0,
+        backoff_factor=app_config.HTTP_BACKOFF_FACTOR,
+        status_forcelist=app_config.HTTP_RETRY_STATUS_CODES if retry_statuses else None,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=retry_statuses,
+        raise_on_status=False, # Hand the final response back so callers still see raise_for_status() errors
+    )
+    # pool_maxsize with pool_block=True caps the open connections per host: extra
+    # threads wait for a free connection instead of opening new ones.
+    adapter = HTTPAdapter(
+        pool_connections=app_config.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=app_config.HTTP_MAX_CONNECTIONS_PER_HOST,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+
+def get_session(retry_statuses=True, retry_reads=True):
+    """
+    The shared session for a retry policy. Requests made through a scheduler use one without
+    status retries, which http_get sends through the scheduler instead.
+    """
+    key = (retry_statuses, retry_reads)
+    with _session_lock:
+        if key not in _sessions:
+            _sessions[key] = _build_session(retry_statuses, retry_reads)
+        return _sessions[key]
+
+
+def reset_session():
+    """Closes the shared sessions; the next request builds new ones from the current config."""
+    with _session_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+class _ScheduledStreamResponse:
+    """
+    A response requested with stream=True through a scheduler. Its body is still downloading
+    when the headers arrive, so it keeps the scheduler slot until the body has been read to
+    the end (iter_content / content) or the response is closed, and the latency the scheduler
+    sees is the time to the last byte.
+    """
+
+    def __init__(self, resp, ticket):
+        self._resp = resp
+        self._ticket = ticket
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+
+    def raise_for_status(self):
+        self._resp.raise_for_status()
+
+    def json(self):
+        return json.loads(self.content)
+
+    @property
+    def content(self):
+        try:
+            body = self._resp.content
+        except Exception as e_body:
+            self._ticket.record_error(e_body)
+            self.close()
+            raise
+        self._ticket.record_response(self._resp)
+        self.close()
+        return body
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        completed = False
+        try:
+            yield from self._resp.iter_content(chunk_size=chunk_size, decode_unicode=decode_unicode)
+            completed = True
+        except Exception as e_body:
+            self._ticket.record_error(e_body)
+            raise
+        finally:
+            if completed:
+                self._ticket.record_response(self._resp)
+            self.close()
+
+    def close(self):
+        self._resp.close()
+        self._ticket.finish()
+
+
+def _status_backoff_seconds(attempt, resp):
+    """Wait before status retry number attempt + 1: Retry-After if given in seconds, else the session's backoff."""
+    retry_after = resp.headers.get('Retry-After', '').strip()
+    if retry_after.isdigit():
+        return min(float(retry_after), app_config.HTTP_BACKOFF_MAX)
+    backoff = app_config.HTTP_BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, app_config.HTTP_BACKOFF_JITTER)
+    return min(backoff, app_config.HTTP_BACKOFF_MAX)
+
+
+def _scheduled_get(url, params, timeout, scheduler, retry_reads, **kwargs):
+    # Each attempt waits for its own admission, so a retried 429/503 takes a rate token and
+    # a slot again and every one of them reaches the scheduler's congestion control.
+    for attempt in range(app_config.HTTP_MAX_RETRIES + 1):
+        ticket = scheduler.admit()
+        try:
+            resp = get_session(retry_statuses=False, retry_reads=retry_reads).get(url, params=params, timeout=timeout, **kwargs)
+        except Exception as e_request:
+            ticket.record_error(e_request)
+            ticket.finish()
+            raise
+        if resp.status_code >= 400:
+            ticket.record_response(resp)
+            if resp.status_code in app_config.HTTP_RETRY_STATUS_CODES and attempt < app_config.HTTP_MAX_RETRIES:
+                resp.close()
+                ticket.finish()
+                time.sleep(_status_backoff_seconds(attempt, resp))
+                continue
+        elif kwargs.get('stream'):
+            return _ScheduledStreamResponse(resp, ticket)
+        ticket.record_response(resp)
+        ticket.finish()
+        return resp
+
+
+def http_get(url, params=None, timeout=None, scheduler=None, retry_reads=True, **kwargs):
+    """
+    GET on the shared session; with a request_scheduler.RequestScheduler the call waits for its
+    admission, retries 429/5xx answers through it, and a stream=True response holds its slot
+    until it is read or closed. retry_reads=False raises the first read timeout instead of
+    retrying it, for callers that have a better answer to a timeout than the same request.
+    """
+    if timeout is None:
+        timeout = app_config.HTTP_DEFAULT_TIMEOUT
+    if scheduler is None:
+        return get_session(retry_reads=retry_reads).get(url, params=params, timeout=timeout, **kwargs)
+    return _scheduled_get(url, params, timeout, scheduler, retry_reads, **kwargs)
@@ -0,0 +1,243 @@
+# nrw_geotools/local_store.py
+#
+# Local columnar store of fetched WFS features, one directory per feature type under
+# LOCAL_STORE_DIR. Every fetch appends a FlatGeobuf part (EPSG:4326, packed R-tree
+# spatial index) and records the EPSG:25832 area it covers in the type's manifest.json,
+# so "type X within bbox Y" can later be answered from disk through a pyogrio bbox
+# filter instead of the WFS. Parts are merged into one file beyond LOCAL_STORE_MAX_PARTS.
+# Columns holding lists, dicts or mixed values are stored as JSON text and decoded on load.
+
+import contextlib
+import json
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import geopandas as gpd
+import pyogrio
+import shapely
+import shapely.geometry
+import shapely.wkt
+
+from . import config as app_config
+from . import projection
+
+try:
+    import fcntl
+except ImportError: # Windows: manifest updates are only serialized within one process
+    fcntl = None
+
+_lock = threading.RLock()
+_UNSTORED_PROPERTIES = ('_temp_id', 'style') # Per-session display state, recreated on load
+
+
+def _type_dir(feature_type):
+    return os.path.join(app_config.LOCAL_STORE_DIR, feature_type.replace(':', '_').replace('/', '_'))
+
+
+def _manifest_path(feature_type):
+    return os.path.join(_type_dir(feature_type), "manifest.json")
+
+
+@contextlib.contextmanager
+def _manifest_update_lock(feature_type):
+    # Threads of this process and, where flock exists, other processes (CLI workers) take turns.
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(_type_dir(feature_type), ".lock"), 'a') as f_lock:
+            fcntl.flock(f_lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f_lock, fcntl.LOCK_UN)
+
+
+def _load_manifest(feature_type):
+    try:
+        with open(_manifest_path(feature_type), 'r', encoding='utf-8') as f_manifest:
+            return json.load(f_manifest)
+    except (OSError, ValueError):
+        return {'feature_type': feature_type, 'parts': []}
+
+
+def _save_manifest(feature_type, manifest):
+    tmp_path = f"{_manifest_path(feature_type)}.{uuid.uuid4().hex}.tmp" # Unique where flock is missing (Windows)
+    with open(tmp_path, 'w', encoding='utf-8') as f_manifest:
+        json.dump(manifest, f_manifest)
+    os.replace(tmp_path, _manifest_path(feature_type))
+
+
+def _is_fresh(part):
+    return time.time() - part['fetched_at'] < app_config.LOCAL_STORE_MAX_AGE_SECONDS
+
+
+def _fresh_parts(manifest, params_key):
+    """Parts usable for params_key, newest first."""
+    parts = [part for part in manifest['parts'] if part['params'] == params_key and _is_fresh(part)]
+    return sorted(parts, key=lambda part: part['fetched_at'], reverse=True)
+
+
+def _is_missing(value):
+    # from_features fills properties a feature lacks with NaN
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _features_to_gdf(features):
+    """The features as a GeoDataFrame to write, and the columns stored as JSON text (see _read_parts)."""
+    rows = []
+    for feature_dict_item in features:
+        if not feature_dict_item.get('geometry'):
+            continue # The packed spatial index has no place for features without geometry
+        properties = {k: v for k, v in feature_dict_item['properties'].items() if k not in _UNSTORED_PROPERTIES}
+        rows.append({'type': 'Feature', 'properties': properties, 'geometry': feature_dict_item['geometry']})
+    gdf = gpd.GeoDataFrame.from_features(rows, crs="EPSG:4326")
+    json_columns = []
+    for column in gdf.columns:
+        if column == gdf.geometry.name or gdf[column].dtype != object:
+            continue
+        if not all(_is_missing(v) or isinstance(v, str) for v in gdf[column]):
+            # FlatGeobuf columns have one type; lists, dicts and mixed values are stored as JSON text.
+            gdf[column] = gdf[column].map(lambda v: None if _is_missing(v) else json.dumps(v, ensure_ascii=False, default=str))
+            json_columns.append(column)
+    return gdf, json_columns
+
+
+def _write_part(feature_type, gdf):
+    part_name = f"part_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    part_file = f"{part_name}.fgb"
+    # Without the .fgb extension GDAL would create a multi-layer directory instead of one file.
+    tmp_path = os.path.join(_type_dir(feature_type), f"{part_name}.tmp.fgb")
+    pyogrio.write_dataframe(gdf, tmp_path, driver="FlatGeobuf", layer=part_name)
+    os.replace(tmp_path, os.path.join(_type_dir(feature_type), part_file))
+    return part_file
+
+
+def _remove_part_file(feature_type, part):
+    try:
+        os.remove(os.path.join(_type_dir(feature_type), part['file']))
+    except OSError:
+        pass
+
+
+def append_features(feature_type, features, covered_area, params_key):
+    """
+    Stores features (GeoJSON dicts in EPSG:4326) fetched for covered_area (a shapely
+    EPSG:25832 geometry: everything the WFS has within it was requested) as a new part.
+    params_key identifies the request settings the coverage is valid for.
+    """
+    os.makedirs(_type_dir(feature_type), exist_ok=True)
+    gdf, json_columns = _features_to_gdf(features)
+    part_file = _write_part(feature_type, gdf) if not gdf.empty else None
+    with _manifest_update_lock(feature_type):
+        manifest = _load_manifest(feature_type)
+        stale_parts = [part for part in manifest['parts'] if not _is_fresh(part)]
+        manifest['parts'] = [part for part in manifest['parts'] if _is_fresh(part)]
+        manifest['parts'].append({
+            'file': part_file,
+            'params': params_key,
+            'covered_wkt': covered_area.wkt,
+            'fetched_at': time.time(),
+            'count': len(gdf),
+            'json_columns': json_columns,
+        })
+        _save_manifest(feature_type, manifest)
+        for part in stale_parts:
+            if part['file']:
+                _remove_part_file(feature_type, part)
+        if len([part for part in manifest['parts'] if part['params'] == params_key]) > app_config.LOCAL_STORE_MAX_PARTS:
+            _compact_locked(feature_type, params_key)
+
+
+def _compact_locked(feature_type, params_key):
+    """Merges the fresh parts for params_key into one file."""
+    manifest = _load_manifest(feature_type)
+    fresh_parts = _fresh_parts(manifest, params_key)
+    merged_features = _read_parts(feature_type, fresh_parts, bbox_4326=None)
+    covered_areas = [shapely.wkt.loads(part['covered_wkt']) for part in fresh_parts]
+    gdf, json_columns = _features_to_gdf(merged_features)
+    merged_part = {
+        'file': _write_part(feature_type, gdf) if not gdf.empty else None,
+        'params': params_key,
+        'covered_wkt': shapely.union_all(covered_areas).wkt if covered_areas else shapely.geometry.Polygon().wkt,
+        'fetched_at': min((part['fetched_at'] for part in fresh_parts), default=time.time()), # Ages with its oldest data
+        'count': len(gdf),
+        'json_columns': json_columns,
+    }
+    replaced = [part for part in manifest['parts'] if part['params'] == params_key]
+    manifest['parts'] = [part for part in manifest['parts'] if part['params'] != params_key] + [merged_part]
+    _save_manifest(feature_type, manifest)
+    for part in replaced:
+        if part['file']:
+            _remove_part_file(feature_type, part)
+
+
+def _read_parts(feature_type, parts, bbox_4326):
+    """Features of the parts (newest first), each gml_id only once, as GeoJSON dicts."""
+    features, seen_ids = [], set()
+    for part in parts:
+        if not part['file']:
+            continue
+        part_path = os.path.join(_type_dir(feature_type), part['file'])
+        gdf = pyogrio.read_dataframe(part_path, bbox=bbox_4326)
+        if gdf.empty:
+            continue
+        json_columns = part.get('json_columns', ())
+        for feature_dict_item in gdf.__geo_interface__['features']:
+            feature_id = feature_dict_item['properties'].get('gml_id')
+            if feature_id is not None:
+                if feature_id in seen_ids:
+                    continue
+                seen_ids.add(feature_id)
+            feature_dict_item.pop('bbox', None)
+            feature_dict_item.pop('id', None)
+            properties = feature_dict_item['properties']
+            for column in json_columns:
+                if properties.get(column) is not None:
+                    properties[column] = json.loads(properties[column])
+            features.append(feature_dict_item)
+    return features
+
+
+def covered_area(feature_type, params_key):
+    """EPSG:25832 area the store can answer for feature_type without the WFS, or None."""
+    if not os.path.exists(_manifest_path(feature_type)):
+        return None
+    with _lock:
+        parts = _fresh_parts(_load_manifest(feature_type), params_key)
+    if not parts:
+        return None
+    return shapely.union_all([shapely.wkt.loads(part['covered_wkt']) for part in parts])
+
+
+def load_features(feature_type, bbox_25832, params_key):
+    """
+    Stored features of feature_type intersecting bbox_25832 (minx, miny, maxx, maxy), as
+    GeoJSON dicts in EPSG:4326 without '_temp_id' / 'style'. Only the files' spatial
+    indexes are searched; nothing outside the bbox is read.
+    """
+    if not os.path.exists(_manifest_path(feature_type)):
+        return []
+    bbox_4326 = projection.reproject_geometries(
+        [shapely.geometry.box(*bbox_25832)], "EPSG:25832", "EPSG:4326"
+    )[0].bounds
+    with _lock:
+        parts = _fresh_parts(_load_manifest(feature_type), params_key)
+        return _read_parts(feature_type, parts, bbox_4326)
+
+
+def clear_store(feature_type=None):
+    """Deletes the stored parts of one feature type, or of all types."""
+    with _lock:
+        if feature_type is not None:
+            type_dirs = [_type_dir(feature_type)]
+        elif os.path.isdir(app_config.LOCAL_STORE_DIR):
+            type_dirs = [os.path.join(app_config.LOCAL_STORE_DIR, d) for d in os.listdir(app_config.LOCAL_STORE_DIR)]
+        else:
+            type_dirs = []
+        for type_dir in type_dirs:
+            shutil.rmtree(type_dir, ignore_errors=True)
@@ -0,0 +1,107 @@
+# nrw_geotools/map_payload.py
+#
+# Serialization stage for features sent to the map. Layer data travels to the browser as
+# JSON text, and full float64 coordinates (15+ digits) and attributes the browser never
+# uses make up most of it. Map-bound features get coordinates rounded to
+# MAP_COORDINATE_DECIMALS (2D only), consecutive vertices that became equal dropped, and
+# only the MAP_CLIENT_PROPERTIES. The FeatureStore keeps the originals for selection, edit,
+# cut and export; FeatureStore.display_features caches the compact geometries and
+# measures the payload as it builds it.
+
+import json
+
+import numpy as np
+
+from . import config as app_config
+
+_MIN_POSITIONS = {'LineString': 2, 'MultiLineString': 2, 'Polygon': 4, 'MultiPolygon': 4}
+
+
+def enabled():
+    return app_config.MAP_COORDINATE_DECIMALS is not None or app_config.MAP_CLIENT_PROPERTIES is not None
+
+
+def _compact_positions(positions, decimals, min_count):
+    array = np.asarray(positions, dtype=float)
+    if array.ndim != 2 or not len(array):
+        return positions
+    array = array[:, :2].round(decimals)
+    if min_count is not None and len(array) > 1:
+        kept = np.ones(len(array), dtype=bool)
+        kept[1:] = np.any(array[1:] != array[:-1], axis=1)
+        if kept.sum() >= min_count: # A ring or line that would collapse keeps its duplicates
+            array = array[kept]
+    return array.tolist()
+
+
+def _compact_coordinates(coordinates, depth, decimals, min_count):
+    # depth: nesting levels above the position lists (LineString 0, Polygon 1, MultiPolygon 2)
+    if depth == 0:
+        return _compact_positions(coordinates, decimals, min_count)
+    return [_compact_coordinates(part, depth - 1, decimals, min_count) for part in coordinates]
+
+
+def compact_geometry(geometry_dict):
+    """The GeoJSON geometry with coordinates rounded and consecutive duplicate vertices dropped."""
+    decimals = app_config.MAP_COORDINATE_DECIMALS
+    if not geometry_dict or decimals is None:
+        return geometry_dict
+    geometry_type = geometry_dict.get('type')
+    try:
+        if geometry_type == 'GeometryCollection':
+            return {'type': geometry_type, 'geometries': [compact_geometry(g) for g in geometry_dict.get('geometries', [])]}
+        coordinates = geometry_dict.get('coordinates')
+        if geometry_type == 'Point':
+            compact = [round(float(value), decimals) for value in coordinates[:2]]
+        elif geometry_type == 'MultiPoint':
+            compact = _compact_positions(coordinates, decimals, None)
+        elif geometry_type in ('LineString', 'Polygon', 'MultiLineString', 'MultiPolygon'):
+            depth = {'LineString': 0, 'Polygon': 1, 'MultiLineString': 1, 'MultiPolygon': 2}[geometry_type]
+            compact = _compact_coordinates(coordinates, depth, decimals, _MIN_POSITIONS[geometry_type])
+        else:
+            return geometry_dict
+    except (TypeError, ValueError): # Ragged or malformed coordinates: sent as they are
+        return geometry_dict
+    return {'type': geometry_type, 'coordinates': compact}
+
+
+def client_properties(properties):
+    """The properties the map needs (MAP_CLIENT_PROPERTIES), or all of them if that is None."""
+    keep = app_config.MAP_CLIENT_PROPERTIES
+    if keep is None or not properties:
+        return properties
+    return {key: properties[key] for key in keep if key in properties}
+
+
+def payload_bytes(features):
+    """Size in bytes of features as the JSON text the widget comm sends (dates as text)."""
+    return len(json.dumps(features, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+# {"type": "Feature", "geometry": ..., "properties": ...} without the two values
+_FEATURE_FRAME_BYTES = payload_bytes({'type': 'Feature', 'geometry': None, 'properties': None}) - 2 * len('null')
+
+
+def feature_bytes(geometry_bytes, properties_bytes):
+    """payload_bytes of a feature, from the payload_bytes of its geometry and properties."""
+    return _FEATURE_FRAME_BYTES + geometry_bytes + properties_bytes
+
+
+def list_bytes(item_bytes):
+    """payload_bytes of a list, from the payload_bytes of its items."""
+    return len('[]') + sum(item_bytes) + len(', ') * max(len(item_bytes) - 1, 0)
+
+
+def _format_size(num_bytes):
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    if num_bytes < 1024 * 1024:
+        return f"{num_bytes / 1024:.1f} KB"
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+def report_line(layer_name, sent_bytes, full_bytes):
+    """Summary line: what a layer sends to the map and what this stage saved (see feature_index.payload_sizes)."""
+    saved = full_bytes - sent_bytes
+    saved_percent = 100 * saved / full_bytes if full_bytes else 0
+    return f"{layer_name}: {_format_size(sent_bytes)} sent to the map, {_format_size(saved)} ({saved_percent:.0f}%) saved"
@@ -61,4 +61,24 @@ def initialize_drawn_features_layer_on_map(m, on_click_callback):
         # This will be handled by the caller providing a pre-wrapped lambda
         app_state.drawn_features_layer.on_click(on_click_callback)
         m.add_layer(app_state.drawn_features_layer)
-    return app_state.drawn_features_layer
\ No newline at end of file
+    return app_state.drawn_features_layer
+
+def initialize_selection_overlay_layer_on_map(m, on_click_callback):
+    """
+    Initializes or retrieves the layer that shows the selected features on top of all
+    other layers (SELECTION_RENDER_MODE "overlay"). Clicking a feature on it deselects it.
+    """
+    from . import state as app_state # Local import to avoid circular issues at module load time
+
+    existing_layer = m.find_layer(app_config.SELECTION_OVERLAY_LAYER_NAME)
+    if existing_layer:
+        app_state.selection_overlay_layer = existing_layer
+    else:
+        app_state.selection_overlay_layer = ipyleaflet.GeoJSON(
+            data={"type": "FeatureCollection", "features": []},
+            name=app_config.SELECTION_OVERLAY_LAYER_NAME,
+            style={},
+        )
+        app_state.selection_overlay_layer.on_click(on_click_callback)
+        m.add_layer(app_state.selection_overlay_layer)
+    return app_state.selection_overlay_layer
@@ -0,0 +1,104 @@
+# nrw_geotools/persistence.py
+#
+# Background writer for everything the UI persists to disk: the GeoJSON copies of the
+# layers (fetched WFS data, kept selections) and the local feature store. GeoJSON is
+# serialized directly from the feature dicts instead of going through a GeoDataFrame
+# again, and on a worker thread so the UI never waits on disk. Jobs with the same key
+# (the target path) are coalesced: only the latest one runs.
+
+import atexit
+import functools
+import json
+import os
+import threading
+import uuid
+
+_cond = threading.Condition()
+_pending = {} # key -> callable, in submission order; a newer submit for a key replaces its job
+_batches = [] # [remaining keys, on_done, done keys, failures {key: error}]
+_writing = 0
+_thread = None
+_EXIT_FLUSH_TIMEOUT_SECONDS = 60
+
+
+def write_geojson(path, features):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp" # Unique: another writer may be saving the same path
+    with open(tmp_path, 'w', encoding='utf-8') as f_out:
+        # default=str covers dates and other non-JSON property values, as GDAL's writer does.
+        json.dump({"type": "FeatureCollection", "features": features}, f_out, default=str)
+    os.replace(tmp_path, path)
+
+
+def _writer_loop():
+    global _writing
+    while True:
+        with _cond:
+            while not _pending:
+                _cond.wait()
+            key = next(iter(_pending))
+            job = _pending.pop(key)
+            _writing += 1
+        error = None
+        try:
+            job()
+        except Exception as e_write:
+            error = e_write
+        finished_batches = []
+        with _cond:
+            _writing -= 1
+            for batch in _batches:
+                remaining, _, done_keys, failures = batch
+                if key in remaining and key not in _pending:
+                    remaining.discard(key)
+                    if error is None:
+                        done_keys.append(key)
+                    else:
+                        failures[key] = error
+                    if not remaining:
+                        finished_batches.append(batch)
+            for batch in finished_batches:
+                _batches.remove(batch)
+            _cond.notify_all()
+        for _, on_done, done_keys, failures in finished_batches:
+            if on_done is not None:
+                try:
+                    on_done(done_keys, failures)
+                except Exception:
+                    pass
+
+
+def run_async(jobs, on_done=None):
+    """
+    Queues {key: callable} on the writer thread and returns immediately. on_done(done_keys,
+    failures) is called from the writer thread once every job of this call has run;
+    failures maps key -> exception. A queued job is replaced by a newer one with the same key.
+    """
+    global _thread
+    if not jobs:
+        if on_done is not None:
+            on_done([], {})
+        return
+    with _cond:
+        _pending.update(jobs)
+        _batches.append([set(jobs), on_done, [], {}])
+        if _thread is None:
+            _thread = threading.Thread(target=_writer_loop, name="nrw_geotools-writer", daemon=True)
+            _thread.start()
+            # The writer is a daemon thread; without this, exiting mid-write (GDAL for the local
+            # store) loses the write or crashes the interpreter.
+            atexit.register(flush, _EXIT_FLUSH_TIMEOUT_SECONDS)
+        _cond.notify_all()
+
+
+def save_geojson_async(jobs, on_done=None):
+    """
+    Queues {path: features} for writing as GeoJSON FeatureCollections (EPSG:4326), see run_async.
+    The feature lists are copied, the feature dicts themselves must not be mutated in place.
+    """
+    run_async({path: functools.partial(write_geojson, path, list(features)) for path, features in jobs.items()}, on_done)
+
+
+def flush(timeout=None):
+    """Blocks until all queued writes are done. Returns False if the timeout expired first."""
+    with _cond:
+        return _cond.wait_for(lambda: not _pending and _writing == 0, timeout=timeout)
@@ -0,0 +1,74 @@
+# nrw_geotools/projection.py
+#
+# Shared CRS transformation service. pyproj Transformers are expensive to build, so they
+# are created once per (source, target) CRS pair and reused by every module. Geometries
+# are reprojected in one vectorized pass: shapely.transform hands all coordinates of all
+# geometries to pyproj as a single array.
+
+import threading
+
+import numpy as np
+import shapely
+import shapely.geometry
+from pyproj import Transformer
+
+_transformers = {}
+_transformers_lock = threading.Lock()
+
+
+def _normalise_crs(crs):
+    return crs.to_string() if hasattr(crs, 'to_string') else str(crs)
+
+
+def get_transformer(source_crs, target_crs):
+    """Cached always_xy Transformer for the CRS pair (pyproj Transformers are thread-safe)."""
+    key = (_normalise_crs(source_crs), _normalise_crs(target_crs))
+    with _transformers_lock:
+        transformer = _transformers.get(key)
+        if transformer is None:
+            transformer = Transformer.from_crs(key[0], key[1], always_xy=True)
+            _transformers[key] = transformer
+        return transformer
+
+
+def is_same_crs(source_crs, target_crs):
+    return _normalise_crs(source_crs).upper() == _normalise_crs(target_crs).upper()
+
+
+def transform_point(x, y, source_crs, target_crs):
+    return get_transformer(source_crs, target_crs).transform(x, y)
+
+
+def _transform_coords(transformer):
+    def transform_array(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack((x, y))
+    return transform_array
+
+
+def reproject_geometries(geometries, source_crs, target_crs):
+    """Reprojects an array/list of shapely geometries (None allowed) in one coordinate pass."""
+    geometries = np.asarray(geometries, dtype=object)
+    if is_same_crs(source_crs, target_crs) or geometries.size == 0:
+        return geometries
+    return shapely.transform(geometries, _transform_coords(get_transformer(source_crs, target_crs)))
+
+
+def reproject_features(features, source_crs, target_crs):
+    """Reprojects the geometries of GeoJSON feature dicts in place and returns the list."""
+    if is_same_crs(source_crs, target_crs) or not features:
+        return features
+    geometries = [shapely.geometry.shape(f['geometry']) if f.get('geometry') else None for f in features]
+    reprojected = reproject_geometries(geometries, source_crs, target_crs)
+    for feature_dict_item, geometry in zip(features, reprojected):
+        if geometry is not None:
+            feature_dict_item['geometry'] = shapely.geometry.mapping(geometry)
+    return features
+
+
+def reproject_gdf(gdf, target_crs):
+    """Like gdf.to_crs(target_crs), but through the cached transformer."""
+    if gdf.crs is None or is_same_crs(gdf.crs, target_crs):
+        return gdf
+    reprojected = reproject_geometries(gdf.geometry.values, gdf.crs, target_crs)
+    return gdf.set_geometry(list(reprojected), crs=target_crs)
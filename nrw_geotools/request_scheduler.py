@@ -0,0 +1,241 @@
+# nrw_geotools/request_scheduler.py
+#
+# Keeps the GetFeature traffic polite towards wfs.nrw.de: a token bucket caps the request
+# rate, and the number of requests in flight adapts AIMD-style. Every healthy response
+# adds 1/limit to the concurrency limit (about +1 per round trip of requests); OGC
+# exception reports, 429/503 answers, timeouts and latency spikes halve it, at most once
+# per cooldown period. Cache hits never reach the scheduler. One scheduler per process;
+# processes running side by side (the CLI's worker pool) split the limits with
+# share_limits.
+
+import contextlib
+import threading
+import time
+
+from . import config as app_config
+
+_CONGESTION_STATUS_CODES = (429, 503)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_processes_sharing = 1 # Processes the configured limits are split between, see share_limits
+
+
+class RequestAbandoned(Exception):
+    """Raised instead of admitting a request whose should_abandon() became true while it waited."""
+
+
+class RequestScheduler:
+    """
+    Admission control for outgoing WFS requests. Use `with scheduler.request() as ticket:`,
+    or `ticket = scheduler.admit()` ... `ticket.finish()` when the slot must outlive a block.
+    """
+
+    def __init__(self, rate_per_second, burst, min_concurrency, max_concurrency, initial_concurrency):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self._cond = threading.Condition()
+        self._limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self._tokens = float(burst)
+        self._tokens_updated_at = time.monotonic()
+        self._in_flight = 0
+        self._queued = 0
+        self._latency_baseline = None # EWMA of healthy response times, seconds
+        self._last_decrease_at = 0.0
+        self._counts = {'requests': 0, 'backoffs': 0, 'congestion_signals': 0}
+        self._last_backoff_reason = None
+
+    # --- Admission ---
+
+    def _refill_tokens_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._tokens_updated_at) * self.rate_per_second)
+        self._tokens_updated_at = now
+
+    def _acquire(self, should_abandon=None):
+        # Waiters with should_abandon wake up at least every 0.25 s to check it.
+        max_wait = 0.25 if should_abandon is not None else None
+        with self._cond:
+            self._queued += 1
+            try:
+                while True:
+                    if should_abandon is not None and should_abandon():
+                        raise RequestAbandoned()
+                    if self._in_flight < int(self._limit):
+                        self._refill_tokens_locked()
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            break
+                        token_wait = (1 - self._tokens) / self.rate_per_second
+                        self._cond.wait(token_wait if max_wait is None else min(token_wait, max_wait))
+                    else:
+                        self._cond.wait(max_wait)
+            finally:
+                self._queued -= 1
+            self._in_flight += 1
+            self._counts['requests'] += 1
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def admit(self, should_abandon=None):
+        """
+        Waits for a rate token and a free slot and returns the ticket holding the slot until
+        its finish() is called, for requests that outlive a block (e.g. a streamed body).
+        Raises RequestAbandoned if should_abandon() becomes true while waiting.
+        """
+        self._acquire(should_abandon)
+        return _RequestTicket(self)
+
+    @contextlib.contextmanager
+    def request(self, should_abandon=None):
+        """Like admit(), but holds the slot until the block exits."""
+        ticket = self.admit(should_abandon)
+        try:
+            yield ticket
+        except Exception as e_request:
+            ticket.record_error(e_request)
+            raise
+        finally:
+            ticket.finish()
+
+    def abandoning_if(self, should_abandon):
+        """This scheduler as seen by one caller whose waiting requests give up once should_abandon() is true."""
+        return _AbandoningScheduler(self, should_abandon)
+
+    # --- Feedback ---
+
+    def _record_healthy(self, latency):
+        with self._cond:
+            baseline = self._latency_baseline
+            spike_threshold = None if baseline is None else max(
+                baseline * app_config.WFS_LATENCY_SPIKE_FACTOR, app_config.WFS_LATENCY_SPIKE_MIN_SECONDS
+            )
+            if spike_threshold is not None and latency > spike_threshold:
+                self._decrease_locked(f"latency spike ({latency:.1f}s)")
+                return
+            self._latency_baseline = latency if baseline is None else 0.8 * baseline + 0.2 * latency
+            self._limit = min(self.max_concurrency, self._limit + 1.0 / max(self._limit, 1.0))
+            self._cond.notify_all()
+
+    def note_congestion(self, reason):
+        """Reports a congestion signal found after the request, e.g. an OGC ExceptionReport in the body."""
+        with self._cond:
+            self._decrease_locked(reason)
+
+    def _decrease_locked(self, reason):
+        self._counts['congestion_signals'] += 1
+        now = time.monotonic()
+        # Requests already in flight during a congestion event tend to fail together: count them once.
+        if now - self._last_decrease_at < app_config.WFS_BACKOFF_COOLDOWN_SECONDS:
+            return
+        self._last_decrease_at = now
+        self._limit = max(float(self.min_concurrency), self._limit / 2)
+        self._counts['backoffs'] += 1
+        self._last_backoff_reason = reason
+
+    def stats(self):
+        """Snapshot: concurrency limit, requests in flight / waiting, tokens, latency baseline and counters."""
+        with self._cond:
+            self._refill_tokens_locked()
+            return {
+                'concurrency_limit': int(self._limit),
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'tokens': round(self._tokens, 2),
+                'latency_baseline_s': None if self._latency_baseline is None else round(self._latency_baseline, 3),
+                'last_backoff_reason': self._last_backoff_reason,
+                **self._counts,
+            }
+
+
+class _AbandoningScheduler:
+    def __init__(self, scheduler, should_abandon):
+        self._scheduler = scheduler
+        self._should_abandon = should_abandon
+
+    def admit(self):
+        return self._scheduler.admit(self._should_abandon)
+
+    def request(self):
+        return self._scheduler.request(self._should_abandon)
+
+    def note_congestion(self, reason):
+        self._scheduler.note_congestion(reason)
+
+
+class _RequestTicket:
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self._started_at = time.monotonic()
+        self._recorded = False
+        self._finished = False
+
+    def record_response(self, resp):
+        if self._recorded:
+            return
+        self._recorded = True
+        if resp.status_code in _CONGESTION_STATUS_CODES:
+            self._scheduler.note_congestion(f"HTTP {resp.status_code}")
+        elif resp.status_code < 400:
+            self._scheduler._record_healthy(time.monotonic() - self._started_at)
+
+    def record_error(self, exc):
+        if self._recorded:
+            return
+        self._recorded = True
+        self._scheduler.note_congestion(f"{type(exc).__name__}")
+
+    def finish(self):
+        """Gives the slot back; later calls do nothing."""
+        if self._finished:
+            return
+        self._finished = True
+        self._scheduler._release()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            parts = _processes_sharing
+            max_concurrency = max(1, app_config.WFS_MAX_CONCURRENCY // parts)
+            _scheduler = RequestScheduler(
+                rate_per_second=app_config.WFS_RATE_LIMIT_PER_SECOND / parts,
+                burst=max(1, app_config.WFS_RATE_LIMIT_BURST // parts),
+                min_concurrency=1,
+                max_concurrency=max_concurrency,
+                initial_concurrency=min(app_config.WFS_INITIAL_CONCURRENCY, max_concurrency),
+            )
+        return _scheduler
+
+
+def share_limits(processes):
+    """
+    Declares this process one of processes that fetch side by side, e.g. as a process pool
+    initializer: its scheduler gets that share of the configured rate, burst and concurrency
+    (at least one request at a time), so together they stay within the limits.
+    """
+    global _processes_sharing, _scheduler
+    with _scheduler_lock:
+        _processes_sharing = max(1, processes)
+        _scheduler = None
+
+
+def reset_scheduler():
+    """Drops the scheduler; the next request builds a new one from the current config."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = None
+
+
+def format_stats(stats):
+    line = (f"Request scheduler: concurrency limit {stats['concurrency_limit']}, {stats['in_flight']} in flight, "
+            f"{stats['queued']} queued, {stats['requests']} request(s), {stats['backoffs']} back-off(s)")
+    if stats['last_backoff_reason']:
+        line += f" (last: {stats['last_backoff_reason']})"
+    return line
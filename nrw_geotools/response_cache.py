@@ -0,0 +1,350 @@
+# nrw_geotools/response_cache.py
+#
+# Content-addressed on-disk cache for GET responses (used for WFS GetFeature).
+# Entries are keyed by URL + the full, normalised query parameters, stay fresh for
+# RESPONSE_CACHE_TTL_SECONDS, are revalidated with ETag / Last-Modified once stale,
+# and the least recently used entries are evicted beyond RESPONSE_CACHE_MAX_BYTES.
+# Concurrent misses for the same key are coalesced: one request goes to the network,
+# the others wait for its entry and are answered from disk. Several processes (e.g. CLI
+# workers) may share the cache directory: temporary files have unique names, a reader
+# that finds half an entry treats it as a miss, and the index is rescanned from the
+# directory before evicting, so the size cap holds for the directory's contents.
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from . import config as app_config
+from . import http_client
+
+CACHE_HIT = 'hit'
+CACHE_MISS = 'miss'
+CACHE_REVALIDATED = 'revalidated'
+CACHE_COALESCED = 'coalesced'
+
+_lock = threading.Lock()
+_index = None # key -> {'size': bytes, 'last_used': epoch seconds}; built lazily from the cache dir, then kept up to date
+_indexed_bytes = 0 # Sum of the index's sizes
+_writes_since_scan = 0
+_in_flight = {} # key -> threading.Event, set when the leading request for the key has finished
+
+
+class CachedResponse:
+    """The subset of requests.Response used by the callers, backed by a cache entry."""
+    status_code = 200
+
+    def __init__(self, content, headers):
+        self.content = content
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=65536, decode_unicode=False):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _CacheFillingResponse:
+    """
+    Wraps a live response requested with stream=True. While the caller iterates
+    iter_content() the body is spooled to a partial file next to the cache entry, and
+    it only becomes an entry if the stream is read to the end, so a caller that stops
+    early (e.g. on an exception report) leaves nothing behind. Reading .content instead
+    buffers the body and stores it when is_cacheable accepts it.
+    """
+
+    def __init__(self, resp, key, meta, is_cacheable, releases_in_flight=False):
+        self._resp = resp
+        self._key = key
+        self._meta = meta
+        self._is_cacheable = is_cacheable
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+        self._holds_in_flight = releases_in_flight
+
+    def raise_for_status(self):
+        self._resp.raise_for_status()
+
+    def json(self):
+        return json.loads(self.content)
+
+    @property
+    def content(self):
+        body = self._resp.content
+        if self._is_cacheable is None or self._is_cacheable(CachedResponse(body, self.headers)):
+            _write_entry(self._key, self._meta, body)
+        self._finish()
+        return body
+
+    def _finish(self):
+        # Wakes requests coalesced onto this one; they find the entry or, if there is none, go to the network.
+        if self._holds_in_flight:
+            self._holds_in_flight = False
+            _release_in_flight(self._key)
+
+    def iter_content(self, chunk_size=65536, decode_unicode=False):
+        body_path, _ = _entry_paths(self._key)
+        partial_path = f"{body_path}.{uuid.uuid4().hex}.partial"
+        completed = False
+        os.makedirs(app_config.RESPONSE_CACHE_DIR, exist_ok=True)
+        try:
+            with open(partial_path, 'wb') as f_partial:
+                for chunk in self._resp.iter_content(chunk_size=chunk_size):
+                    f_partial.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            self._resp.close()
+            if completed:
+                _install_entry_file(self._key, self._meta, partial_path)
+            else:
+                try:
+                    os.remove(partial_path)
+                except OSError:
+                    pass
+            self._finish()
+
+    def close(self):
+        self._resp.close()
+        self._finish()
+
+
+def make_cache_key(url, params):
+    normalised = {str(k).upper(): str(v) for k, v in (params or {}).items()}
+    key_source = json.dumps({'url': url, 'params': normalised}, sort_keys=True)
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+
+def _entry_paths(key):
+    return (os.path.join(app_config.RESPONSE_CACHE_DIR, f"{key}.body"),
+            os.path.join(app_config.RESPONSE_CACHE_DIR, f"{key}.json"))
+
+
+def _scan_index():
+    # The body file's mtime doubles as the LRU timestamp, so the scan also sees other processes' reads.
+    index = {}
+    os.makedirs(app_config.RESPONSE_CACHE_DIR, exist_ok=True)
+    for fname in os.listdir(app_config.RESPONSE_CACHE_DIR):
+        if fname.endswith('.body'):
+            body_path = os.path.join(app_config.RESPONSE_CACHE_DIR, fname)
+            try:
+                stat = os.stat(body_path)
+            except OSError:
+                continue
+            index[fname[:-len('.body')]] = {'size': stat.st_size, 'last_used': stat.st_mtime}
+    return index
+
+
+def _rescan_index_locked():
+    global _index, _indexed_bytes, _writes_since_scan
+    _index = _scan_index()
+    _indexed_bytes = sum(entry['size'] for entry in _index.values())
+    _writes_since_scan = 0
+    return _index
+
+
+def _load_index():
+    if _index is None:
+        return _rescan_index_locked()
+    return _index
+
+
+def _index_entry_locked(key, size, last_used):
+    global _indexed_bytes
+    previous = _load_index().get(key)
+    _indexed_bytes += size - (previous['size'] if previous else 0)
+    _index[key] = {'size': size, 'last_used': last_used}
+
+
+def _read_entry(key):
+    body_path, meta_path = _entry_paths(key)
+    with _lock:
+        # An entry missing from the index may have been written by another process since it was built.
+        if key not in _load_index() and not os.path.exists(body_path):
+            return None, None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f_meta:
+                meta = json.load(f_meta)
+            with open(body_path, 'rb') as f_body:
+                content = f_body.read()
+        except OSError:
+            # Being installed (the body is in place before its meta) or evicted by another process: a miss, the entry stays.
+            return None, None
+        except ValueError:
+            _remove_entry_locked(key)
+            return None, None
+        # The body file's mtime doubles as the LRU timestamp.
+        now = time.time()
+        try:
+            os.utime(body_path, (now, now))
+        except OSError:
+            pass # Evicted by another process since it was read
+        _index_entry_locked(key, len(content), now)
+    return meta, content
+
+
+def _write_entry(key, meta, content):
+    body_path, _ = _entry_paths(key)
+    tmp_path = f"{body_path}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(app_config.RESPONSE_CACHE_DIR, exist_ok=True)
+    with open(tmp_path, 'wb') as f_tmp:
+        f_tmp.write(content)
+    _install_entry_file(key, meta, tmp_path)
+
+
+def _install_entry_file(key, meta, body_tmp_path):
+    # The body goes in before its meta: a reader in between sees the old meta (stale, so it
+    # revalidates) or none (a miss), never a new meta that would vouch for the old body.
+    global _writes_since_scan
+    body_path, meta_path = _entry_paths(key)
+    with _lock:
+        size = os.path.getsize(body_tmp_path)
+        os.replace(body_tmp_path, body_path)
+        _write_meta_locked(meta_path, meta)
+        _index_entry_locked(key, size, time.time())
+        _writes_since_scan += 1
+        _evict_locked()
+
+
+def _write_meta_locked(meta_path, meta):
+    meta_tmp_path = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+    with open(meta_tmp_path, 'w', encoding='utf-8') as f_meta:
+        json.dump(meta, f_meta)
+    os.replace(meta_tmp_path, meta_path)
+
+
+def _touch_entry_meta(key, meta):
+    _, meta_path = _entry_paths(key)
+    with _lock:
+        _write_meta_locked(meta_path, meta)
+
+
+def _remove_entry_locked(key):
+    global _indexed_bytes
+    for path in _entry_paths(key):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    entry = _load_index().pop(key, None)
+    if entry is not None:
+        _indexed_bytes -= entry['size']
+
+
+def _evict_locked():
+    # This index only knows the entries this process wrote or read since the last scan:
+    # rescan when it reaches the cap, and every RESPONSE_CACHE_RESCAN_WRITES writes for
+    # the entries other processes sharing the directory add.
+    if _indexed_bytes <= app_config.RESPONSE_CACHE_MAX_BYTES and _writes_since_scan < app_config.RESPONSE_CACHE_RESCAN_WRITES:
+        return
+    _rescan_index_locked()
+    if _indexed_bytes <= app_config.RESPONSE_CACHE_MAX_BYTES:
+        return
+    for key, _ in sorted(_index.items(), key=lambda item: item[1]['last_used']):
+        _remove_entry_locked(key)
+        if _indexed_bytes <= app_config.RESPONSE_CACHE_MAX_BYTES:
+            break
+
+
+def _claim_in_flight(key):
+    """None if the caller now leads the request for key, else the Event of the request already running."""
+    with _lock:
+        event = _in_flight.get(key)
+        if event is None:
+            _in_flight[key] = threading.Event()
+        return event
+
+
+def _release_in_flight(key):
+    with _lock:
+        event = _in_flight.pop(key, None)
+    if event is not None:
+        event.set()
+
+
+def _is_fresh(meta):
+    return meta is not None and time.time() - meta['stored_at'] < app_config.RESPONSE_CACHE_TTL_SECONDS
+
+
+def clear_cache():
+    with _lock:
+        for key in list(_rescan_index_locked().keys()):
+            _remove_entry_locked(key)
+
+
+def cached_get(url, params=None, timeout=None, is_cacheable=None, stream=False, scheduler=None, retry_reads=True):
+    """
+    GET through the response cache. Returns (response, cache_status) where cache_status is
+    CACHE_HIT (served from disk, no network), CACHE_COALESCED (served from disk after waiting
+    for an identical request already in flight), CACHE_REVALIDATED (server answered 304) or
+    CACHE_MISS. Only 200 responses for which is_cacheable(response) is true are stored.
+    With stream=True a missed response is stored once the caller has read iter_content()
+    to the end (is_cacheable is not consulted then, stop reading to reject a body).
+    Requests that reach the network go through scheduler and retry_reads (see http_client.http_get); hits do not.
+    """
+    if not app_config.RESPONSE_CACHE_ENABLED:
+        return http_client.http_get(url, params=params, timeout=timeout, stream=stream, scheduler=scheduler,
+                                    retry_reads=retry_reads), CACHE_MISS
+
+    key = make_cache_key(url, params)
+    meta, content = _read_entry(key)
+    if _is_fresh(meta):
+        return CachedResponse(content, {'content-type': meta['content_type']}), CACHE_HIT
+    leading_request = _claim_in_flight(key)
+    if leading_request is not None:
+        leading_request.wait(timeout or app_config.HTTP_DEFAULT_TIMEOUT)
+        meta, content = _read_entry(key)
+        if _is_fresh(meta):
+            return CachedResponse(content, {'content-type': meta['content_type']}), CACHE_COALESCED
+        # The other request stored nothing (error, exception report, cancelled): request it ourselves.
+        return _network_get(key, url, params, timeout, is_cacheable, stream, scheduler, retry_reads, meta, content, leading=False)
+    return _network_get(key, url, params, timeout, is_cacheable, stream, scheduler, retry_reads, meta, content, leading=True)
+
+
+def _network_get(key, url, params, timeout, is_cacheable, stream, scheduler, retry_reads, meta, content, leading):
+    request_headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            request_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            request_headers['If-Modified-Since'] = meta['last_modified']
+
+    handed_over = False # A streamed response releases the in-flight claim itself once read or closed
+    try:
+        resp = http_client.http_get(url, params=params, timeout=timeout, headers=request_headers or None, stream=stream,
+                                    scheduler=scheduler, retry_reads=retry_reads)
+        if resp.status_code == 304 and meta is not None:
+            resp.close()
+            meta['stored_at'] = time.time()
+            _touch_entry_meta(key, meta)
+            return CachedResponse(content, {'content-type': meta['content_type']}), CACHE_REVALIDATED
+
+        if resp.status_code != 200:
+            return resp, CACHE_MISS
+        new_meta = {
+            'url': url,
+            'params': {str(k): str(v) for k, v in (params or {}).items()},
+            'content_type': resp.headers.get('content-type', ''),
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'stored_at': time.time(),
+        }
+        if stream:
+            handed_over = leading
+            return _CacheFillingResponse(resp, key, new_meta, is_cacheable, releases_in_flight=leading), CACHE_MISS
+        if is_cacheable is None or is_cacheable(resp):
+            _write_entry(key, new_meta, resp.content)
+        return resp, CACHE_MISS
+    finally:
+        if leading and not handed_over:
+            _release_in_flight(key)
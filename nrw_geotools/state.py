@@ -1,12 +1,20 @@
       
 # --- Global state for the application ---
+import threading
 
 # WFS related
 all_discovered_feature_types = []
+wfs_capabilities = None # Parsed capabilities summary, see capabilities.py
+wfs_coverage_by_key = {} # (type, request params) -> shapely geometry (EPSG:25832) already fetched
+active_fetch_job = None # wfs_client.FetchJob of the fetch running in the background, if any
+active_fetch_thread = None
+wfs_layer_lock = threading.RLock() # Held while a WFS layer's data is replaced (fetch job thread vs. clicks)
 
 # Feature selection
 selected_features_by_layer = {}
 original_styles_by_layer = {}
+is_area_selecting = False # Rectangles / polygons drawn on the map select features instead of becoming drawn features
+selection_overlay_layer = None # ipyleaflet.GeoJSON showing the selection when SELECTION_RENDER_MODE is "overlay"
 
 # Editing state
 is_editing_feature = False
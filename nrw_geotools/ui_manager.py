@@ -1,8 +1,16 @@
+import contextlib
+import functools
+import threading
 import ipywidgets as widgets
 from . import config as app_config
 from . import state as app_state
+from . import feature_index
 from IPython.display import display, clear_output as ipython_clear_output
 
+_transaction_lock = threading.Lock()
+_transaction_depth = 0
+_button_states_dirty = False # update_all_button_states was called during the running transaction
+
 def create_widgets():
     widgets_dict = {}
     widgets_dict['feature_type_dropdown'] = widgets.Dropdown(
@@ -15,12 +23,34 @@ def create_widgets():
     widgets_dict['fetch_data_button'] = widgets.Button(
         description="Fetch Selected/All WFS Data", button_style='info', layout={'width': '250px'}, disabled=True
     )
+    widgets_dict['cancel_fetch_button'] = widgets.Button(
+        description="Cancel Fetch", icon="stop", button_style='danger', layout={'visibility': 'hidden'}
+    )
     widgets_dict['keep_selected_button'] = widgets.Button(
         description="Keep Only Selected Features", button_style='success', layout={'width': '200px'}, disabled=True
     )
     widgets_dict['clear_selection_button'] = widgets.Button(
         description="Clear Selection", button_style='warning', layout={'width': '150px'}, disabled=True
     )
+    widgets_dict['area_select_toggle'] = widgets.ToggleButton(
+        value=False, description="Select by Area", icon="object-group",
+        tooltip="Draw rectangles / polygons on the map to select the features they hit", layout={'width': '150px'}
+    )
+    widgets_dict['area_select_predicate_dropdown'] = widgets.Dropdown(
+        options=[('Touching the shape', 'intersects'), ('Inside the shape', 'covers')], value='intersects',
+        layout={'width': '170px'}
+    )
+    widgets_dict['area_select_layer_dropdown'] = widgets.Dropdown(
+        options=[('All feature layers', app_config.AREA_SELECT_ALL_LAYERS)], value=app_config.AREA_SELECT_ALL_LAYERS,
+        description='In:', style={'description_width': 'initial'}, layout={'width': '220px'}
+    )
+    widgets_dict['query_select_input'] = widgets.Text(
+        placeholder="e.g. gebaeudefunktion == 2000", description='Query:',
+        style={'description_width': 'initial'}, layout={'width': '380px'}
+    )
+    widgets_dict['query_select_button'] = widgets.Button(
+        description="Select by Query", icon="filter", layout={'width': '150px'}
+    )
     widgets_dict['status_output_widget'] = widgets.Output(
         layout={'border': '1px solid #ccc', 'padding': '5px', 'max_height': '150px', 'overflow_y': 'auto', 'width': '98%'}
     )
@@ -56,7 +86,8 @@ def create_widgets():
 
 def layout_widgets(widgets_dict):
     ui_line1_discovery_fetch = widgets.HBox([
-        widgets_dict['discover_button'], widgets_dict['feature_type_dropdown'], widgets_dict['fetch_data_button']
+        widgets_dict['discover_button'], widgets_dict['feature_type_dropdown'], widgets_dict['fetch_data_button'],
+        widgets_dict['cancel_fetch_button']
     ], layout=widgets.Layout(flex_flow='row wrap', justify_content='flex-start'))
 
     ui_line2_selection_edit_remove = widgets.HBox([
@@ -65,6 +96,11 @@ def layout_widgets(widgets_dict):
         widgets_dict['cut_selected_button']
     ], layout=widgets.Layout(flex_flow='row wrap', justify_content='flex-start', margin_top='5px'))
 
+    ui_line2b_area_selection = widgets.HBox([
+        widgets_dict['area_select_toggle'], widgets_dict['area_select_predicate_dropdown'],
+        widgets_dict['area_select_layer_dropdown'], widgets_dict['query_select_input'], widgets_dict['query_select_button']
+    ], layout=widgets.Layout(flex_flow='row wrap', justify_content='flex-start', margin_top='5px'))
+
     ui_line3_save_actions = widgets.HBox([
         widgets_dict['gml_filename_input'], widgets_dict['save_selected_as_gml_button']
     ], layout=widgets.Layout(flex_flow='row wrap', justify_content='flex-start', margin_top='5px'))
@@ -75,14 +111,52 @@ def layout_widgets(widgets_dict):
     ], layout=widgets.Layout(flex_flow='row wrap', justify_content='flex-start', margin_top='5px'))
 
     ui_top_controls = widgets.VBox([
-        ui_line1_discovery_fetch, ui_line2_selection_edit_remove, ui_line3_save_actions,
+        ui_line1_discovery_fetch, ui_line2_selection_edit_remove, ui_line2b_area_selection, ui_line3_save_actions,
         ui_hidden_apply_cancel_buttons, widgets_dict['editing_status_output_widget'],
         widgets_dict['status_output_widget']
     ])
     return ui_top_controls
 
+@contextlib.contextmanager
+def ui_transaction(app_context):
+    """
+    Batches the frontend updates of one operation: every changed layer gets one data
+    assignment when the transaction ends (feature_index.hold_layer_updates), map changes such
+    as added / removed layers go out as one message (hold_sync), and update_all_button_states
+    runs once at the end instead of after every step. Transactions nest; the outermost flushes.
+    """
+    global _transaction_depth, _button_states_dirty
+    with _transaction_lock:
+        _transaction_depth += 1
+    try:
+        with app_context['m'].hold_sync(), feature_index.hold_layer_updates():
+            yield
+    finally:
+        with _transaction_lock:
+            _transaction_depth -= 1
+            update_buttons = not _transaction_depth and _button_states_dirty
+            if update_buttons:
+                _button_states_dirty = False
+        if update_buttons:
+            update_all_button_states(app_context)
+
+
+def ui_operation(func):
+    """Runs an operation in a ui_transaction; app_context is its last positional argument."""
+    @functools.wraps(func)
+    def run_in_transaction(*args, **kwargs):
+        with ui_transaction(args[-1]):
+            return func(*args, **kwargs)
+    return run_in_transaction
+
+
 def update_all_button_states(app_context):
     # app_context contains 'm', 'widgets', 'config', 'state'
+    global _button_states_dirty
+    with _transaction_lock:
+        if _transaction_depth:
+            _button_states_dirty = True # Debounced: runs once when the transaction ends
+            return
     w = app_context['widgets']
     s = app_context['state']
     cfg = app_context['config']
@@ -95,21 +169,32 @@ def update_all_button_states(app_context):
 
     any_selected_at_all = num_map_features_selected > 0
     an_operation_is_active = s.is_editing_feature or s.is_cutting_operation_active
+    # While a fetch grows the WFS layers in the background, operations that rebuild them wait.
+    fetch_is_running = s.active_fetch_job is not None
+    layers_are_busy = an_operation_is_active or fetch_is_running
 
-    w['discover_button'].disabled = an_operation_is_active
+    w['discover_button'].disabled = layers_are_busy
     w['feature_type_dropdown'].disabled = an_operation_is_active or not bool(s.all_discovered_feature_types)
     w['fetch_data_button'].disabled = an_operation_is_active or not ((w['feature_type_dropdown'].value is not None) or (not s.all_discovered_feature_types and not w['feature_type_dropdown'].value))
+    w['cancel_fetch_button'].layout.visibility = 'visible' if fetch_is_running else 'hidden'
 
-    w['keep_selected_button'].disabled = an_operation_is_active or not any_selected_at_all
+    w['keep_selected_button'].disabled = layers_are_busy or not any_selected_at_all
     w['clear_selection_button'].disabled = an_operation_is_active or not any_selected_at_all
-    w['remove_selected_button'].disabled = an_operation_is_active or not any_selected_at_all
+    w['remove_selected_button'].disabled = layers_are_busy or not any_selected_at_all
 
-    w['edit_selected_feature_button'].disabled = an_operation_is_active or (num_map_features_selected != 1)
+    # Edit and cut take over the draw control, which area selection is using.
+    w['edit_selected_feature_button'].disabled = layers_are_busy or s.is_area_selecting or (num_map_features_selected != 1)
     w['apply_feature_edits_button'].layout.visibility = 'visible' if s.is_editing_feature else 'hidden'
     w['cancel_feature_edits_button'].layout.visibility = 'visible' if s.is_editing_feature else 'hidden'
 
-    w['cut_selected_button'].disabled = an_operation_is_active or (num_map_features_selected == 0)
+    w['cut_selected_button'].disabled = layers_are_busy or s.is_area_selecting or (num_map_features_selected == 0)
     w['cancel_cut_button'].layout.visibility = 'visible' if s.is_cutting_operation_active else 'hidden'
 
+    w['area_select_toggle'].disabled = an_operation_is_active
+    w['area_select_predicate_dropdown'].disabled = an_operation_is_active
+    w['area_select_layer_dropdown'].disabled = an_operation_is_active
+    w['query_select_input'].disabled = an_operation_is_active
+    w['query_select_button'].disabled = an_operation_is_active
+
     w['save_selected_as_gml_button'].disabled = an_operation_is_active or not any_selected_at_all
     w['gml_filename_input'].disabled = an_operation_is_active or not any_selected_at_all
\ No newline at end of file
@@ -1,20 +1,54 @@
 import sys
-import io
 import contextlib
 import re
+import threading
+
+# suppress_stdout_stderr is used from WFS fetch worker threads, so it must not
+# swap sys.stdout per call (threads would restore each other's streams).
+# Instead the first caller installs a filtering wrapper that drops writes from
+# every thread currently inside the context manager.
+_suppress_lock = threading.Lock()
+_suppress_depth = 0
+_suppressed_thread_ids = set()
+_saved_streams = None
+
+class _ThreadFilteredStream:
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def write(self, text):
+        if threading.get_ident() in _suppressed_thread_ids:
+            return len(text)
+        return self._wrapped.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
 
 @contextlib.contextmanager
 def suppress_stdout_stderr():
-    original_stdout, original_stderr = sys.stdout, sys.stderr
-    sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+    global _suppress_depth, _saved_streams
+    thread_id = threading.get_ident()
+    with _suppress_lock:
+        if _suppress_depth == 0:
+            _saved_streams = (sys.stdout, sys.stderr)
+            sys.stdout, sys.stderr = _ThreadFilteredStream(sys.stdout), _ThreadFilteredStream(sys.stderr)
+        _suppress_depth += 1
+        already_suppressed = thread_id in _suppressed_thread_ids
+        _suppressed_thread_ids.add(thread_id)
     try:
         yield
     finally:
-        sys.stdout, sys.stderr = original_stdout, original_stderr
+        with _suppress_lock:
+            if not already_suppressed:
+                _suppressed_thread_ids.discard(thread_id)
+            _suppress_depth -= 1
+            if _suppress_depth == 0:
+                sys.stdout, sys.stderr = _saved_streams
+                _saved_streams = None
 
 def sanitize_filename(filename_base):
     sane_filename_base = re.sub(r'[^\w\-_.]+', '_', filename_base)
     sane_filename_base = re.sub(r'_+', '_', sane_filename_base).strip('_')
     if not sane_filename_base:
         sane_filename_base = "output_features" # Default if empty after sanitize
-    return sane_filename_base
\ No newline at end of file
+    return sane_filename_base
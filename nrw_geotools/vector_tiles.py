@@ -0,0 +1,213 @@
+# nrw_geotools/vector_tiles.py
+#
+# Vector tile rendering for large layers. A GeoJSON layer sends its whole FeatureCollection
+# through the widget comm, which stops working at tens of thousands of features. A layer
+# bound to a TileSource (see feature_index.bind_tile_source) instead keeps its GeoJSON data
+# empty while it is large, and a companion ipyleaflet.VectorTileLayer draws it from Mapbox
+# Vector Tiles cut on request from the layer's FeatureStore: STRtree query for the tile,
+# reprojection to Web Mercator, clipping, simplification to the tile resolution, encoding.
+# The tiles come from a small HTTP server in this process (daemon threads), so the browser
+# only holds the tiles in view. Tile features carry the feature's _temp_id and style, and
+# clicks on them resolve through the FeatureStore like clicks on GeoJSON features.
+# Needs mapbox_vector_tile; without it enabled() is False and layers stay GeoJSON.
+
+import collections
+import http.server
+import re
+import threading
+import uuid
+import weakref
+
+import numpy as np
+import shapely
+
+from . import config as app_config
+from . import projection
+
+try:
+    import mapbox_vector_tile
+    from mapbox_vector_tile.encoder import on_invalid_geometry_make_valid
+except ImportError: # Optional: layers are rendered as GeoJSON only
+    mapbox_vector_tile = None
+
+TILE_LAYER_NAME = "features" # The one MVT layer in each tile
+FEATURE_ID_PROPERTY = '_temp_id'
+# VectorGrid style: every tile feature carries its Leaflet path style; polygons are filled.
+LAYER_STYLES = (
+    "{%s: function(properties, zoom, geometryDimension) {"
+    " return Object.assign({fill: geometryDimension === 3, radius: 4}, properties); }}" % TILE_LAYER_NAME
+)
+_STYLE_PROPERTIES = ('color', 'weight', 'opacity', 'fillColor', 'fillOpacity', 'stroke', 'fill', 'dashArray')
+_EXTENT = 4096 # Tile coordinate units per tile side
+_BUFFER = 64 # Units drawn beyond the tile edge, so outlines do not show the tile borders
+_TOLERANCE_UNITS = 4 # Simplification tolerance; a 256 px tile shows 16 units per pixel
+_WEB_MERCATOR_HALF_SIZE = 20037508.342789244
+_TILE_PATH = re.compile(r"^/([0-9a-f]+)/\d+/(\d+)/(\d+)/(\d+)\.pbf$")
+
+_sources = weakref.WeakValueDictionary() # key -> TileSource
+_server = None
+_server_lock = threading.Lock()
+
+
+def enabled():
+    return app_config.VECTOR_TILES_ENABLED and mapbox_vector_tile is not None
+
+
+def tile_bounds(z, x, y):
+    """(minx, miny, maxx, maxy) of tile z/x/y in EPSG:3857."""
+    size = 2 * _WEB_MERCATOR_HALF_SIZE / (1 << z)
+    minx = -_WEB_MERCATOR_HALF_SIZE + x * size
+    maxy = _WEB_MERCATOR_HALF_SIZE - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def encode_tile(store, z, x, y):
+    """Mapbox Vector Tile (bytes) of the FeatureStore's features in tile z/x/y."""
+    bounds = tile_bounds(z, x, y)
+    unit = (bounds[2] - bounds[0]) / _EXTENT
+    minx, miny = bounds[0] - _BUFFER * unit, bounds[1] - _BUFFER * unit
+    maxx, maxy = bounds[2] + _BUFFER * unit, bounds[3] + _BUFFER * unit
+    lon_min, lat_min = projection.transform_point(minx, miny, "EPSG:3857", "EPSG:4326")
+    lon_max, lat_max = projection.transform_point(maxx, maxy, "EPSG:3857", "EPSG:4326")
+    positions = np.sort(store.tree().query(shapely.box(lon_min, lat_min, lon_max, lat_max)))
+    if not len(positions):
+        return b""
+    geometries = projection.reproject_geometries(store.geometries()[positions], "EPSG:4326", "EPSG:3857")
+    tolerance = _TOLERANCE_UNITS * unit
+    geometries = shapely.simplify(shapely.clip_by_rect(geometries, minx, miny, maxx, maxy), tolerance)
+    # Polygons smaller than a tolerance square would not cover a visible part of a pixel.
+    drawn = ~(shapely.is_empty(geometries) | shapely.is_missing(geometries))
+    drawn &= (shapely.get_dimensions(geometries) < 2) | (shapely.area(geometries) >= tolerance * tolerance)
+    tile_features = []
+    for position, geometry in zip(positions[drawn].tolist(), geometries[drawn]):
+        properties = store.features[position].get('properties') or {}
+        style = properties.get('style') or app_config.DEFAULT_FEATURE_STYLE
+        tile_properties = {key: style[key] for key in _STYLE_PROPERTIES if key in style}
+        if properties.get(FEATURE_ID_PROPERTY) is not None:
+            tile_properties[FEATURE_ID_PROPERTY] = properties[FEATURE_ID_PROPERTY]
+        tile_features.append({'geometry': geometry, 'properties': tile_properties})
+    if not tile_features:
+        return b""
+    return mapbox_vector_tile.encode(
+        {'name': TILE_LAYER_NAME, 'features': tile_features},
+        default_options={'quantize_bounds': bounds, 'extents': _EXTENT, 'on_invalid_geometry': on_invalid_geometry_make_valid}
+    )
+
+
+class _TileRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = _TILE_PATH.match(self.path.split('?', 1)[0])
+        source = _sources.get(match.group(1)) if match else None
+        if source is None:
+            self.send_error(404)
+            return
+        try:
+            body = source.tile(*(int(value) for value in match.groups()[1:]))
+        except Exception as e_tile:
+            self.send_error(500, str(e_tile))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*") # The notebook page is served from another origin
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # One line per tile would go to the notebook's stderr
+
+
+def base_url():
+    """URL of the tile endpoint; the server is started on first use."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = http.server.ThreadingHTTPServer((app_config.VECTOR_TILE_HOST, app_config.VECTOR_TILE_PORT), _TileRequestHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="vector-tile-server", daemon=True).start()
+        host, port = _server.server_address[:2]
+    if app_config.VECTOR_TILE_PUBLIC_URL:
+        return app_config.VECTOR_TILE_PUBLIC_URL.rstrip('/')
+    return f"http://{host}:{port}"
+
+
+class TileSource:
+    """
+    Serves the tiles of one GeoJSON layer and keeps its VectorTileLayer on the map m right
+    above the layer while the layer is large enough to be tiled. When the layer leaves the
+    map, the tile layer is removed with it and the source stops serving.
+    """
+
+    def __init__(self, m, geo_layer, tile_layer):
+        self.key = uuid.uuid4().hex
+        self.tile_layer = tile_layer
+        self._map = m
+        self._geo_layer = weakref.ref(geo_layer) # feature_index holds the source per layer
+        self._store = None # FeatureStore drawn as tiles; None while the layer renders as GeoJSON
+        self._version = 0 # Part of the tile URL, so the browser fetches changed tiles again
+        self._tiles = collections.OrderedDict() # (z, x, y) -> encoded tile, least recently used first
+        self._lock = threading.Lock()
+        self._was_on_map = False
+        self._detached = False
+        _sources[self.key] = self
+        m.observe(self._on_map_layers_changed, names='layers')
+
+    def publish(self, store):
+        """
+        Makes store the layer's content. Returns True if the layer is drawn from tiles
+        (store has at least VECTOR_TILE_MIN_FEATURES features), False if it renders as GeoJSON.
+        """
+        tiled = len(store) >= app_config.VECTOR_TILE_MIN_FEATURES and not self._detached
+        with self._lock:
+            if store is self._store or (not tiled and self._store is None):
+                return tiled
+            self._store = store if tiled else None
+            self._version += 1
+            version = self._version
+            self._tiles.clear()
+        if tiled:
+            self.tile_layer.url = f"{base_url()}/{self.key}/{version}/{{z}}/{{x}}/{{y}}.pbf"
+        self._sync_tile_layer()
+        return tiled
+
+    def tile(self, z, x, y):
+        """Encoded tile z/x/y of the current store (empty while the layer is not tiled)."""
+        with self._lock:
+            store, version = self._store, self._version
+            body = self._tiles.get((z, x, y))
+            if body is not None:
+                self._tiles.move_to_end((z, x, y))
+                return body
+        if store is None:
+            return b""
+        body = encode_tile(store, z, x, y)
+        with self._lock:
+            if self._version == version:
+                self._tiles[(z, x, y)] = body
+                while len(self._tiles) > app_config.VECTOR_TILE_CACHE_SIZE:
+                    self._tiles.popitem(last=False)
+        return body
+
+    def _on_map_layers_changed(self, change):
+        self._sync_tile_layer()
+
+    def _sync_tile_layer(self):
+        m, tile_layer = self._map, self.tile_layer
+        geo_layer = self._geo_layer()
+        geo_on_map = geo_layer is not None and geo_layer in m.layers
+        self._was_on_map = self._was_on_map or geo_on_map
+        if geo_on_map and self._store is not None:
+            if tile_layer not in m.layers:
+                layers = list(m.layers)
+                layers.insert(layers.index(geo_layer) + 1, tile_layer)
+                m.layers = tuple(layers)
+            return
+        if tile_layer in m.layers:
+            m.remove_layer(tile_layer)
+        if self._was_on_map and not geo_on_map and not self._detached: # Layer removed from the map: detach for good
+            self._detached = True
+            m.unobserve(self._on_map_layers_changed, names='layers')
+            _sources.pop(self.key, None)
+            with self._lock:
+                self._store = None
+                self._tiles.clear()
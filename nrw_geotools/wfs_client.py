@@ -0,0 +1,433 @@
+# nrw_geotools/wfs_client.py
+#
+# Widget-free WFS GetFeature engine shared by the notebook UI (wfs_handler.py) and the
+# headless API (core.py): paging, tiling with timeout subdivision, streaming parse and
+# the threaded fetch of many (feature type, tile) requests. Nothing in here may import
+# ipywidgets / ipyleaflet or print; results and errors are returned as data.
+
+import collections
+import concurrent.futures
+import copy
+import io
+import itertools
+import json
+import math
+import os
+import queue
+import re
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+
+import geopandas as gpd
+import numpy as np
+import requests
+import shapely.geometry
+
+from . import config as app_config
+from . import utils
+from . import response_cache
+from . import gml_stream
+from . import local_store
+from . import projection
+from . import request_scheduler
+
+SRS_NAME_25832 = "urn:ogc:def:crs:EPSG::25832"
+SRS_NAME_4326 = "urn:ogc:def:crs:EPSG::4326"
+_EXCEPTION_REPORT_REASON = "Server OGC Exception (XML)"
+
+
+class WFSFetchError(Exception):
+    """Raised by the page generator with the short reason reported in the fetch summary."""
+
+
+class FetchCancelled(Exception):
+    """Raised by the page generator instead of requesting another page for a cancelled FetchJob."""
+
+
+class FetchJob:
+    """
+    Handle of one fetch run, shared by the caller and the workers. cancel() is safe from any
+    thread: tiles not started yet are dropped and no further pages are requested. With
+    abort_downloads=False the pages already downloading still finish into the response
+    cache (without being delivered), so a superseding job asking for them is served from there.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.job_id = next(FetchJob._ids)
+        self.cancel_reason = None
+        self.abort_downloads = True
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason="cancelled", abort_downloads=True):
+        if self._cancelled.is_set():
+            return
+        self.cancel_reason = reason
+        self.abort_downloads = abort_downloads
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+def iter_feature_pages(ft_fetch, bbox, srs_name_req, cache_counts, job=None):
+    """
+    Generator over the GetFeature result of one feature type within bbox, one batch at a time.
+    Each yielded item is a list of GeoJSON feature dicts in EPSG:4326, already carrying
+    '_temp_id' and 'style'. With config.WFS_PAGING_ENABLED the request is repeated with
+    STARTINDEX/COUNT until the result set is exhausted or WFS_MAX_FEATURES_PER_TYPE_PAGED
+    is reached (per tile); otherwise a single request limited to MAX_FEATURES_PER_TYPE_FETCH is made.
+    With WFS_STREAMING_PARSE a GML page arrives as several batches while it downloads.
+    Response cache hits/misses are tallied in the cache_counts Counter. Once job is
+    cancelled, FetchCancelled is raised instead of requesting the next page.
+    """
+    if app_config.WFS_PAGING_ENABLED:
+        page_size = app_config.WFS_PAGE_SIZE
+        feature_cap = app_config.WFS_MAX_FEATURES_PER_TYPE_PAGED
+    else:
+        page_size = feature_cap = app_config.MAX_FEATURES_PER_TYPE_FETCH
+
+    sane_name = ft_fetch.replace(':', '_').replace('/', '_')
+    bbox_req_str = format_request_bbox(bbox, srs_name_req)
+    start_index = 0
+    while start_index < feature_cap:
+        if job is not None and job.cancelled:
+            raise FetchCancelled(job.cancel_reason)
+        count = min(page_size, feature_cap - start_index)
+        params = {
+            "SERVICE": "WFS", "VERSION": "2.0.0", "REQUEST": "GetFeature",
+            "TYPENAMES": ft_fetch, "BBOX": bbox_req_str, "SRSNAME": srs_name_req, "COUNT": count
+        }
+        if app_config.WFS_PAGING_ENABLED:
+            params["STARTINDEX"] = start_index
+
+        page_feature_count, number_matched = 0, None
+        for batch_features, number_matched in _iter_page_batches(params, sane_name, srs_name_req, cache_counts, job):
+            page_feature_count += len(batch_features)
+            yield tag_features_for_display(batch_features)
+        if page_feature_count == 0:
+            return
+
+        start_index += page_feature_count
+        if not app_config.WFS_PAGING_ENABLED or page_feature_count < count:
+            return
+        if number_matched is not None and start_index >= number_matched:
+            return
+
+
+def _is_exception_report(content):
+    return b"<ows:ExceptionReport" in content or b"<ServiceExceptionReport" in content or b"<wfs:ExceptionReport" in content
+
+
+def _crs_from_srs_name(srs_name_req):
+    return "EPSG:4326" if srs_name_req.endswith("4326") else "EPSG:25832"
+
+
+def _iter_page_batches(params, sane_name, srs_name_req, cache_counts, job=None):
+    """
+    Performs one GetFeature request through the response cache and yields
+    (features_in_epsg4326, numberMatched or None) batches. GML is parsed incrementally
+    while it downloads when config.WFS_STREAMING_PARSE is set; other responses are parsed
+    in one go and come out as a single batch.
+    """
+    streaming = app_config.WFS_STREAMING_PARSE
+    scheduler = request_scheduler.get_scheduler() if app_config.WFS_SCHEDULER_ENABLED else None
+    if scheduler is not None and job is not None:
+        scheduler = scheduler.abandoning_if(lambda: job.cancelled) # Don't send what a cancelled job queued
+    try:
+        # No read retries: a tile that times out is split (see iter_tile_pages) rather than sent again.
+        resp, cache_status = response_cache.cached_get(
+            app_config.WFS_GETFEATURE_BASE_URL, params=params, timeout=120,
+            is_cacheable=lambda r: not _is_exception_report(r.content), stream=streaming, scheduler=scheduler,
+            retry_reads=False
+        )
+    except request_scheduler.RequestAbandoned:
+        raise FetchCancelled(job.cancel_reason)
+    cache_counts[cache_status] += 1
+    try:
+        resp.raise_for_status()
+        ctype = resp.headers.get('content-type', '').lower()
+
+        if streaming and ('gml' in ctype or 'xml' in ctype):
+            feature_stream = gml_stream.GMLFeatureStream(
+                batch_size=app_config.WFS_STREAM_BATCH_SIZE, swap_axes=srs_name_req.endswith("4326")
+            )
+            try:
+                for raw_batch in feature_stream.iter_batches(resp.iter_content(chunk_size=64 * 1024)):
+                    yield projection.reproject_features(raw_batch, _crs_from_srs_name(srs_name_req), "EPSG:4326"), feature_stream.number_matched
+            except gml_stream.GMLExceptionReport:
+                raise WFSFetchError(_EXCEPTION_REPORT_REASON)
+            except ET.ParseError as e_parse:
+                raise WFSFetchError(f"GMLReadErr:ParseError-{str(e_parse)[:60]}")
+            return
+
+        gdf_data, number_matched = _parse_page_content(resp, ctype, sane_name, srs_name_req)
+        if gdf_data is None or gdf_data.empty:
+            return
+        if gdf_data.crs and gdf_data.crs.to_string().upper() != "EPSG:4326":
+            try:
+                gdf_data = projection.reproject_gdf(gdf_data, "EPSG:4326")
+            except Exception as e_reproj_gdf:
+                raise WFSFetchError(f"GDFReprojErr:{type(e_reproj_gdf).__name__}")
+        yield _plain_list_properties(gdf_data.__geo_interface__['features']), number_matched
+    except WFSFetchError as e_page:
+        # An ExceptionReport is how the WFS answers when it is overloaded: back off like on a 503.
+        if scheduler is not None and str(e_page) == _EXCEPTION_REPORT_REASON:
+            scheduler.note_congestion("OGC ExceptionReport")
+        raise
+    finally:
+        resp.close()
+
+
+def _plain_list_properties(features):
+    """
+    GDAL's list fields come out as numpy arrays. They become lists, and a list of one value
+    that value, as the streaming parser reports properties (see gml_stream).
+    """
+    for feature_dict_item in features:
+        properties = feature_dict_item['properties']
+        for key, value in properties.items():
+            if isinstance(value, np.ndarray):
+                properties[key] = value[0].item() if len(value) == 1 else value.tolist()
+    return features
+
+
+def _parse_page_content(resp, ctype, sane_name, srs_name_req):
+    """Parses a fully downloaded GetFeature response. Returns (gdf_data, numberMatched or None)."""
+    with utils.suppress_stdout_stderr():
+        if 'gml' in ctype or 'xml' in ctype:
+            if _is_exception_report(resp.content):
+                err_fname = os.path.join(app_config.DOWNLOAD_DIR, f"err_{sane_name}.xml")
+                with open(err_fname, 'wb') as f_err: f_err.write(resp.content)
+                raise WFSFetchError(_EXCEPTION_REPORT_REASON)
+            try:
+                # Parsed straight from the response bytes (GDAL /vsimem/ under the hood), no temp file.
+                gdf_data = gpd.read_file(io.BytesIO(resp.content))
+            except Exception as e_gml:
+                if app_config.WFS_DUMP_UNREADABLE_GML:
+                    prob_fname = os.path.join(app_config.DOWNLOAD_DIR, f"prob_{sane_name}.gml")
+                    with open(prob_fname, 'wb') as f_prob: f_prob.write(resp.content)
+                raise WFSFetchError(f"GMLReadErr:{type(e_gml).__name__}")
+            matched = re.search(rb'numberMatched="(\d+)"', resp.content[:4096])
+            return gdf_data, int(matched.group(1)) if matched else None
+        elif 'json' in ctype or 'geojson' in ctype:
+            json_resp = resp.json()
+            if json_resp.get("type") == "FeatureCollection" and "features" in json_resp:
+                crs_json = json_resp.get('crs', {}).get('properties', {}).get('name', srs_name_req)
+                for feature_json in json_resp["features"]:
+                    # Keep the feature id as a column, it identifies the feature across tiles.
+                    if feature_json.get('id') is not None and isinstance(feature_json.get('properties'), dict):
+                        feature_json['properties'].setdefault('gml_id', feature_json['id'])
+                gdf_data = gpd.GeoDataFrame.from_features(json_resp["features"], crs=crs_json)
+                number_matched = json_resp.get('numberMatched')
+                return gdf_data, number_matched if isinstance(number_matched, int) else None
+            raw_json_p = os.path.join(app_config.DOWNLOAD_DIR, f"{sane_name}_raw.json")
+            with open(raw_json_p, 'w') as f_json_raw: json.dump(json_resp, f_json_raw, indent=2)
+            raise WFSFetchError("NonStdJSON")
+        else:
+            raw_dat_p = os.path.join(app_config.DOWNLOAD_DIR, f"{sane_name}_raw.dat")
+            with open(raw_dat_p, 'wb') as f_raw: f_raw.write(resp.content)
+            raise WFSFetchError(f"UnexpCType:{ctype}")
+
+
+def format_request_bbox(bbox, srs_name_req):
+    minx, miny, maxx, maxy = bbox
+    if srs_name_req.endswith("4326"):
+        return f"{miny},{minx},{maxy},{maxx}" # EPSG:4326 urn means lat,lon axis order
+    return f"{minx},{miny},{maxx},{maxy}"
+
+
+def plan_tiles(bbox):
+    """
+    Splits an EPSG:25832 bbox into a grid of equally sized tiles of roughly WFS_TILE_SIZE_M.
+    For very large areas the tile size is doubled until the grid has at most
+    WFS_MAX_TILES_PER_TYPE tiles, so the request count stays bounded.
+    """
+    minx, miny, maxx, maxy = bbox
+    width, height = maxx - minx, maxy - miny
+    tile_size = app_config.WFS_TILE_SIZE_M
+    while math.ceil(width / tile_size) * math.ceil(height / tile_size) > app_config.WFS_MAX_TILES_PER_TYPE:
+        tile_size *= 2
+    nx, ny = max(1, math.ceil(width / tile_size)), max(1, math.ceil(height / tile_size))
+    step_x, step_y = width / nx, height / ny
+    return [
+        (minx + i * step_x, miny + j * step_y, minx + (i + 1) * step_x, miny + (j + 1) * step_y)
+        for j in range(ny) for i in range(nx)
+    ]
+
+
+def _split_tile(bbox):
+    minx, miny, maxx, maxy = bbox
+    midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+    return [(minx, miny, midx, midy), (midx, miny, maxx, midy), (minx, midy, midx, maxy), (midx, midy, maxx, maxy)]
+
+
+def _is_timeout(exc):
+    if isinstance(exc, requests.exceptions.Timeout):
+        return True
+    # Read timeouts surface from urllib3's Retry as ConnectionError(MaxRetryError), even without read retries.
+    return isinstance(exc, requests.exceptions.ConnectionError) and 'timed out' in str(exc).lower()
+
+
+def iter_tile_pages(ft_fetch, tile_bbox, srs_name_req, cache_counts, job=None):
+    """
+    Like iter_feature_pages, but a tile that times out is split into four sub-tiles
+    (down to WFS_MIN_TILE_SIZE_M) which are fetched instead. Pages already delivered
+    before the timeout may come again from the sub-tiles; the caller dedupes by gml:id.
+    """
+    try:
+        yield from iter_feature_pages(ft_fetch, tile_bbox, srs_name_req, cache_counts, job)
+    except Exception as e_tile:
+        tile_width = tile_bbox[2] - tile_bbox[0]
+        if not _is_timeout(e_tile) or srs_name_req.endswith("4326") or tile_width / 2 < app_config.WFS_MIN_TILE_SIZE_M:
+            raise
+        for sub_tile in _split_tile(tile_bbox):
+            yield from iter_tile_pages(ft_fetch, sub_tile, srs_name_req, cache_counts, job)
+
+
+def fetch_tile_worker(ft_fetch, tile_bbox, srs_name_req, result_queue, job=None):
+    """
+    Runs on a worker thread. Streams the pages of one feature type within one tile into
+    result_queue as ('page', ft_fetch, features) messages, followed by an optional
+    ('error', ft_fetch, reason) and always a final ('tile_done', ft_fetch, tile_result) where
+    tile_result is {'bbox', 'ok', 'cache_counts'}. A tile of a cancelled job is not 'ok'
+    and reports no error. Nothing in here may touch widgets or the map.
+    """
+    cache_counts = collections.Counter()
+    tile_ok = False
+    page_no = 0
+    pages = iter_tile_pages(ft_fetch, tile_bbox, srs_name_req, cache_counts, job)
+    try:
+        pages_dropped = False
+        for page_no, page_features in enumerate(pages, start=1):
+            if job is not None and job.cancelled:
+                if job.abort_downloads:
+                    raise FetchCancelled(job.cancel_reason)
+                pages_dropped = True # Let the page in progress finish into the response cache
+                continue
+            result_queue.put(('page', ft_fetch, page_features))
+        tile_ok = not pages_dropped
+    except FetchCancelled:
+        pass
+    except WFSFetchError as e_fetch:
+        result_queue.put(('error', ft_fetch, _describe_page_failure(str(e_fetch), page_no)))
+    except requests.exceptions.HTTPError as e_http:
+        result_queue.put(('error', ft_fetch, _describe_page_failure(f"HTTPErr:{e_http}", page_no)))
+    except Exception as e_gen:
+        result_queue.put(('error', ft_fetch, _describe_page_failure(f"Err:{type(e_gen).__name__}-{str(e_gen)[:100]}", page_no)))
+    finally:
+        pages.close() # Closes the response of a page left unfinished
+        result_queue.put(('tile_done', ft_fetch, {'bbox': tile_bbox, 'ok': tile_ok, 'cache_counts': cache_counts}))
+
+
+def coverage_key(ft_fetch, srs_name_req):
+    # Coverage only counts for requests made with the same parameters.
+    feature_limit = app_config.WFS_MAX_FEATURES_PER_TYPE_PAGED if app_config.WFS_PAGING_ENABLED else app_config.MAX_FEATURES_PER_TYPE_FETCH
+    return (ft_fetch, srs_name_req, app_config.WFS_PAGING_ENABLED, feature_limit)
+
+
+def store_params_key(srs_name_req):
+    # The local store keeps coverage across sessions, so it is keyed by the request settings only.
+    return json.dumps(list(coverage_key(None, srs_name_req)[1:]))
+
+
+def tag_features_for_display(features):
+    for feature_dict_item in features:
+        feature_dict_item['properties']['_temp_id'] = str(uuid.uuid4())
+        feature_dict_item['properties'].setdefault('style', copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE))
+    return features
+
+
+def plan_uncovered_tiles(tiles, covered_area):
+    """
+    Keeps only the parts of the tiles not yet in covered_area (an EPSG:25832 geometry or None).
+    Each remaining part is requested by its bounding box, so a small pan only costs the new
+    edge strips; any overlap with already loaded features is removed by the gml:id dedupe.
+    """
+    if covered_area is None or covered_area.is_empty:
+        return list(tiles)
+    uncovered_tiles = []
+    for tile_bbox in tiles:
+        uncovered_part = shapely.geometry.box(*tile_bbox).difference(covered_area)
+        parts = getattr(uncovered_part, 'geoms', [uncovered_part])
+        for part in parts:
+            if part.is_empty or part.area < app_config.WFS_MIN_UNCOVERED_AREA_M2:
+                continue
+            uncovered_tiles.append(part.bounds)
+    return uncovered_tiles
+
+
+def _describe_page_failure(reason, pages_received):
+    # Features of earlier pages stay on the map, so say where the tile stopped.
+    return f"{reason} (after page {pages_received})" if pages_received else reason
+
+
+def feature_identity(feature_dict):
+    # gml:id as read by GDAL (or the GeoJSON feature id); None means "cannot be deduplicated".
+    return feature_dict['properties'].get('gml_id')
+
+
+def take_from_local_store(tiles_by_type, request_bbox, srs_name_req):
+    """
+    Loads from the local store what it covers of request_bbox (EPSG:25832) for each type in
+    tiles_by_type and removes that area from the type's tiles (in place). Returns
+    ({type: (features, covered_area)}, {type: exception}) for types the store helped with / failed on.
+    """
+    store_params = store_params_key(srs_name_req)
+    request_area = shapely.geometry.box(*request_bbox)
+    store_results_by_type, store_errors = {}, {}
+    for ft_fetch, type_tiles in tiles_by_type.items():
+        if not type_tiles:
+            continue
+        try:
+            store_area = local_store.covered_area(ft_fetch, store_params)
+            if store_area is None or not store_area.intersects(request_area):
+                continue
+            store_features = local_store.load_features(ft_fetch, request_bbox, store_params)
+        except Exception as e_store:
+            store_errors[ft_fetch] = e_store
+            continue
+        store_results_by_type[ft_fetch] = (store_features, request_area.intersection(store_area))
+        tiles_by_type[ft_fetch] = plan_uncovered_tiles(type_tiles, store_area)
+    return store_results_by_type, store_errors
+
+
+def iter_fetch_events(tiles_by_type, srs_name_req, max_workers=None, job=None):
+    """
+    Fetches every (feature type, tile) of tiles_by_type ({type: [bbox, ...]}) on a thread
+    pool and yields the workers' messages on the calling thread as (kind, feature_type, payload):
+    'page' (list of features), 'error' (reason), 'tile_done' ({'bbox', 'ok', 'cache_counts'})
+    and finally one 'type_done' (None) per type once all of its tiles have finished.
+    When job is cancelled the generator stops within a fraction of a second without
+    waiting for the workers; types still pending get no 'type_done'.
+    """
+    tiles_pending_by_type = {ft_fetch: len(type_tiles) for ft_fetch, type_tiles in tiles_by_type.items() if type_tiles}
+    total_tiles = sum(tiles_pending_by_type.values())
+    if not total_tiles:
+        return
+    max_workers = max(1, min(max_workers or app_config.WFS_FETCH_MAX_WORKERS, total_tiles))
+    result_queue = queue.Queue()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for ft_fetch, type_tiles in tiles_by_type.items():
+            for tile_bbox in type_tiles:
+                executor.submit(fetch_tile_worker, ft_fetch, tile_bbox, srs_name_req, result_queue, job)
+        while tiles_pending_by_type:
+            if job is not None and job.cancelled:
+                return
+            try:
+                kind, ft_fetch, payload = result_queue.get(timeout=0.25 if job is not None else None)
+            except queue.Empty:
+                continue
+            yield kind, ft_fetch, payload
+            if kind == 'tile_done':
+                tiles_pending_by_type[ft_fetch] -= 1
+                if tiles_pending_by_type[ft_fetch] == 0:
+                    del tiles_pending_by_type[ft_fetch]
+                    yield 'type_done', ft_fetch, None
+    finally:
+        # A cancelled job's workers wind down on their own; tiles not started yet are dropped.
+        cancelled = job is not None and job.cancelled
+        executor.shutdown(wait=not cancelled, cancel_futures=cancelled)
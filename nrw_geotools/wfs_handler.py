@@ -1,25 +1,81 @@
-import requests
-import geopandas as gpd
-from pyproj import Transformer
-from owslib.wfs import WebFeatureService
 from IPython.display import clear_output as ipython_clear_output
-import xml.etree.ElementTree as ET
-import json
 import os
-import shutil
 import ipyleaflet
 import uuid
 import copy
-import ipyleaflet
+import functools
+import collections
+import threading
+import shapely.geometry
 
 
 # Import from within the package
 from . import config as app_config
 from . import state as app_state
-from . import utils
-from .ui_manager import update_all_button_states # For convenience
+from . import response_cache
+from . import capabilities as wfs_capabilities
+from . import feature_index
+from . import local_store
+from . import map_payload
+from . import persistence
+from . import projection
+from . import request_scheduler
+from . import vector_tiles
+from . import wfs_client
+from .ui_manager import update_all_button_states, ui_operation # For convenience
 from .feature_manager import on_geojson_feature_click_callback_base # Will define this in feature_manager
+from .feature_manager import sync_selection_overlay
+
+_capabilities_refresh_lock = threading.Lock()
+
+def _apply_capabilities(app_context, capabilities):
+    widgets = app_context['widgets']
+    app_state.wfs_capabilities = capabilities
+    app_state.all_discovered_feature_types = list(capabilities['feature_types'].keys())
+    if app_state.all_discovered_feature_types:
+        previous_value = widgets['feature_type_dropdown'].value
+        opts = [app_config.FETCH_ALL_BUTTON_LABEL] + sorted(list(set(app_state.all_discovered_feature_types)))
+        widgets['feature_type_dropdown'].options = opts
+        widgets['feature_type_dropdown'].value = previous_value if previous_value in opts else app_config.FETCH_ALL_BUTTON_LABEL
+
+
+def _refresh_capabilities_in_background(app_context):
+    status_output_widget = app_context['widgets']['status_output_widget']
+    if not _capabilities_refresh_lock.acquire(blocking=False):
+        return # A refresh is already running
+
+    def refresh():
+        try:
+            capabilities = wfs_capabilities.fetch_capabilities(log=lambda msg: None)
+        except Exception as e_refresh:
+            # Output widgets cannot be used as context managers from other threads, append instead.
+            status_output_widget.append_stdout(f"Background capabilities refresh failed: {e_refresh}\n")
+            return
+        finally:
+            _capabilities_refresh_lock.release()
+        _apply_capabilities(app_context, capabilities)
+        status_output_widget.append_stdout(f"Capabilities refreshed in the background: {len(app_state.all_discovered_feature_types)} types.\n")
+        update_all_button_states(app_context)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def warm_start_feature_types(app_context):
+    """Fills the feature type dropdown from the capabilities cache, if any (e.g. after a kernel restart)."""
+    cached_capabilities, is_stale = wfs_capabilities.load_cached_capabilities()
+    if cached_capabilities is None:
+        return
+    _apply_capabilities(app_context, cached_capabilities)
+    with app_context['widgets']['status_output_widget']:
+        print(f"Loaded {len(app_state.all_discovered_feature_types)} feature types from the capabilities cache.")
+        if is_stale:
+            print("Cached capabilities are stale, refreshing in the background...")
+    if is_stale:
+        _refresh_capabilities_in_background(app_context)
+    update_all_button_states(app_context)
+
 
+@ui_operation
 def discover_feature_types(app_context):
     widgets = app_context['widgets']
     status_output_widget = widgets['status_output_widget']
@@ -27,47 +83,124 @@ def discover_feature_types(app_context):
     with status_output_widget:
         ipython_clear_output(wait=True)
         print("Discovering feature types...")
-        app_state.all_discovered_feature_types = []
-        try:
-            wfs = WebFeatureService(url=app_config.WFS_CAPABILITIES_URL.split('?')[0], version='2.0.0', timeout=30)
-            app_state.all_discovered_feature_types = [content.id for content in wfs.contents]
-        except Exception as e_owslib:
-            print(f"OWSLib discovery failed: {e_owslib}. Trying direct XML parsing...")
+        cached_capabilities, is_stale = wfs_capabilities.load_cached_capabilities()
+        if cached_capabilities is not None:
+            _apply_capabilities(app_context, cached_capabilities)
+            print(f"Discovery complete (cached): {len(app_state.all_discovered_feature_types)} types. Select/fetch.")
+            if is_stale:
+                print("Cached capabilities are stale, refreshing in the background...")
+                _refresh_capabilities_in_background(app_context)
+        else:
+            app_state.all_discovered_feature_types = []
             try:
-                response_caps = requests.get(app_config.WFS_CAPABILITIES_URL, timeout=30)
-                response_caps.raise_for_status()
-                root = ET.fromstring(response_caps.content)
-                namespaces = {'wfs': 'http://www.opengis.net/wfs/2.0'}
-                if not root.findall('.//wfs:FeatureType', namespaces):
-                    namespaces = {'wfs': 'http://www.opengis.net/wfs'}
-                for ft_node in root.findall('.//wfs:FeatureType', namespaces):
-                    name_el = ft_node.find('wfs:Name', namespaces)
-                    if name_el is not None and name_el.text:
-                        app_state.all_discovered_feature_types.append(name_el.text)
-            except Exception as e_xml:
-                print(f"Error parsing WFS Capabilities XML: {e_xml}")
+                capabilities = wfs_capabilities.fetch_capabilities()
+            except Exception as e_caps:
+                print(f"Error discovering WFS feature types: {type(e_caps).__name__}: {e_caps}")
                 return
-
-        if app_state.all_discovered_feature_types:
-            opts = [app_config.FETCH_ALL_BUTTON_LABEL] + sorted(list(set(app_state.all_discovered_feature_types)))
-            widgets['feature_type_dropdown'].options = opts
-            widgets['feature_type_dropdown'].value = app_config.FETCH_ALL_BUTTON_LABEL
-            print(f"Discovery complete: {len(app_state.all_discovered_feature_types)} types. Select/fetch.")
-        else:
-            print("No feature types discovered.")
+            _apply_capabilities(app_context, capabilities)
+            if app_state.all_discovered_feature_types:
+                print(f"Discovery complete: {len(app_state.all_discovered_feature_types)} types. Select/fetch.")
+            else:
+                print("No feature types discovered.")
     update_all_button_states(app_context)
 
 
+def _layer_geojson_path(ft_fetch):
+    sane_name = ft_fetch.replace(':', '_').replace('/', '_')
+    return os.path.join(app_config.DOWNLOAD_DIR, f"{sane_name}_bbox_{app_state.min_x_25832_fname_global:.0f}_{app_state.min_y_25832_fname_global:.0f}.geojson")
+
+
+def _report_saved_geojson(status_output_widget, saved_paths, failures):
+    # Runs on the writer thread, after fetch_wfs_data has returned.
+    if saved_paths:
+        status_output_widget.append_stdout(f"Saved {len(saved_paths)} GeoJSON file(s) to '{app_config.DOWNLOAD_DIR}'.\n")
+    for path, e_save in failures.items():
+        status_output_widget.append_stdout(f"  Warn: Save GeoJSON fail for {os.path.basename(path)}: {e_save}\n")
+
+
+def _report_stored_features(status_output_widget, stored_keys, failures):
+    # Runs on the writer thread, after fetch_wfs_data has returned.
+    if stored_keys:
+        status_output_widget.append_stdout(f"Local store updated for {len(stored_keys)} type(s).\n")
+    for (_, ft_fetch, _), e_store in failures.items():
+        status_output_widget.append_stdout(f"  Warn: Local store write fail for {ft_fetch.split(':')[-1]}: {e_store}\n")
+
+
+def _create_wfs_layer(layer_title, features, app_context):
+    geo_layer = ipyleaflet.GeoJSON(
+        data={"type": "FeatureCollection", "features": []},
+        name=layer_title,
+        style={}, # Individual feature styles will override this
+        hover_style=copy.deepcopy(app_config.SELECTED_STYLE)
+    )
+    # Crucial: Use a lambda to capture layer_title and pass app_context
+    geo_layer.on_click(
+        lambda feature, layer_name_captured=layer_title, **kwargs_from_leaflet:
+            on_geojson_feature_click_callback_base(feature, layer_name_captured, kwargs_from_leaflet, app_context)
+    )
+    if vector_tiles.enabled():
+        # Drawn from vector tiles instead once it reaches VECTOR_TILE_MIN_FEATURES features.
+        tile_layer = ipyleaflet.VectorTileLayer(
+            name=f"{layer_title} (tiles)",
+            layer_styles=vector_tiles.LAYER_STYLES,
+            interactive=True,
+            renderer='svg',
+            feature_id=vector_tiles.FEATURE_ID_PROPERTY
+        )
+        # Tile clicks carry the tile feature's properties, i.e. its _temp_id.
+        tile_layer.on_click(
+            lambda layer_name_captured=layer_title, **kwargs_from_leaflet:
+                on_geojson_feature_click_callback_base(
+                    {'type': 'Feature', 'properties': kwargs_from_leaflet.get('properties') or {}},
+                    layer_name_captured, kwargs_from_leaflet, app_context
+                )
+        )
+        feature_index.bind_tile_source(geo_layer, vector_tiles.TileSource(app_context['m'], geo_layer, tile_layer))
+    feature_index.set_features(geo_layer, features) # Rendered through its store (LOD or vector tiles)
+    return geo_layer
+
+
+def cancel_fetch(app_context, reason="cancelled", abort_downloads=True):
+    """Cancels the running fetch job, if any. Returns True if one was running."""
+    fetch_job = app_state.active_fetch_job
+    if fetch_job is None or fetch_job.cancelled:
+        return False
+    fetch_job.cancel(reason, abort_downloads=abort_downloads)
+    return True
+
+
+def _wait_for_fetch_job():
+    fetch_thread = app_state.active_fetch_thread
+    if fetch_thread is not None and fetch_thread is not threading.current_thread():
+        fetch_thread.join()
+
+
 def fetch_wfs_data(app_context):
+    # A new request supersedes a running one. Pages it is downloading still land in the
+    # response cache, where this fetch picks them up if it needs them. Its job thread is
+    # joined before this fetch's ui_transaction opens, so its last layer updates and
+    # messages go out on their own.
+    superseded = cancel_fetch(app_context, reason="superseded by a new fetch", abort_downloads=False)
+    _wait_for_fetch_job()
+    _start_fetch(superseded, app_context)
+
+
+@ui_operation
+def _start_fetch(superseded, app_context):
     m = app_context['m']
     widgets = app_context['widgets']
     status_output_widget = widgets['status_output_widget']
-    
-    app_state.selected_features_by_layer.clear()
-    app_state.original_styles_by_layer.clear()
+
+    if not app_config.WFS_INCREMENTAL_FETCH:
+        # Every WFS layer is replaced below, so selections in them cannot survive.
+        app_state.selected_features_by_layer.clear()
+        app_state.original_styles_by_layer.clear()
+        sync_selection_overlay(app_context)
 
     with status_output_widget:
         ipython_clear_output(wait=True)
+        if superseded:
+            print("Previous fetch superseded.")
         print("Initiating WFS data fetch...")
         current_map_bbox_wgs84 = m.get_bbox()
         if not current_map_bbox_wgs84 or len(current_map_bbox_wgs84) != 4:
@@ -75,17 +208,19 @@ def fetch_wfs_data(app_context):
             return
 
         try:
-            transformer = Transformer.from_crs("EPSG:4326", "EPSG:25832", always_xy=True)
-            min_x_25832_fname, min_y_25832_fname = transformer.transform(current_map_bbox_wgs84[0], current_map_bbox_wgs84[1])
-            max_x_25832, max_y_25832 = transformer.transform(current_map_bbox_wgs84[2], current_map_bbox_wgs84[3])
-            bbox_req_str = f"{min_x_25832_fname},{min_y_25832_fname},{max_x_25832},{max_y_25832}"
-            srs_name_req = "urn:ogc:def:crs:EPSG::25832"
+            min_x_25832_fname, min_y_25832_fname = projection.transform_point(current_map_bbox_wgs84[0], current_map_bbox_wgs84[1], "EPSG:4326", "EPSG:25832")
+            max_x_25832, max_y_25832 = projection.transform_point(current_map_bbox_wgs84[2], current_map_bbox_wgs84[3], "EPSG:4326", "EPSG:25832")
+            request_bbox = (min_x_25832_fname, min_y_25832_fname, max_x_25832, max_y_25832)
+            srs_name_req = wfs_client.SRS_NAME_25832
             app_state.min_x_25832_fname_global, app_state.min_y_25832_fname_global = min_x_25832_fname, min_y_25832_fname
+            tiles = wfs_client.plan_tiles(request_bbox)
         except Exception as e_proj:
             print(f"Warn: BBOX reproj error: {e_proj}. Using WGS84 (lat,lon order for BBOX).")
-            bbox_req_str = f"{current_map_bbox_wgs84[1]},{current_map_bbox_wgs84[0]},{current_map_bbox_wgs84[3]},{current_map_bbox_wgs84[2]}"
-            srs_name_req = "urn:ogc:def:crs:EPSG::4326"
+            request_bbox = tuple(current_map_bbox_wgs84)
+            srs_name_req = wfs_client.SRS_NAME_4326
             app_state.min_x_25832_fname_global, app_state.min_y_25832_fname_global = current_map_bbox_wgs84[0], current_map_bbox_wgs84[1]
+            tiles = [request_bbox] # Tiling works in metres, so the WGS84 fallback is a single request
+        incremental = app_config.WFS_INCREMENTAL_FETCH and not srs_name_req.endswith("4326")
 
         selected_option = widgets['feature_type_dropdown'].value
         types_to_fetch = app_state.all_discovered_feature_types if selected_option == app_config.FETCH_ALL_BUTTON_LABEL else ([selected_option] if selected_option else [])
@@ -97,112 +232,241 @@ def fetch_wfs_data(app_context):
             print("Error: Discover types first.")
             return
 
-        for layer_name_rem in m.get_layer_names():
-            if layer_name_rem.startswith("WFS:"):
-                layer_rem = m.find_layer(layer_name_rem)
-                if layer_rem:
-                    m.remove_layer(layer_rem)
+        layers_by_type = {}
+        tiles_by_type = {}
+        if incremental:
+            # Existing layers are extended; only the area not yet covered for a type is requested.
+            for ft_fetch in types_to_fetch:
+                existing_layer = m.find_layer(f"WFS: {ft_fetch.split(':')[-1]}")
+                coverage_key = wfs_client.coverage_key(ft_fetch, srs_name_req)
+                if existing_layer is None:
+                    app_state.wfs_coverage_by_key.pop(coverage_key, None) # Layer was removed, start over
+                else:
+                    layers_by_type[ft_fetch] = existing_layer
+                tiles_by_type[ft_fetch] = wfs_client.plan_uncovered_tiles(tiles, app_state.wfs_coverage_by_key.get(coverage_key))
+        else:
+            for layer_name_rem in m.get_layer_names():
+                if layer_name_rem.startswith("WFS:"):
+                    layer_rem = m.find_layer(layer_name_rem)
+                    if layer_rem:
+                        m.remove_layer(layer_rem)
+            app_state.wfs_coverage_by_key.clear()
+            tiles_by_type = {ft_fetch: list(tiles) for ft_fetch in types_to_fetch}
+        # Restored if a cancelled fetch discards what it added (WFS_KEEP_PARTIAL_RESULTS = False).
+        coverage_before = {
+            coverage_key: app_state.wfs_coverage_by_key.get(coverage_key)
+            for coverage_key in (wfs_client.coverage_key(ft_fetch, srs_name_req) for ft_fetch in types_to_fetch)
+        }
 
-        max_feat = app_config.MAX_FEATURES_PER_TYPE_FETCH
-        total_added, successful_count = 0, 0
+        # Areas the local store covers are loaded from disk, only the rest goes to the WFS.
+        use_local_store = app_config.LOCAL_STORE_ENABLED and not srs_name_req.endswith("4326")
+        store_results_by_type = {}
+        if use_local_store:
+            store_results_by_type, store_errors = wfs_client.take_from_local_store(tiles_by_type, request_bbox, srs_name_req)
+            for ft_fetch, e_store in store_errors.items():
+                print(f"Warn: Local store read failed for {ft_fetch.split(':')[-1]}: {e_store}")
+
+        total_tiles = sum(len(type_tiles) for type_tiles in tiles_by_type.values())
+        total_added, duplicates_dropped = 0, 0
         failed_details = {}
+        seen_ids_by_type = {ft_fetch: set() for ft_fetch in types_to_fetch}
+        for ft_fetch, existing_layer in layers_by_type.items():
+            seen_ids_by_type[ft_fetch].update(
+                fid for fid in (wfs_client.feature_identity(f) for f in feature_index.all_features(existing_layer)) if fid is not None
+            )
+        updated_types = set()
+        created_types = set()
+        added_temp_ids_by_type = collections.defaultdict(set)
+        cache_counts = collections.Counter()
+        geojson_jobs = {}
+        store_jobs = {}
+        fetched_features_by_type = collections.defaultdict(list)
+        fetched_area_by_type = {}
 
-        for idx, ft_fetch in enumerate(types_to_fetch):
-            print(f"Processing: {ft_fetch.split(':')[-1]} ({idx+1}/{len(types_to_fetch)})... (max {max_feat} features)")
-            params = {
-                "SERVICE": "WFS", "VERSION": "2.0.0", "REQUEST": "GetFeature",
-                "TYPENAMES": ft_fetch, "BBOX": bbox_req_str, "SRSNAME": srs_name_req, "COUNT": max_feat
-            }
-            sane_name = ft_fetch.replace(':', '_').replace('/', '_')
-            out_geojson_path = os.path.join(app_config.DOWNLOAD_DIR, f"{sane_name}_bbox_{app_state.min_x_25832_fname_global:.0f}_{app_state.min_y_25832_fname_global:.0f}.geojson")
-            tmp_gml, gdf_data = None, None
-            try:
-                resp = requests.get(app_config.WFS_GETFEATURE_BASE_URL, params=params, timeout=120)
-                resp.raise_for_status()
-                ctype = resp.headers.get('content-type', '').lower()
-
-                with utils.suppress_stdout_stderr():
-                    if 'gml' in ctype or 'xml' in ctype:
-                        if b"<ows:ExceptionReport" in resp.content or b"<ServiceExceptionReport" in resp.content or b"<wfs:ExceptionReport" in resp.content:
-                            failed_details[ft_fetch] = "Server OGC Exception (XML)"
-                            err_fname = os.path.join(app_config.DOWNLOAD_DIR, f"err_{sane_name}.xml")
-                            with open(err_fname, 'wb') as f_err: f_err.write(resp.content)
-                            continue
-                        tmp_gml = os.path.join(app_config.DOWNLOAD_DIR, f"tmp_{sane_name}.gml")
-                        with open(tmp_gml, 'wb') as f_gml: f_gml.write(resp.content)
-                        try:
-                            gdf_data = gpd.read_file(tmp_gml)
-                        except Exception as e_gml:
-                            failed_details[ft_fetch] = f"GMLReadErr:{type(e_gml).__name__}"
-                            prob_fname = os.path.join(app_config.DOWNLOAD_DIR, f"prob_{sane_name}.gml")
-                            shutil.copy(tmp_gml, prob_fname)
-                            continue
-                    elif 'json' in ctype or 'geojson' in ctype:
-                        json_resp = resp.json()
-                        if json_resp.get("type") == "FeatureCollection" and "features" in json_resp:
-                            crs_json = json_resp.get('crs', {}).get('properties', {}).get('name', srs_name_req)
-                            gdf_data = gpd.GeoDataFrame.from_features(json_resp["features"], crs=crs_json)
-                        else:
-                            raw_json_p = os.path.join(app_config.DOWNLOAD_DIR, f"{sane_name}_raw.json")
-                            with open(raw_json_p, 'w') as f_json_raw: json.dump(json_resp, f_json_raw, indent=2)
-                            failed_details[ft_fetch] = "NonStdJSON"
-                            continue
-                    else:
-                        failed_details[ft_fetch] = f"UnexpCType:{ctype}"
-                        raw_dat_p = os.path.join(app_config.DOWNLOAD_DIR, f"{sane_name}_raw.dat")
-                        with open(raw_dat_p, 'wb') as f_raw: f_raw.write(resp.content)
+        def add_coverage(ft_fetch, area):
+            coverage_key = wfs_client.coverage_key(ft_fetch, srs_name_req)
+            covered_area = app_state.wfs_coverage_by_key.get(coverage_key)
+            app_state.wfs_coverage_by_key[coverage_key] = area if covered_area is None else covered_area.union(area)
+
+        def add_features(ft_fetch, features):
+            # Features that several tiles (or the store and a tile) return are kept once, by gml:id.
+            nonlocal total_added, duplicates_dropped
+            seen_ids = seen_ids_by_type[ft_fetch]
+            new_features = []
+            for feature_dict_item in features:
+                feature_id = wfs_client.feature_identity(feature_dict_item)
+                if feature_id is not None:
+                    if feature_id in seen_ids:
+                        duplicates_dropped += 1
                         continue
-                
-                if gdf_data is not None and not gdf_data.empty:
-                    if gdf_data.crs and gdf_data.crs.to_string().upper() != "EPSG:4326":
-                        try:
-                            gdf_data = gdf_data.to_crs("EPSG:4326")
-                        except Exception as e_reproj_gdf:
-                            print(f"  Warn: GDF reproj to EPSG:4326 failed for {ft_fetch}: {e_reproj_gdf}.")
-                            failed_details[ft_fetch] = f"GDFReprojErr:{type(e_reproj_gdf).__name__}"
-                            continue
-                    
-                    geojson_processed_data = gdf_data.__geo_interface__
-                    for feature_dict_item in geojson_processed_data['features']:
-                        feature_dict_item['properties']['_temp_id'] = str(uuid.uuid4())
-                        feature_dict_item['properties'].setdefault('style', copy.deepcopy(app_config.DEFAULT_FEATURE_STYLE))
-                    
-                    try:
-                        gpd.GeoDataFrame.from_features(geojson_processed_data['features'], crs="EPSG:4326").to_file(out_geojson_path, driver="GeoJSON", encoding='utf-8')
-                    except Exception as e_save:
-                        print(f"  Warn: Save GeoJSON fail for {ft_fetch}: {e_save}")
-                    
-                    layer_title = f"WFS: {ft_fetch.split(':')[-1]}"
-                    geo_layer = ipyleaflet.GeoJSON(
-                        data=geojson_processed_data,
-                        name=layer_title,
-                        style={}, # Individual feature styles will override this
-                        hover_style=copy.deepcopy(app_config.SELECTED_STYLE)
-                    )
-                    # Crucial: Use a lambda to capture layer_title and pass app_context
-                    geo_layer.on_click(
-                        lambda feature, layer_name_captured=layer_title, **kwargs_from_leaflet:
-                            on_geojson_feature_click_callback_base(feature, layer_name_captured, kwargs_from_leaflet, app_context)
-                    )
+                    seen_ids.add(feature_id)
+                new_features.append(feature_dict_item)
+            if not new_features:
+                return 0
+            with app_state.wfs_layer_lock:
+                geo_layer = layers_by_type.get(ft_fetch)
+                if geo_layer is None:
+                    geo_layer = _create_wfs_layer(f"WFS: {ft_fetch.split(':')[-1]}", new_features, app_context)
+                    layers_by_type[ft_fetch] = geo_layer
+                    created_types.add(ft_fetch)
                     m.add_layer(geo_layer)
-                    total_added += len(gdf_data)
-                    successful_count += 1
-            except requests.exceptions.HTTPError as e_http:
-                failed_details[ft_fetch] = f"HTTPErr:{e_http}"
-            except Exception as e_gen:
-                failed_details[ft_fetch] = f"Err:{type(e_gen).__name__}-{str(e_gen)[:100]}"
-            finally:
-                if tmp_gml and os.path.exists(tmp_gml):
-                    try:
-                        os.remove(tmp_gml)
-                    except OSError:
-                        pass
-        
-        print(f"\n--- Summary ---")
-        print(f"Added {successful_count} layer(s), ~{total_added} features.")
-        if failed_details:
-            print(f"Failed for {len(failed_details)} types:")
-            for k, v in failed_details.items():
-                print(f"  - {k.split(':')[-1]}: {v}")
-        print(f"Data in '{app_config.DOWNLOAD_DIR}'. Click on features to select/deselect.")
-    update_all_button_states(app_context)
\ No newline at end of file
+                else:
+                    feature_index.append_features(geo_layer, new_features)
+            added_temp_ids_by_type[ft_fetch].update(f['properties']['_temp_id'] for f in new_features)
+            updated_types.add(ft_fetch)
+            total_added += len(new_features)
+            return len(new_features)
+
+        def queue_store_job(ft_fetch):
+            if use_local_store and ft_fetch in fetched_area_by_type:
+                store_jobs[('local_store', ft_fetch, str(uuid.uuid4()))] = functools.partial(
+                    local_store.append_features, ft_fetch, fetched_features_by_type.pop(ft_fetch, []),
+                    fetched_area_by_type.pop(ft_fetch), wfs_client.store_params_key(srs_name_req)
+                )
+
+        def discard_added_features():
+            # Undoes everything this fetch put on the map, including selections made on it meanwhile.
+            with app_state.wfs_layer_lock:
+                for ft_fetch, added_temp_ids in added_temp_ids_by_type.items():
+                    geo_layer = layers_by_type[ft_fetch]
+                    for selection_dict in (app_state.selected_features_by_layer.get(geo_layer.name, {}),
+                                           app_state.original_styles_by_layer.get(geo_layer.name, {})):
+                        for temp_id in added_temp_ids:
+                            selection_dict.pop(temp_id, None)
+                    feature_index.remove_features(geo_layer, added_temp_ids)
+                    if not feature_index.all_features(geo_layer) and ft_fetch in created_types:
+                        if geo_layer in m.layers:
+                            m.remove_layer(geo_layer)
+                sync_selection_overlay(app_context)
+            for coverage_key, covered_area in coverage_before.items():
+                if covered_area is None:
+                    app_state.wfs_coverage_by_key.pop(coverage_key, None)
+                else:
+                    app_state.wfs_coverage_by_key[coverage_key] = covered_area
+
+        def summary_lines(fetch_job):
+            lines = ["", "--- Summary ---"]
+            if fetch_job is not None and fetch_job.cancelled:
+                kept_desc = "kept" if app_config.WFS_KEEP_PARTIAL_RESULTS else "discarded"
+                lines.append(f"Fetch {fetch_job.cancel_reason}; partial results {kept_desc}.")
+            lines.append(f"Added/extended {len(updated_types)} layer(s), ~{total_added} new features.")
+            if duplicates_dropped:
+                lines.append(f"Merged {duplicates_dropped} feature(s) returned more than once.")
+            if map_payload.enabled():
+                for ft_fetch in sorted(updated_types):
+                    geo_layer = layers_by_type[ft_fetch]
+                    sizes = feature_index.payload_sizes(geo_layer) if geo_layer in m.layers else None
+                    if sizes is not None: # None while held back, and for tiled layers
+                        lines.append("Map payload " + map_payload.report_line(geo_layer.name, *sizes))
+            if app_config.RESPONSE_CACHE_ENABLED:
+                coalesced_desc = f", {cache_counts[response_cache.CACHE_COALESCED]} coalesced" if cache_counts[response_cache.CACHE_COALESCED] else ""
+                lines.append(f"Response cache: {cache_counts[response_cache.CACHE_HIT]} hit(s), "
+                             f"{cache_counts[response_cache.CACHE_REVALIDATED]} revalidated, {cache_counts[response_cache.CACHE_MISS]} miss(es){coalesced_desc}.")
+            if app_config.WFS_SCHEDULER_ENABLED and total_tiles:
+                lines.append(request_scheduler.format_stats(request_scheduler.get_scheduler().stats()))
+            if failed_details:
+                lines.append(f"Failed for {len(failed_details)} types:")
+                for k, v in failed_details.items():
+                    lines.append(f"  - {k.split(':')[-1]}: {v}")
+            lines.append(f"Data in '{app_config.DOWNLOAD_DIR}'. Click on features to select/deselect.")
+            if geojson_jobs or store_jobs:
+                lines.append(f"Writing {len(store_jobs)} local store part(s) and {len(geojson_jobs)} GeoJSON file(s) in the background...")
+            return lines
+
+        def start_background_writes():
+            persistence.run_async(
+                store_jobs, on_done=lambda stored, failures: _report_stored_features(status_output_widget, stored, failures)
+            )
+            persistence.save_geojson_async(
+                geojson_jobs, on_done=lambda saved, failures: _report_saved_geojson(status_output_widget, saved, failures)
+            )
+
+        already_loaded = [ft_fetch for ft_fetch in types_to_fetch if not tiles_by_type[ft_fetch] and ft_fetch not in store_results_by_type]
+        if already_loaded:
+            print(f"Already loaded for this viewport: {len(already_loaded)} type(s).")
+        for ft_fetch, (store_features, store_covered_area) in store_results_by_type.items():
+            added_count = add_features(ft_fetch, wfs_client.tag_features_for_display(store_features))
+            if incremental:
+                add_coverage(ft_fetch, store_covered_area)
+            remaining_desc = f", {len(tiles_by_type[ft_fetch])} tile(s) left to fetch" if tiles_by_type[ft_fetch] else ""
+            print(f"From local store: {ft_fetch.split(':')[-1]}, {added_count} features{remaining_desc}")
+        if not total_tiles:
+            print("Nothing new to fetch.")
+            for line in summary_lines(None):
+                print(line)
+
+        if app_config.WFS_PAGING_ENABLED:
+            limit_desc = f"pages of {app_config.WFS_PAGE_SIZE}, max {app_config.WFS_MAX_FEATURES_PER_TYPE_PAGED} features per tile"
+        else:
+            limit_desc = f"max {app_config.MAX_FEATURES_PER_TYPE_FETCH} features per tile"
+        types_with_tiles = [ft_fetch for ft_fetch in types_to_fetch if tiles_by_type[ft_fetch]]
+        if total_tiles:
+            if app_config.WFS_SCHEDULER_ENABLED:
+                parallel_desc = f"{request_scheduler.get_scheduler().stats()['concurrency_limit']} in parallel (adaptive)"
+            else:
+                parallel_desc = f"up to {min(app_config.WFS_FETCH_MAX_WORKERS, total_tiles)} in parallel"
+            print(f"Fetching {len(types_with_tiles)} type(s) in {total_tiles} tile request(s), {parallel_desc}... ({limit_desc})")
+
+    if not total_tiles:
+        start_background_writes()
+        update_all_button_states(app_context)
+        return
+
+    def run_fetch_job(fetch_job):
+        # Runs on the job thread: output goes through append_stdout, layers grow page by page.
+        def log(msg):
+            status_output_widget.append_stdout(f"{msg}\n")
+
+        try:
+            done_count = 0
+            for kind, ft_fetch, payload in wfs_client.iter_fetch_events(tiles_by_type, srs_name_req, job=fetch_job):
+                short_name = ft_fetch.split(':')[-1]
+                if kind == 'page':
+                    if use_local_store:
+                        fetched_features_by_type[ft_fetch].extend(payload)
+                    add_features(ft_fetch, payload)
+                elif kind == 'error':
+                    # Keep the first reason per type; other tiles of the type may still have succeeded.
+                    failed_details.setdefault(ft_fetch, payload)
+                elif kind == 'tile_done':
+                    cache_counts.update(payload['cache_counts'])
+                    if payload['ok']:
+                        tile_area = shapely.geometry.box(*payload['bbox'])
+                        if incremental:
+                            add_coverage(ft_fetch, tile_area)
+                        fetched_area = fetched_area_by_type.get(ft_fetch)
+                        fetched_area_by_type[ft_fetch] = tile_area if fetched_area is None else fetched_area.union(tile_area)
+                elif kind == 'type_done':
+                    done_count += 1
+                    queue_store_job(ft_fetch)
+                    if ft_fetch in updated_types and app_config.WFS_SAVE_GEOJSON_COPIES:
+                        geojson_jobs[_layer_geojson_path(ft_fetch)] = feature_index.all_features(layers_by_type[ft_fetch])
+                    if ft_fetch in failed_details:
+                        log(f"Failed: {short_name} ({done_count}/{len(types_with_tiles)})")
+                    elif ft_fetch in updated_types:
+                        log(f"Added: {short_name} ({done_count}/{len(types_with_tiles)}), {len(feature_index.all_features(layers_by_type[ft_fetch]))} features")
+                    else:
+                        log(f"No features: {short_name} ({done_count}/{len(types_with_tiles)})")
+            if fetch_job.cancelled:
+                # Completed tiles are valid WFS data either way, so the local store keeps them.
+                for ft_fetch in list(fetched_area_by_type):
+                    queue_store_job(ft_fetch)
+                if not app_config.WFS_KEEP_PARTIAL_RESULTS:
+                    discard_added_features()
+            for line in summary_lines(fetch_job):
+                log(line)
+            start_background_writes()
+        except Exception as e_job:
+            log(f"Error: fetch failed: {type(e_job).__name__}: {e_job}")
+        finally:
+            if app_state.active_fetch_job is fetch_job:
+                app_state.active_fetch_job = None
+                app_state.active_fetch_thread = None
+            update_all_button_states(app_context)
+
+    fetch_job = wfs_client.FetchJob()
+    fetch_thread = threading.Thread(target=run_fetch_job, args=(fetch_job,), daemon=True)
+    app_state.active_fetch_job = fetch_job
+    app_state.active_fetch_thread = fetch_thread
+    update_all_button_states(app_context)
+    fetch_thread.start()
@@ -0,0 +1,25 @@
+import shapely.geometry
+
+from nrw_geotools import core
+
+
+def _feature(gml_id, x, **properties):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [x, 51.0]},
+            'properties': {'gml_id': gml_id, **properties}}
+
+
+def test_select_features_compares_numbers_as_numbers():
+    features = [
+        _feature('DENW1', 7.0, gebaeudefunktion=2000, land='05'),
+        _feature('DENW2', 7.1, gebaeudefunktion='2000', land='05'),
+        _feature('DENW3', 7.2, gebaeudefunktion=2000.0, land='5'),
+        _feature('DENW4', 7.3, gebaeudefunktion=2001, land='05'),
+    ]
+
+    def selected_ids(**kwargs):
+        return [feature['properties']['gml_id'] for feature in core.select_features(features, **kwargs)]
+
+    assert selected_ids(where={'gebaeudefunktion': '2000'}) == ['DENW1', 'DENW2', 'DENW3']
+    assert selected_ids(where={'gebaeudefunktion': '2000', 'land': '05'}) == ['DENW1', 'DENW2']
+    assert selected_ids(where={'gebaeudefunktion': '2000'}, intersects=shapely.geometry.box(7.05, 50, 8, 52)) == ['DENW2', 'DENW3']
+    assert selected_ids(where={'land': '5'}, predicate=lambda feature: feature['geometry']['coordinates'][0] > 7) == ['DENW3']
@@ -0,0 +1,54 @@
+import threading
+
+from nrw_geotools import feature_index
+
+
+class _Layer:
+    """Stands in for an ipyleaflet.GeoJSON layer: counts the data assignments."""
+
+    def __init__(self):
+        self._data = {'type': 'FeatureCollection', 'features': []}
+        self.assignments = 0
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self.assignments += 1
+
+
+def _feature(temp_id):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [7.0, 51.0]},
+            'properties': {'_temp_id': temp_id}}
+
+
+def _rendered_ids(layer):
+    return [feature['properties']['_temp_id'] for feature in layer.data['features']]
+
+
+def test_hold_sends_a_layer_once():
+    layer = _Layer()
+    with feature_index.hold_layer_updates():
+        feature_index.append_features(layer, [_feature('a')])
+        with feature_index.hold_layer_updates():
+            feature_index.append_features(layer, [_feature('b')])
+        assert layer.assignments == 0
+        assert [f['properties']['_temp_id'] for f in feature_index.all_features(layer)] == ['a', 'b']
+
+    assert layer.assignments == 1 and _rendered_ids(layer) == ['a', 'b']
+
+
+def test_hold_does_not_hold_other_threads():
+    layer = _Layer()
+    with feature_index.hold_layer_updates():
+        feature_index.append_features(layer, [_feature('a')])
+        worker = threading.Thread(target=feature_index.append_features, args=(layer, [_feature('b')]))
+        worker.start()
+        worker.join()
+        # The other thread rendered at once, with the held change it was built on.
+        assert layer.assignments == 1 and _rendered_ids(layer) == ['a', 'b']
+
+    assert layer.assignments == 1 and _rendered_ids(layer) == ['a', 'b']
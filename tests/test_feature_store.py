@@ -0,0 +1,61 @@
+import pytest
+
+from nrw_geotools import feature_store
+from nrw_geotools import gml_stream
+
+GETFEATURE_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:gml="http://www.opengis.net/gml/3.2"
+    xmlns:adv="http://www.adv-online.de/namespaces/adv/gid/6.0">
+<wfs:member><adv:AX_Gebaeude gml:id="DENW1"><adv:gebaeudefunktion>2000</adv:gebaeudefunktion>
+ <adv:amtlicheFlaeche uom="m2">512.5</adv:amtlicheFlaeche><adv:land>05</adv:land>
+ <adv:position><gml:Point><gml:pos>359000 5651000</gml:pos></gml:Point></adv:position></adv:AX_Gebaeude></wfs:member>
+<wfs:member><adv:AX_Gebaeude gml:id="DENW2"><adv:gebaeudefunktion>2001</adv:gebaeudefunktion>
+ <adv:amtlicheFlaeche uom="m2">480</adv:amtlicheFlaeche><adv:land>05</adv:land>
+ <adv:position><gml:Point><gml:pos>359100 5651000</gml:pos></gml:Point></adv:position></adv:AX_Gebaeude></wfs:member>
+<wfs:member><adv:AX_Gebaeude gml:id="DENW3"><adv:gebaeudefunktion>2001</adv:gebaeudefunktion>
+ <adv:amtlicheFlaeche uom="m2">1003</adv:amtlicheFlaeche><adv:land>05</adv:land>
+ <adv:position><gml:Point><gml:pos>359200 5651000</gml:pos></gml:Point></adv:position></adv:AX_Gebaeude></wfs:member>
+</wfs:FeatureCollection>
+"""
+
+
+def _store(features):
+    for feature_dict_item in features:
+        feature_dict_item['properties']['_temp_id'] = feature_dict_item['properties']['gml_id']
+    return feature_store.FeatureStore(features)
+
+
+def _streamed_store():
+    features = [feature for batch in gml_stream.GMLFeatureStream(batch_size=2).iter_batches([GETFEATURE_RESPONSE])
+                for feature in batch]
+    return _store(features)
+
+
+def test_numeric_query_on_streamed_layer():
+    store = _streamed_store()
+
+    assert store.query_properties("gebaeudefunktion == 2001") == ['DENW2', 'DENW3']
+    assert store.query_properties("amtlicheFlaeche > 500") == ['DENW1', 'DENW3']
+    assert store.query_properties("land == '05'") == ['DENW1', 'DENW2', 'DENW3']
+
+
+def test_numeric_query_on_text_values():
+    # e.g. features reopened from the local store, which keeps mixed columns as text
+    store = _store([
+        {'type': 'Feature', 'geometry': None, 'properties': {'gml_id': 'DENW1', 'gebaeudefunktion': '2000', 'land': '05', 'gemarkungsnummer': '1234'}},
+        {'type': 'Feature', 'geometry': None, 'properties': {'gml_id': 'DENW2', 'gebaeudefunktion': 2001, 'land': '05', 'gemarkungsnummer': '1235'}},
+        {'type': 'Feature', 'geometry': None, 'properties': {'gml_id': 'DENW3', 'land': 'x', 'gemarkungsnummer': '1234'}},
+    ])
+
+    assert store.query_properties("gebaeudefunktion >= 2000") == ['DENW1', 'DENW2']
+    assert store.query_properties("gemarkungsnummer == 1234") == ['DENW1', 'DENW3']
+    assert store.query_properties("land == '05'") == ['DENW1', 'DENW2']
+
+
+@pytest.mark.parametrize('value, expected, matches', [
+    (2000, '2000', True), ('2000', '2000', True), (2000.0, '2000', True), (12, '12.0', True),
+    (12, '012', False), ('012', '12', False), ('05', '05', True), ('05', '5', False), (5, '05', False),
+    (True, 'true', True), (1, 'true', False), ('DENW05', 'DENW05', True), (None, '0', False),
+])
+def test_property_matches(value, expected, matches):
+    assert feature_store.property_matches(value, expected) is matches
@@ -0,0 +1,111 @@
+import collections
+import datetime
+
+import pytest
+import shapely.geometry
+
+from nrw_geotools import config as app_config
+from nrw_geotools import gml_stream
+from nrw_geotools import response_cache
+from nrw_geotools import wfs_client
+
+GETFEATURE_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:gml="http://www.opengis.net/gml/3.2"
+    xmlns:adv="http://www.adv-online.de/namespaces/adv/gid/6.0" xmlns:xlink="http://www.w3.org/1999/xlink"
+    numberMatched="2" numberReturned="2">
+<wfs:member><adv:AX_Flurstueck gml:id="DENW1">
+ <gml:boundedBy><gml:Envelope srsName="urn:ogc:def:crs:EPSG::25832"><gml:lowerCorner>359000 5651000</gml:lowerCorner><gml:upperCorner>359100 5651100</gml:upperCorner></gml:Envelope></gml:boundedBy>
+ <gml:identifier codeSpace="http://www.adv-online.de/">urn:adv:oid:DENW1</gml:identifier>
+ <adv:lebenszeitintervall><adv:AA_Lebenszeitintervall><adv:beginnt>2012-06-25T08:48:51Z</adv:beginnt></adv:AA_Lebenszeitintervall></adv:lebenszeitintervall>
+ <adv:anlass>000000</adv:anlass>
+ <adv:anlass>010102</adv:anlass>
+ <adv:position><gml:Polygon srsName="urn:ogc:def:crs:EPSG::25832"><gml:exterior><gml:LinearRing><gml:posList>359000 5651000 359100 5651000 359100 5651100 359000 5651000</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></adv:position>
+ <adv:gemarkung><adv:AX_Gemarkung_Schluessel><adv:land>05</adv:land><adv:gemarkungsnummer>1234</adv:gemarkungsnummer></adv:AX_Gemarkung_Schluessel></adv:gemarkung>
+ <adv:flurstuecksnummer><adv:AX_Flurstuecksnummer><adv:zaehler>17</adv:zaehler><adv:nenner>3</adv:nenner></adv:AX_Flurstuecksnummer></adv:flurstuecksnummer>
+ <adv:amtlicheFlaeche uom="m2">512.5</adv:amtlicheFlaeche>
+ <adv:zeitpunktDerEntstehung>1995-03-01</adv:zeitpunktDerEntstehung>
+ <adv:istGebucht xlink:href="urn:adv:oid:DENW2"/>
+ <adv:a><adv:X><adv:name>one</adv:name></adv:X></adv:a>
+ <adv:b><adv:Y><adv:name>two</adv:name></adv:Y></adv:b>
+</adv:AX_Flurstueck></wfs:member>
+<wfs:member><adv:AX_Flurstueck gml:id="DENW3">
+ <gml:boundedBy><gml:Envelope srsName="urn:ogc:def:crs:EPSG::25832"><gml:lowerCorner>359200 5651200</gml:lowerCorner><gml:upperCorner>359300 5651300</gml:upperCorner></gml:Envelope></gml:boundedBy>
+ <gml:identifier codeSpace="http://www.adv-online.de/">urn:adv:oid:DENW3</gml:identifier>
+ <adv:lebenszeitintervall><adv:AA_Lebenszeitintervall><adv:beginnt>2015-01-02T10:00:00Z</adv:beginnt></adv:AA_Lebenszeitintervall></adv:lebenszeitintervall>
+ <adv:anlass>000000</adv:anlass>
+ <adv:position><gml:Polygon srsName="urn:ogc:def:crs:EPSG::25832"><gml:exterior><gml:LinearRing><gml:posList>359200 5651200 359300 5651200 359300 5651300 359200 5651200</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></adv:position>
+ <adv:gemarkung><adv:AX_Gemarkung_Schluessel><adv:land>05</adv:land><adv:gemarkungsnummer>1235</adv:gemarkungsnummer></adv:AX_Gemarkung_Schluessel></adv:gemarkung>
+ <adv:flurstuecksnummer><adv:AX_Flurstuecksnummer><adv:zaehler>18</adv:zaehler></adv:AX_Flurstuecksnummer></adv:flurstuecksnummer>
+ <adv:amtlicheFlaeche uom="m2">1003</adv:amtlicheFlaeche>
+ <adv:zeitpunktDerEntstehung>1996-04-02</adv:zeitpunktDerEntstehung>
+</adv:AX_Flurstueck></wfs:member>
+</wfs:FeatureCollection>
+"""
+
+
+ARC_RING_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:gml="http://www.opengis.net/gml/3.2"
+    xmlns:adv="http://www.adv-online.de/namespaces/adv/gid/6.0">
+<wfs:member><adv:AX_Flurstueck gml:id="DENW1">
+ <adv:position><gml:Surface srsName="urn:ogc:def:crs:EPSG::25832"><gml:patches><gml:PolygonPatch><gml:exterior><gml:Ring>
+  <gml:curveMember><gml:Curve><gml:segments>
+   <gml:LineStringSegment><gml:posList>359000 5651000 359100 5651000</gml:posList></gml:LineStringSegment>
+   <gml:Arc><gml:posList>359100 5651000 359150 5651050 359100 5651100</gml:posList></gml:Arc>
+   <gml:LineStringSegment><gml:posList>359100 5651100 359000 5651100 359000 5651000</gml:posList></gml:LineStringSegment>
+  </gml:segments></gml:Curve></gml:curveMember>
+ </gml:Ring></gml:exterior></gml:PolygonPatch></gml:patches></gml:Surface></adv:position>
+</adv:AX_Flurstueck></wfs:member>
+</wfs:FeatureCollection>
+"""
+
+
+def _page_features(monkeypatch, streaming, body=GETFEATURE_RESPONSE):
+    monkeypatch.setattr(app_config, 'WFS_STREAMING_PARSE', streaming)
+    monkeypatch.setattr(app_config, 'WFS_SCHEDULER_ENABLED', False)
+    response = response_cache.CachedResponse(body, {'content-type': 'application/gml+xml; version=3.2'})
+    monkeypatch.setattr(response_cache, 'cached_get', lambda *args, **kwargs: (response, response_cache.CACHE_MISS))
+    batches = wfs_client._iter_page_batches({}, 'AX_Flurstueck', wfs_client.SRS_NAME_25832, collections.Counter())
+    return [feature for features, _ in batches for feature in features]
+
+
+def test_streaming_parse_matches_gdal_parse(monkeypatch):
+    streamed = _page_features(monkeypatch, streaming=True)
+    parsed = _page_features(monkeypatch, streaming=False)
+
+    assert len(streamed) == len(parsed) == 2
+    for streamed_feature, parsed_feature in zip(streamed, parsed):
+        # GDAL reports properties a feature lacks as None, the streaming parser leaves them out.
+        parsed_properties = {k: v for k, v in parsed_feature['properties'].items() if v is not None}
+        assert streamed_feature['properties'] == parsed_properties
+        assert shapely.geometry.shape(streamed_feature['geometry']).equals_exact(
+            shapely.geometry.shape(parsed_feature['geometry']), 1e-9)
+
+
+def test_streaming_parse_strokes_arcs_like_gdal(monkeypatch):
+    streamed = shapely.geometry.shape(_page_features(monkeypatch, True, ARC_RING_RESPONSE)[0]['geometry'])
+    parsed = shapely.geometry.shape(_page_features(monkeypatch, False, ARC_RING_RESPONSE)[0]['geometry'])
+
+    assert len(streamed.exterior.coords) == len(parsed.exterior.coords) == 49
+    assert streamed.equals_exact(parsed, 1e-9)
+
+
+def test_streaming_parse_types_values_like_gdal(monkeypatch):
+    properties = _page_features(monkeypatch, streaming=True)[0]['properties']
+
+    assert properties['amtlicheFlaeche'] == 512.5
+    assert properties['amtlicheFlaeche_uom'] == 'm2'
+    assert properties['gemarkungsnummer'] == 1234
+    assert properties['land'] == '05'
+    assert properties['anlass'] == ['000000', '010102']
+    assert properties['beginnt'] == datetime.datetime(2012, 6, 25, 8, 48, 51, tzinfo=datetime.timezone.utc)
+    assert properties['name'] == 'one' and properties['b|Y|name'] == 'two'
+    assert 'istGebucht' not in properties
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2000', 2000), ('-3', -3), ('0', 0), ('0.5', 0.5), ('1e3', 1000.0), ('05', '05'),
+    ('true', True), ('1995-03-01', datetime.datetime(1995, 3, 1)), ('DENW05', 'DENW05'),
+])
+def test_typed_value(text, expected):
+    value = gml_stream.typed_value(text)
+    assert value == expected and type(value) is type(expected)
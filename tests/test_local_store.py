@@ -0,0 +1,57 @@
+import shapely.geometry
+
+import pytest
+
+from nrw_geotools import config as app_config
+from nrw_geotools import local_store
+from nrw_geotools import projection
+
+FEATURE_TYPE = 'adv:AX_Flurstueck'
+PARAMS_KEY = 'EPSG:25832|paged'
+
+
+@pytest.fixture(autouse=True)
+def store_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_config, 'LOCAL_STORE_DIR', str(tmp_path))
+
+
+def _area_25832():
+    return projection.reproject_geometries([shapely.geometry.box(6.9, 50.9, 7.3, 51.1)], "EPSG:4326", "EPSG:25832")[0]
+
+
+def _point_feature(gml_id, x, **properties):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [x, 51.0]},
+            'properties': {'gml_id': gml_id, '_temp_id': f"t-{gml_id}", **properties}}
+
+
+def _store_and_load(features):
+    area = _area_25832()
+    local_store.append_features(FEATURE_TYPE, features, area, PARAMS_KEY)
+    loaded = local_store.load_features(FEATURE_TYPE, area.bounds, PARAMS_KEY)
+    return {feature['properties']['gml_id']: feature['properties'] for feature in loaded}
+
+
+def test_store_and_load_round_trip():
+    loaded = _store_and_load([
+        _point_feature('DENW1', 7.0, anlass=['000000', '010102'], land='05', gebaeudefunktion=2000,
+                       gemarkung={'land': '05', 'nummer': 1234}, amtlicheFlaeche=512.5, style={'color': 'red'}),
+        _point_feature('DENW2', 7.1, anlass=['000000'], land='05', gebaeudefunktion='2001a'),
+    ])
+
+    assert loaded['DENW1'] == {
+        'gml_id': 'DENW1', 'anlass': ['000000', '010102'], 'land': '05', 'gebaeudefunktion': 2000,
+        'gemarkung': {'land': '05', 'nummer': 1234}, 'amtlicheFlaeche': 512.5,
+    }
+    assert loaded['DENW2']['anlass'] == ['000000']
+    assert loaded['DENW2']['gebaeudefunktion'] == '2001a'
+    assert loaded['DENW2']['gemarkung'] is None
+
+
+def test_compaction_keeps_values(monkeypatch):
+    monkeypatch.setattr(app_config, 'LOCAL_STORE_MAX_PARTS', 1)
+    _store_and_load([_point_feature('DENW1', 7.0, anlass=['000000', '010102'])])
+    loaded = _store_and_load([_point_feature('DENW2', 7.1, anlass=['000000'], land='05')])
+
+    assert len(local_store._load_manifest(FEATURE_TYPE)['parts']) == 1
+    assert loaded['DENW1']['anlass'] == ['000000', '010102']
+    assert loaded['DENW2']['anlass'] == ['000000'] and loaded['DENW2']['land'] == '05'
@@ -0,0 +1,76 @@
+import datetime
+
+import pytest
+
+from nrw_geotools import config as app_config
+from nrw_geotools import feature_store
+from nrw_geotools import map_payload
+
+
+@pytest.fixture(autouse=True)
+def payload_config(monkeypatch):
+    monkeypatch.setattr(app_config, 'MAP_COORDINATE_DECIMALS', 3)
+    monkeypatch.setattr(app_config, 'MAP_CLIENT_PROPERTIES', ('_temp_id', 'style'))
+
+
+def test_compact_geometry_rounds_and_drops_repeated_vertices():
+    line = {'type': 'LineString', 'coordinates': [[7.00001, 51.0, 80.5], [7.00002, 51.0, 81.0], [7.1234567, 51.2, 82.0]]}
+
+    assert map_payload.compact_geometry(line) == {'type': 'LineString', 'coordinates': [[7.0, 51.0], [7.123, 51.2]]}
+
+
+def test_compact_geometry_keeps_rings_that_would_collapse():
+    ring = [[7.00001, 51.0], [7.00002, 51.0], [7.00003, 51.0], [7.00001, 51.0]]
+    polygon = {'type': 'Polygon', 'coordinates': [ring]}
+
+    assert map_payload.compact_geometry(polygon) == {'type': 'Polygon', 'coordinates': [[[7.0, 51.0]] * 4]}
+
+
+def test_compact_geometry_points_and_collections():
+    point = {'type': 'Point', 'coordinates': (7.12345, 51.98765, 100.0)}
+    multi_point = {'type': 'MultiPoint', 'coordinates': [[7.00001, 51.0], [7.00002, 51.0]]}
+    collection = {'type': 'GeometryCollection', 'geometries': [point, multi_point]}
+
+    assert map_payload.compact_geometry(collection) == {'type': 'GeometryCollection', 'geometries': [
+        {'type': 'Point', 'coordinates': [7.123, 51.988]},
+        {'type': 'MultiPoint', 'coordinates': [[7.0, 51.0], [7.0, 51.0]]}, # Points are not merged
+    ]}
+
+
+def test_compact_geometry_passes_through_what_it_cannot_compact(monkeypatch):
+    ragged = {'type': 'Polygon', 'coordinates': [[[7.0, 51.0], [7.1]]]}
+    assert map_payload.compact_geometry(ragged) is ragged
+    assert map_payload.compact_geometry(None) is None
+
+    monkeypatch.setattr(app_config, 'MAP_COORDINATE_DECIMALS', None)
+    point = {'type': 'Point', 'coordinates': [7.12345, 51.98765]}
+    assert map_payload.compact_geometry(point) is point
+
+
+def test_client_properties(monkeypatch):
+    properties = {'_temp_id': 'a', 'style': {'color': 'red'}, 'gml_id': 'DENW1', 'flaeche': 512.5}
+
+    assert map_payload.client_properties(properties) == {'_temp_id': 'a', 'style': {'color': 'red'}}
+    assert map_payload.client_properties(None) is None
+
+    monkeypatch.setattr(app_config, 'MAP_CLIENT_PROPERTIES', None)
+    assert map_payload.client_properties(properties) is properties
+
+
+def test_display_features_measure_the_payload():
+    features = [
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [7.12345, 51.98765]},
+         'properties': {'_temp_id': 'a', 'gml_id': 'DENW1', 'beginnt': datetime.datetime(2012, 6, 25), 'name': 'Straße'}},
+        {'type': 'Feature', 'geometry': None, 'properties': {'_temp_id': 'b'}},
+        {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[7.0, 51.0], [7.00001, 51.0], [7.1, 51.1]]},
+         'properties': None},
+    ]
+    store = feature_store.FeatureStore(features)
+
+    for tolerance in (None, 0.01):
+        rendered = store.display_features(tolerance)
+        assert store.payload_sizes(rendered) == (map_payload.payload_bytes(rendered), map_payload.payload_bytes(features))
+    assert store.payload_sizes(list(rendered)) is None
+
+    empty = feature_store.FeatureStore([])
+    assert empty.payload_sizes(empty.display_features()) == (2, 2)
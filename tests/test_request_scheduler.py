@@ -0,0 +1,157 @@
+import time
+
+import pytest
+
+from nrw_geotools import config as app_config
+from nrw_geotools import http_client
+from nrw_geotools import request_scheduler
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _FakeResponse:
+    def __init__(self, status_code=200, body=b"<wfs:FeatureCollection/>"):
+        self.status_code = status_code
+        self.headers = {}
+        self.body = body
+        self.closed = False
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    @property
+    def content(self):
+        return self.body
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def get(self, url, params=None, timeout=None, **kwargs):
+        return self.responses.pop(0)
+
+
+def _scheduler(rate_per_second=10.0, burst=2, initial_concurrency=4):
+    return request_scheduler.RequestScheduler(
+        rate_per_second=rate_per_second, burst=burst, min_concurrency=1, max_concurrency=8,
+        initial_concurrency=initial_concurrency,
+    )
+
+
+def test_token_bucket_refills_at_the_rate(monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr(request_scheduler.time, 'monotonic', clock)
+    scheduler = _scheduler(rate_per_second=10.0, burst=2)
+
+    for _ in range(2):
+        scheduler.admit().finish()
+    assert scheduler.stats()['tokens'] == 0
+
+    clock.now += 0.15
+    assert scheduler.stats()['tokens'] == 1.5
+    clock.now += 10
+    assert scheduler.stats()['tokens'] == 2 # Never more than the burst
+
+
+def test_admission_waits_for_a_token():
+    scheduler = _scheduler(rate_per_second=20.0, burst=1)
+    scheduler.admit().finish()
+
+    started_at = time.monotonic()
+    scheduler.admit().finish()
+    assert time.monotonic() - started_at >= 0.04
+
+
+def test_congestion_halves_the_limit_once_per_cooldown(monkeypatch):
+    clock = _FakeClock()
+    monkeypatch.setattr(request_scheduler.time, 'monotonic', clock)
+    scheduler = _scheduler(initial_concurrency=4)
+
+    with scheduler.request() as ticket:
+        ticket.record_response(_FakeResponse(429))
+    with scheduler.request() as ticket:
+        ticket.record_response(_FakeResponse(429))
+    stats = scheduler.stats()
+    assert stats['concurrency_limit'] == 2
+    assert stats['backoffs'] == 1 and stats['congestion_signals'] == 2
+    assert stats['last_backoff_reason'] == "HTTP 429"
+
+    clock.now += app_config.WFS_BACKOFF_COOLDOWN_SECONDS
+    with scheduler.request() as ticket:
+        ticket.record_response(_FakeResponse(503))
+    assert scheduler.stats()['concurrency_limit'] == 1
+
+
+def test_healthy_responses_raise_the_limit():
+    scheduler = _scheduler(initial_concurrency=2)
+
+    for _ in range(4):
+        with scheduler.request() as ticket:
+            ticket.record_response(_FakeResponse(200))
+    assert scheduler.stats()['concurrency_limit'] == 3
+
+
+def test_streamed_response_holds_its_slot_until_closed(monkeypatch):
+    scheduler = _scheduler()
+    fake_response = _FakeResponse()
+    monkeypatch.setattr(http_client, 'get_session', lambda **kwargs: _FakeSession([fake_response]))
+
+    resp = http_client.http_get("https://example.invalid/wfs", scheduler=scheduler, stream=True)
+    assert scheduler.stats()['in_flight'] == 1
+
+    resp.close()
+    resp.close()
+    assert fake_response.closed
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_streamed_response_releases_its_slot_when_read(monkeypatch):
+    scheduler = _scheduler()
+    session = _FakeSession([_FakeResponse(), _FakeResponse()])
+    monkeypatch.setattr(http_client, 'get_session', lambda **kwargs: session)
+
+    resp = http_client.http_get("https://example.invalid/wfs", scheduler=scheduler, stream=True)
+    assert b"".join(resp.iter_content(chunk_size=4)) == b"<wfs:FeatureCollection/>"
+    assert scheduler.stats()['in_flight'] == 0
+
+    resp = http_client.http_get("https://example.invalid/wfs", scheduler=scheduler, stream=True)
+    assert resp.content == b"<wfs:FeatureCollection/>"
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_scheduled_get_retries_congestion_through_the_scheduler(monkeypatch):
+    monkeypatch.setattr(http_client, '_status_backoff_seconds', lambda attempt, resp: 0)
+    scheduler = _scheduler(burst=8, initial_concurrency=4)
+    session = _FakeSession([_FakeResponse(429), _FakeResponse(200)])
+    monkeypatch.setattr(http_client, 'get_session', lambda **kwargs: session)
+
+    resp = http_client.http_get("https://example.invalid/wfs", scheduler=scheduler)
+    stats = scheduler.stats()
+    assert resp.status_code == 200
+    assert stats['requests'] == 2 and stats['backoffs'] == 1 and stats['in_flight'] == 0
+
+
+@pytest.mark.parametrize('processes, rate, burst, max_concurrency', [(1, 4.0, 8, 8), (4, 1.0, 2, 2), (16, 0.25, 1, 1)])
+def test_share_limits_splits_the_configured_limits(monkeypatch, processes, rate, burst, max_concurrency):
+    monkeypatch.setattr(app_config, 'WFS_RATE_LIMIT_PER_SECOND', 4.0)
+    monkeypatch.setattr(app_config, 'WFS_RATE_LIMIT_BURST', 8)
+    monkeypatch.setattr(app_config, 'WFS_MAX_CONCURRENCY', 8)
+    monkeypatch.setattr(app_config, 'WFS_INITIAL_CONCURRENCY', 2)
+    try:
+        request_scheduler.share_limits(processes)
+        scheduler = request_scheduler.get_scheduler()
+        assert (scheduler.rate_per_second, scheduler.burst, scheduler.max_concurrency) == (rate, burst, max_concurrency)
+        assert scheduler.stats()['concurrency_limit'] == min(2, max_concurrency)
+    finally:
+        request_scheduler.share_limits(1)
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+import pytest
+
+from nrw_geotools import config as app_config
+from nrw_geotools import response_cache
+
+URL = "https://example.invalid/wfs"
+
+
+class _FakeResponse:
+    def __init__(self, status_code=200, body=b"<wfs:FeatureCollection/>", headers=None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = {'content-type': 'text/xml', **(headers or {})}
+
+    def close(self):
+        pass
+
+
+class _FakeServer:
+    """Stands in for http_client.http_get: answers with the queued responses and records the requests."""
+
+    def __init__(self, *responses, delay=0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.requests = []
+
+    def __call__(self, url, params=None, timeout=None, headers=None, **kwargs):
+        self.requests.append((params, headers))
+        time.sleep(self.delay)
+        return self.responses.pop(0)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_ENABLED', True)
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(response_cache, '_index', None)
+    return tmp_path
+
+
+def _serve(monkeypatch, *responses, delay=0):
+    server = _FakeServer(*responses, delay=delay)
+    monkeypatch.setattr(response_cache.http_client, 'http_get', server)
+    return server
+
+
+def test_second_request_is_a_hit(monkeypatch):
+    server = _serve(monkeypatch, _FakeResponse(body=b"page 1"))
+
+    first, first_status = response_cache.cached_get(URL, {'startIndex': 0})
+    second, second_status = response_cache.cached_get(URL, {'STARTINDEX': '0'})
+
+    assert (first_status, second_status) == (response_cache.CACHE_MISS, response_cache.CACHE_HIT)
+    assert second.content == b"page 1" and second.headers['content-type'] == 'text/xml'
+    assert len(server.requests) == 1
+
+
+def test_rejected_body_is_not_stored(monkeypatch):
+    server = _serve(monkeypatch, _FakeResponse(body=b"<ows:ExceptionReport/>"), _FakeResponse(body=b"page 1"))
+
+    response_cache.cached_get(URL, {'startIndex': 0}, is_cacheable=lambda resp: b"Exception" not in resp.content)
+    _, status = response_cache.cached_get(URL, {'startIndex': 0})
+
+    assert status == response_cache.CACHE_MISS and len(server.requests) == 2
+
+
+def test_stale_entry_is_revalidated(monkeypatch):
+    server = _serve(monkeypatch, _FakeResponse(body=b"page 1", headers={'ETag': '"v1"'}), _FakeResponse(304))
+    response_cache.cached_get(URL, {'startIndex': 0})
+
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_TTL_SECONDS', 0)
+    resp, status = response_cache.cached_get(URL, {'startIndex': 0})
+
+    assert status == response_cache.CACHE_REVALIDATED and resp.content == b"page 1"
+    assert server.requests[1][1] == {'If-None-Match': '"v1"'}
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_TTL_SECONDS', 3600)
+    assert response_cache.cached_get(URL, {'startIndex': 0})[1] == response_cache.CACHE_HIT
+
+
+def test_stale_entry_is_replaced_when_changed(monkeypatch):
+    _serve(monkeypatch, _FakeResponse(body=b"old"), _FakeResponse(body=b"new"))
+    response_cache.cached_get(URL, {'startIndex': 0})
+
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_TTL_SECONDS', 0)
+    resp, status = response_cache.cached_get(URL, {'startIndex': 0})
+    assert status == response_cache.CACHE_MISS and resp.content == b"new"
+
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_TTL_SECONDS', 3600)
+    assert response_cache.cached_get(URL, {'startIndex': 0})[0].content == b"new"
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch, cache_dir):
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_MAX_BYTES', 250)
+    _serve(monkeypatch, *[_FakeResponse(body=bytes([index]) * 100) for index in range(3)])
+    for index in range(2):
+        response_cache.cached_get(URL, {'startIndex': index})
+    # Entry 0 was used more recently than entry 1, so entry 1 goes when entry 2 comes in.
+    os.utime(cache_dir / f"{response_cache.make_cache_key(URL, {'startIndex': 1})}.body", (1, 1))
+    assert response_cache.cached_get(URL, {'startIndex': 0})[1] == response_cache.CACHE_HIT
+    response_cache.cached_get(URL, {'startIndex': 2})
+
+    stored = {path.name for path in cache_dir.iterdir() if path.suffix == '.body'}
+    assert stored == {f"{response_cache.make_cache_key(URL, {'startIndex': index})}.body" for index in (0, 2)}
+
+
+def test_eviction_sees_entries_of_other_processes(monkeypatch, cache_dir):
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_MAX_BYTES', 250)
+    _serve(monkeypatch, *[_FakeResponse(body=b"x" * 100) for _ in range(2)])
+    response_cache.cached_get(URL, {'startIndex': 0})
+    # Another process stored an entry this one has not indexed; it is the oldest.
+    (cache_dir / "other.json").write_text('{}')
+    (cache_dir / "other.body").write_bytes(b"y" * 100)
+    os.utime(cache_dir / "other.body", (1, 1))
+
+    monkeypatch.setattr(app_config, 'RESPONSE_CACHE_RESCAN_WRITES', 1)
+    response_cache.cached_get(URL, {'startIndex': 1})
+    assert not (cache_dir / "other.body").exists()
+
+
+def test_half_installed_entry_is_a_miss_and_stays(monkeypatch, cache_dir):
+    server = _serve(monkeypatch, _FakeResponse(body=b"page 1"))
+    body_path, meta_path = response_cache._entry_paths(response_cache.make_cache_key(URL, {'startIndex': 0}))
+    # Another process has put the body in place but not yet its meta.
+    with open(body_path, 'wb') as f_body:
+        f_body.write(b"page 1")
+
+    assert response_cache._read_entry(response_cache.make_cache_key(URL, {'startIndex': 0})) == (None, None)
+    assert os.path.exists(body_path)
+    response_cache.cached_get(URL, {'startIndex': 0})
+    assert os.path.exists(meta_path) and len(server.requests) == 1
+
+
+def test_identical_requests_are_coalesced(monkeypatch):
+    server = _serve(monkeypatch, _FakeResponse(body=b"page 1"), delay=0.2)
+    statuses = []
+
+    def fetch():
+        statuses.append(response_cache.cached_get(URL, {'startIndex': 0})[1])
+
+    threads = [threading.Thread(target=fetch) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(server.requests) == 1
+    assert sorted(statuses) == sorted([response_cache.CACHE_MISS] + [response_cache.CACHE_COALESCED] * 2)